@@ -0,0 +1,376 @@
+"""
+Approximate analysis module for Violation State study.
+
+For quick health checks on very large corpora, this module estimates the
+primary statistics from a reproducible, condition-stratified sample of
+threads instead of parsing every transcript.
+
+Threads are sampled before parsing: each condition's transcript files are
+shuffled once with a seeded generator, and the sample is always a prefix of
+that order. Growing the sample therefore only parses the newly added
+threads, and the same seed always yields the same sample.
+
+Reported bounds account for sampling:
+    - Refusal rates use a Wilson score interval on the effective number of
+      prompts. Prompts within a thread are correlated, so the prompt count
+      is deflated by the design effect estimated from between-thread
+      variation, and inflated by the finite population correction so the
+      interval shrinks to the exact rate once the whole corpus is sampled.
+    - Cohen's h and the Fisher p-value are bounded by their values at the
+      corners of the two conditions' rate intervals, each taken at the
+      Sidak-adjusted level sqrt(confidence) so the pair covers both true
+      rates jointly with the requested confidence. The p-value is the one
+      a full run would report: rates are projected onto the full corpus
+      size before testing.
+"""
+
+import math
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from batch_stats import cohen_h_batch, fisher_exact_batch
+from classify_responses import CLASSIFICATION_COLUMNS, classify_conversations
+from factor_stats import IMAGE_PROMPTS, compute_final_outcomes
+from parse_transcripts import MANIFEST_FILENAME, find_transcript_files, load_manifest, parse_single_transcript
+
+CONDITIONS = ["control", "contaminated"]
+
+
+def list_transcript_files(data_dir: str) -> Dict[str, List[Path]]:
+    """
+    List transcript files per condition without parsing them.
+
+    Args:
+        data_dir: Directory containing transcripts/control/ and transcripts/contaminated/
+
+    Returns:
+        Dictionary mapping condition to its transcript paths (filename order)
+    """
+    files = {}
+    for condition in CONDITIONS:
+        condition_dir = Path(data_dir) / "transcripts" / condition
+        files[condition] = find_transcript_files(condition_dir) if condition_dir.exists() else []
+    return files
+
+
+def sampling_order(files_by_condition: Dict[str, List[Path]], seed: int) -> Dict[str, List[Path]]:
+    """
+    Shuffle each condition's files reproducibly.
+
+    A sample of size n from a condition is the first n files of its order,
+    so samples for the same seed are nested.
+
+    Args:
+        files_by_condition: Output of list_transcript_files()
+        seed: Random seed
+
+    Returns:
+        Dictionary mapping condition to its shuffled file list
+    """
+    ordered = {}
+    for stratum, condition in enumerate(sorted(files_by_condition)):
+        files = files_by_condition[condition]
+        rng = np.random.default_rng([seed, stratum])
+        ordered[condition] = [files[i] for i in rng.permutation(len(files))]
+    return ordered
+
+
+def thread_refusal_counts(conversations: List[Dict]) -> Dict[str, np.ndarray]:
+    """
+    Per-thread image prompt and refusal counts (final outcomes).
+
+    Args:
+        conversations: Parsed conversations
+
+    Returns:
+        Dictionary mapping condition to an (n_threads, 2) array of
+        [n_image_prompts, n_refusals] rows, in the order given
+    """
+    turns = pd.DataFrame(classify_conversations(conversations), columns=CLASSIFICATION_COLUMNS)
+    outcomes = compute_final_outcomes(turns, IMAGE_PROMPTS)
+    per_thread = outcomes.groupby("thread_id")["refused"].agg(["size", "sum"])
+
+    counts = {condition: [] for condition in CONDITIONS}
+    for conv in conversations:
+        if conv["condition"] not in counts:
+            continue
+        if conv["thread_id"] in per_thread.index:
+            row = per_thread.loc[conv["thread_id"]]
+            counts[conv["condition"]].append([int(row["size"]), int(row["sum"])])
+        else:
+            counts[conv["condition"]].append([0, 0])
+
+    return {condition: np.array(rows, dtype=np.int64).reshape(-1, 2)
+            for condition, rows in counts.items()}
+
+
+def wilson_interval(rate: float, n_effective: float, confidence: float):
+    """
+    Wilson score interval for a proportion.
+
+    Args:
+        rate: Observed proportion
+        n_effective: Effective number of independent trials (infinite
+            when the whole population has been observed)
+        confidence: Two-sided confidence level
+
+    Returns:
+        Tuple (lower, upper)
+    """
+    if n_effective <= 0:
+        return 0.0, 1.0
+    if math.isinf(n_effective):
+        return rate, rate
+
+    z = norm.ppf(0.5 + confidence / 2)
+    denominator = 1 + z ** 2 / n_effective
+    center = (rate + z ** 2 / (2 * n_effective)) / denominator
+    half_width = z * math.sqrt(rate * (1 - rate) / n_effective + z ** 2 / (4 * n_effective ** 2)) / denominator
+    return max(0.0, center - half_width), min(1.0, center + half_width)
+
+
+def estimate_from_sample(counts: Dict[str, np.ndarray], population: Dict[str, int],
+                         confidence: float = 0.95) -> Dict:
+    """
+    Estimate refusal rates, Cohen's h and Fisher p-value with sampling bounds.
+
+    Args:
+        counts: Output of thread_refusal_counts() for the sampled threads
+        population: Number of threads per condition in the full corpus
+        confidence: Two-sided confidence level for all bounds
+
+    Returns:
+        Dictionary with per-condition entries (threads_sampled,
+        threads_total, prompts_sampled, refusals_sampled, refusal_rate,
+        rate_lower, rate_upper) and cohen_h, p_value, each with
+        _lower/_upper bounds
+    """
+    joint_confidence = math.sqrt(confidence)
+    estimate = {}
+    joint_bounds = {}
+    projected_prompts = {}
+
+    for condition in CONDITIONS:
+        sample = counts[condition]
+        n_threads = len(sample)
+        n_total = population[condition]
+        prompts = int(sample[:, 0].sum())
+        refusals = int(sample[:, 1].sum())
+        rate = refusals / prompts if prompts > 0 else float("nan")
+        n_effective = effective_prompts(sample, n_total)
+
+        if prompts > 0:
+            lower, upper = wilson_interval(rate, n_effective, confidence)
+            joint_bounds[condition] = wilson_interval(rate, n_effective, joint_confidence)
+        else:
+            lower, upper = 0.0, 1.0
+            joint_bounds[condition] = (0.0, 1.0)
+
+        estimate[condition] = {
+            "threads_sampled": n_threads,
+            "threads_total": n_total,
+            "prompts_sampled": prompts,
+            "refusals_sampled": refusals,
+            "refusal_rate": rate,
+            "rate_lower": lower,
+            "rate_upper": upper,
+        }
+
+        # Full-corpus prompt count projected from the sampled prompts per thread
+        projected_prompts[condition] = int(round(prompts / n_threads * n_total)) if n_threads else 0
+
+    control_rate = estimate["control"]["refusal_rate"]
+    contaminated_rate = estimate["contaminated"]["refusal_rate"]
+    control_low, control_high = joint_bounds["control"]
+    contaminated_low, contaminated_high = joint_bounds["contaminated"]
+
+    # Evaluate at the point estimate and the two extreme corners of the joint box:
+    # smallest and largest contaminated-minus-control difference.
+    control_rates = np.array([control_rate, control_high, control_low])
+    contaminated_rates = np.array([contaminated_rate, contaminated_low, contaminated_high])
+    h_values = cohen_h_batch(contaminated_rates, control_rates)
+    p_values = _projected_p_values(control_rates, contaminated_rates, projected_prompts)
+
+    estimate["cohen_h"] = float(h_values[0])
+    estimate["cohen_h_lower"] = float(h_values[1])
+    estimate["cohen_h_upper"] = float(h_values[2])
+    estimate["p_value"] = float(p_values[0])
+    estimate["p_value_lower"] = float(min(p_values[1:]))
+    estimate["p_value_upper"] = float(max(p_values[1:]))
+    estimate["confidence"] = confidence
+    return estimate
+
+
+def effective_prompts(sample: np.ndarray, n_total: int) -> float:
+    """
+    Effective number of independent prompts in a sample of threads.
+
+    Args:
+        sample: (n_threads, 2) array of [n_image_prompts, n_refusals]
+        n_total: Number of threads in the population
+
+    Returns:
+        Prompt count divided by the design effect of the ratio estimator
+        and by the finite population correction (infinite when every
+        thread has been sampled)
+    """
+    n_threads = len(sample)
+    if n_total <= 0 or n_threads >= n_total:
+        return math.inf
+
+    prompts = sample[:, 0].sum()
+    refusals = sample[:, 1].sum()
+    if prompts == 0:
+        return 0.0
+    rate = refusals / prompts
+
+    # Design effect: cluster (thread-level) variance of the ratio estimator
+    # relative to the binomial variance of independent prompts
+    deff = 1.0
+    if n_threads > 1 and 0 < rate < 1:
+        mean_prompts = prompts / n_threads
+        residuals = sample[:, 1] - rate * sample[:, 0]
+        cluster_var = (residuals ** 2).sum() / (n_threads * (n_threads - 1) * mean_prompts ** 2)
+        deff = max(1.0, cluster_var / (rate * (1 - rate) / prompts))
+
+    sampling_fraction = n_threads / n_total
+    return prompts / deff / (1 - sampling_fraction)
+
+
+def _projected_p_values(control_rate: np.ndarray, contaminated_rate: np.ndarray,
+                        projected_prompts: Dict[str, int]) -> np.ndarray:
+    """Fisher p-values of full-corpus tables implied by the given refusal rates."""
+    control_n = projected_prompts["control"]
+    contaminated_n = projected_prompts["contaminated"]
+    control_refusals = np.rint(np.nan_to_num(control_rate) * control_n).astype(np.int64)
+    contaminated_refusals = np.rint(np.nan_to_num(contaminated_rate) * contaminated_n).astype(np.int64)
+    return fisher_exact_batch(control_n - control_refusals, control_refusals,
+                              contaminated_n - contaminated_refusals, contaminated_refusals)
+
+
+def approximate_analysis(base_dir: str, precision: float = 0.02, confidence: float = 0.95,
+                         initial_per_condition: int = 20, growth: float = 2.0,
+                         seed: int = 0, max_per_condition: Optional[int] = None) -> Dict:
+    """
+    Estimate the primary statistics from an adaptively grown stratified sample.
+
+    Starting from initial_per_condition threads per condition, the sample
+    is grown by the growth factor until the refusal rate confidence
+    intervals of both conditions have half-width at most precision, or the
+    whole corpus (or max_per_condition) has been sampled.
+
+    Args:
+        base_dir: Base directory containing the data/ folder
+        precision: Target half-width of the refusal rate intervals
+        confidence: Two-sided confidence level for all bounds
+        initial_per_condition: Threads per condition in the first round (>= 1)
+        growth: Factor by which the sample grows each round (> 1)
+        seed: Random seed for sampling
+        max_per_condition: Optional cap on threads sampled per condition
+
+    Returns:
+        Output of estimate_from_sample() for the final sample, plus
+        "rounds" (list of per-round sample sizes and worst half-width)
+        and "converged" (bool)
+    """
+    if growth <= 1:
+        raise ValueError("growth must be greater than 1")
+    if initial_per_condition < 1:
+        raise ValueError("initial_per_condition must be at least 1")
+
+    data_dir = Path(base_dir) / "data"
+    files = list_transcript_files(str(data_dir))
+    population = {condition: len(paths) for condition, paths in files.items()}
+    order = sampling_order(files, seed)
+
+    manifest_path = data_dir / "transcripts" / MANIFEST_FILENAME
+    manifest = load_manifest(str(manifest_path)) if manifest_path.exists() else {}
+
+    sampled_counts = {condition: np.zeros((0, 2), dtype=np.int64) for condition in CONDITIONS}
+    target = initial_per_condition
+    rounds = []
+
+    while True:
+        # Parse only the threads added to the sample this round
+        new_conversations = []
+        for condition in CONDITIONS:
+            limit = min(target, population[condition])
+            if max_per_condition is not None:
+                limit = min(limit, max_per_condition)
+            for path in order[condition][len(sampled_counts[condition]):limit]:
+                conv = parse_single_transcript(str(path), manifest.get(path.stem))
+                # Stratum membership is fixed by directory at sampling time
+                conv["condition"] = condition
+                new_conversations.append(conv)
+
+        new_counts = thread_refusal_counts(new_conversations)
+        for condition in CONDITIONS:
+            sampled_counts[condition] = np.vstack([sampled_counts[condition], new_counts[condition]])
+
+        estimate = estimate_from_sample(sampled_counts, population, confidence)
+        half_width = max((estimate[c]["rate_upper"] - estimate[c]["rate_lower"]) / 2 for c in CONDITIONS)
+        rounds.append({
+            "control": len(sampled_counts["control"]),
+            "contaminated": len(sampled_counts["contaminated"]),
+            "half_width": half_width,
+        })
+
+        exhausted = all(
+            len(sampled_counts[c]) >= (population[c] if max_per_condition is None
+                                       else min(population[c], max_per_condition))
+            for c in CONDITIONS
+        )
+        converged = half_width <= precision
+        if converged or exhausted:
+            break
+        target = int(math.ceil(target * growth))
+
+    estimate["rounds"] = rounds
+    estimate["converged"] = converged
+    estimate["precision"] = precision
+    return estimate
+
+
+def format_approximate_report(estimate: Dict) -> str:
+    """
+    Format the approximate analysis for the console.
+
+    Args:
+        estimate: Output of approximate_analysis()
+
+    Returns:
+        Multi-line report text
+    """
+    confidence = estimate["confidence"]
+    lines = [
+        f"APPROXIMATE ANALYSIS (stratified sample, {confidence:.0%} bounds)",
+        "-" * 70,
+    ]
+    for condition in CONDITIONS:
+        s = estimate[condition]
+        lines.append(
+            f"{condition.capitalize()}: {s['threads_sampled']}/{s['threads_total']} threads sampled, "
+            f"refusal rate {s['refusal_rate']:.2%} [{s['rate_lower']:.2%}, {s['rate_upper']:.2%}]"
+        )
+    lines += [
+        f"Cohen's h: {estimate['cohen_h']:.2f} [{estimate['cohen_h_lower']:.2f}, {estimate['cohen_h_upper']:.2f}]",
+        f"Fisher p-value (projected to full corpus): {estimate['p_value']:.2e} "
+        f"[{estimate['p_value_lower']:.2e}, {estimate['p_value_upper']:.2e}]",
+        "",
+        "Sampling rounds:",
+    ]
+    for i, r in enumerate(estimate["rounds"], 1):
+        lines.append(f"  {i}: control={r['control']}, contaminated={r['contaminated']}, "
+                     f"max rate half-width={r['half_width']:.3f}")
+    status = "reached" if estimate["converged"] else "not reached (corpus or cap exhausted)"
+    lines.append(f"Target precision ±{estimate['precision']:.3f} {status}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    repo_root = Path(__file__).parent.parent
+    print(format_approximate_report(approximate_analysis(str(repo_root), initial_per_condition=5)))
@@ -0,0 +1,370 @@
+"""
+Run comparison module for Violation State study.
+
+After data is re-collected or the classifier is revised, this module reports
+exactly what changed between two analysis runs: which exchanges changed
+classification, which prompts changed final outcome, which threads changed
+counts, how per-condition refusal rates shifted, and whether the test
+results changed.
+
+The comparison is a partitioned (Grace) hash join, so memory stays bounded
+however large the runs are:
+
+1. Each run's parsed_turns.csv, thread_summary.csv and final_outcomes.csv are
+   read in chunks and rows are routed to partition files by a hash of their
+   thread_id. All rows of a thread, in both runs and all three tables, land
+   in the same partition.
+2. Each partition is loaded for both runs, joined on the table keys
+   ((thread_id, prompt_id, user_turn_index) for exchanges, (thread_id,
+   prompt_id) for final outcomes, thread_id for threads), and diffed.
+   Per-condition counts for the statistics are accumulated as partitions
+   are processed.
+
+Inputs that fit in the memory budget are joined directly in one partition.
+Values are compared as text, exactly as written to the CSVs.
+"""
+
+import math
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from factor_stats import compute_final_outcomes
+from run_analysis import (
+    all_attempt_counts,
+    first_attempt_counts,
+    summary_stats_from_counts
+)
+
+# Key and compared columns of each run output
+RUN_TABLES = {
+    "parsed_turns": {
+        "filename": "parsed_turns.csv",
+        "key": ["thread_id", "prompt_id", "user_turn_index"],
+        "compare": ["condition", "response_class"],
+    },
+    "final_outcomes": {
+        "filename": "final_outcomes.csv",
+        "key": ["thread_id", "prompt_id"],
+        "compare": ["condition", "response_class", "n_attempts", "refused"],
+    },
+    "thread_summary": {
+        "filename": "thread_summary.csv",
+        "key": ["thread_id"],
+        "compare": [
+            "condition", "n_image_prompts", "n_image_policy_refusals",
+            "n_image_capability_refusals", "n_image_success", "n_rate_limit",
+            "n_t1_prompts", "n_t1_refusals",
+        ],
+    },
+}
+
+RUN_LABELS = ("a", "b")
+
+# Rough in-memory size of a parsed CSV row relative to its size on disk
+MEMORY_PER_CSV_BYTE = 4
+
+DEFAULT_MEMORY_BUDGET_MB = 256
+DEFAULT_CHUNK_ROWS = 100_000
+DEFAULT_MAX_EXAMPLES = 20
+
+SIGNIFICANCE_LEVEL = 0.05
+
+
+def run_table_paths(run_dir: str) -> Dict[str, Optional[Path]]:
+    """
+    Locate the outputs of an analysis run.
+
+    Args:
+        run_dir: Directory holding parsed_turns.csv and thread_summary.csv,
+            and optionally final_outcomes.csv (e.g., data/processed)
+
+    Returns:
+        Dictionary mapping table name to its path, or None for a missing
+        final_outcomes.csv (it is then derived from parsed_turns)
+    """
+    paths = {}
+    for table, spec in RUN_TABLES.items():
+        path = Path(run_dir) / spec["filename"]
+        if not path.exists():
+            if table == "final_outcomes":
+                path = None
+            else:
+                raise FileNotFoundError(f"{path} not found")
+        paths[table] = path
+    return paths
+
+
+def read_run_csv(path, chunk_rows: Optional[int] = None):
+    """Read a run output as text, so values compare exactly as written."""
+    return pd.read_csv(path, dtype=str, keep_default_na=False, chunksize=chunk_rows)
+
+
+def partition_csv(path: Path, n_partitions: int, out_dir: Path, chunk_rows: int) -> List[Path]:
+    """
+    Split a CSV into partition files by a hash of thread_id.
+
+    Row order is preserved within each partition.
+
+    Args:
+        path: CSV file with a thread_id column
+        n_partitions: Number of partitions
+        out_dir: Directory for the partition files
+        chunk_rows: Rows read per chunk
+
+    Returns:
+        Paths of the partition files (missing if a partition is empty)
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    partition_paths = [out_dir / f"{path.stem}.{i}.csv" for i in range(n_partitions)]
+    started = [False] * n_partitions
+
+    for chunk in read_run_csv(path, chunk_rows):
+        hashes = pd.util.hash_pandas_object(chunk["thread_id"], index=False).to_numpy()
+        partition = hashes % np.uint64(n_partitions)
+        for i in np.unique(partition):
+            chunk[partition == i].to_csv(partition_paths[i], mode="a" if started[i] else "w",
+                                         header=not started[i], index=False)
+            started[i] = True
+
+    return partition_paths
+
+
+def diff_table(frame_a: pd.DataFrame, frame_b: pd.DataFrame, key: List[str],
+               compare: List[str]) -> pd.DataFrame:
+    """
+    Join two versions of a table on its key and keep rows that differ.
+
+    Args:
+        frame_a: Rows from run a (text columns)
+        frame_b: Rows from run b (text columns)
+        key: Join key columns
+        compare: Columns compared between runs
+
+    Returns:
+        DataFrame with the key columns, a change column ("changed", "added"
+        or "removed") and <column>_a / <column>_b for each compared column
+    """
+    merged = frame_a[key + compare].merge(frame_b[key + compare], on=key, how="outer",
+                                          suffixes=("_a", "_b"), indicator=True)
+
+    differs = np.zeros(len(merged), dtype=bool)
+    for column in compare:
+        differs |= (merged[f"{column}_a"] != merged[f"{column}_b"]).to_numpy()
+
+    change = np.select(
+        [merged["_merge"] == "left_only", merged["_merge"] == "right_only"],
+        ["removed", "added"], default="changed"
+    )
+    merged.insert(len(key), "change", change)
+    merged = merged[(merged["_merge"] != "both") | differs].drop(columns="_merge")
+    return merged
+
+
+def _derive_final_outcomes(turns: pd.DataFrame) -> pd.DataFrame:
+    """Final outcomes (as text) from text-typed parsed turns."""
+    turns = turns.replace({"prompt_id": {"": np.nan}})
+    final = compute_final_outcomes(turns)
+    return final.astype(str)
+
+
+def _load_partition(paths: Dict[str, Optional[Path]]) -> Dict[str, pd.DataFrame]:
+    """Load one run's tables for a partition (empty frames for empty partitions)."""
+    frames = {}
+    for table, spec in RUN_TABLES.items():
+        path = paths.get(table)
+        if path is not None and path.exists():
+            frames[table] = read_run_csv(path)
+        else:
+            frames[table] = pd.DataFrame(columns=spec["key"] + spec["compare"], dtype=str)
+
+    if paths.get("final_outcomes") is None:
+        frames["final_outcomes"] = _derive_final_outcomes(frames["parsed_turns"])
+    return frames
+
+
+def _add_counts(total: Dict[str, Dict[str, int]], counts: Dict[str, Dict[str, int]]) -> None:
+    """Accumulate per-condition counts in place."""
+    for condition, values in counts.items():
+        condition_total = total.setdefault(condition, {})
+        for name, value in values.items():
+            condition_total[name] = condition_total.get(name, 0) + value
+
+
+def _typed_final_outcomes(frame: pd.DataFrame) -> pd.DataFrame:
+    return frame.assign(refused=frame["refused"] == "True")
+
+
+def _typed_thread_summary(frame: pd.DataFrame) -> pd.DataFrame:
+    count_columns = [c for c in RUN_TABLES["thread_summary"]["compare"] if c != "condition"]
+    return frame.astype({column: np.int64 for column in count_columns})
+
+
+def compare_runs(run_a: str, run_b: str, memory_budget_mb: float = DEFAULT_MEMORY_BUDGET_MB,
+                 chunk_rows: int = DEFAULT_CHUNK_ROWS, max_examples: int = DEFAULT_MAX_EXAMPLES,
+                 output_dir: Optional[str] = None) -> Dict:
+    """
+    Compare the outputs of two analysis runs.
+
+    Args:
+        run_a: Output directory of the baseline run
+        run_b: Output directory of the new run
+        memory_budget_mb: Approximate memory budget for the join; inputs
+            larger than this are partitioned on disk
+        chunk_rows: Rows read per chunk when partitioning
+        max_examples: Changed rows kept per table for the report
+        output_dir: If given, every changed row of each table is written to
+            <output_dir>/<table>_changes.csv
+
+    Returns:
+        Dictionary with:
+            - n_partitions: Number of partitions used
+            - changes: Per table, counts of changed/added/removed rows and
+              an "examples" DataFrame of up to max_examples changed rows
+            - stats_a, stats_b: Summary statistics of each run (see
+              compute_summary_stats())
+    """
+    paths = {label: run_table_paths(run) for label, run in zip(RUN_LABELS, (run_a, run_b))}
+    input_bytes = sum(path.stat().st_size for run_paths in paths.values()
+                      for path in run_paths.values() if path is not None)
+    n_partitions = max(1, math.ceil(input_bytes * MEMORY_PER_CSV_BYTE / (memory_budget_mb * 2 ** 20)))
+
+    work_dir = Path(tempfile.mkdtemp(prefix="compare_runs_")) if n_partitions > 1 else None
+    try:
+        if work_dir is None:
+            partitions = [paths]
+        else:
+            split = {
+                label: {table: (partition_csv(path, n_partitions, work_dir / label, chunk_rows)
+                                if path is not None else [None] * n_partitions)
+                        for table, path in run_paths.items()}
+                for label, run_paths in paths.items()
+            }
+            partitions = [
+                {label: {table: split[label][table][i] for table in RUN_TABLES} for label in RUN_LABELS}
+                for i in range(n_partitions)
+            ]
+
+        if output_dir is not None:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+
+        changes = {table: {"changed": 0, "added": 0, "removed": 0, "examples": []}
+                   for table in RUN_TABLES}
+        first_counts = {label: {} for label in RUN_LABELS}
+        all_counts = {label: {} for label in RUN_LABELS}
+        written = set()
+
+        for partition in partitions:
+            frames = {label: _load_partition(partition[label]) for label in RUN_LABELS}
+
+            for label in RUN_LABELS:
+                _add_counts(first_counts[label], first_attempt_counts(
+                    _typed_final_outcomes(frames[label]["final_outcomes"])))
+                _add_counts(all_counts[label], all_attempt_counts(
+                    _typed_thread_summary(frames[label]["thread_summary"])))
+
+            for table, spec in RUN_TABLES.items():
+                diff = diff_table(frames["a"][table], frames["b"][table], spec["key"], spec["compare"])
+                if diff.empty:
+                    continue
+
+                summary = changes[table]
+                for change, count in diff["change"].value_counts().items():
+                    summary[change] += int(count)
+                kept = sum(len(example) for example in summary["examples"])
+                if kept < max_examples:
+                    summary["examples"].append(diff.head(max_examples - kept))
+
+                if output_dir is not None:
+                    diff.to_csv(Path(output_dir) / f"{table}_changes.csv",
+                                mode="a" if table in written else "w",
+                                header=table not in written, index=False)
+                    written.add(table)
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    for summary in changes.values():
+        summary["examples"] = (pd.concat(summary["examples"], ignore_index=True)
+                               if summary["examples"] else pd.DataFrame())
+
+    return {
+        "n_partitions": n_partitions,
+        "changes": changes,
+        "stats_a": summary_stats_from_counts(first_counts["a"], all_counts["a"]),
+        "stats_b": summary_stats_from_counts(first_counts["b"], all_counts["b"]),
+    }
+
+
+def format_comparison_report(comparison: Dict) -> str:
+    """
+    Format the result of compare_runs() for the console.
+
+    Args:
+        comparison: Output of compare_runs()
+
+    Returns:
+        Multi-line report text
+    """
+    lines = [
+        "RUN COMPARISON (a = baseline, b = new)",
+        "-" * 70,
+    ]
+
+    for table, summary in comparison["changes"].items():
+        lines.append(f"{table}: {summary['changed']} changed, {summary['added']} added, "
+                     f"{summary['removed']} removed")
+        if len(summary["examples"]):
+            lines.append(summary["examples"].to_string(index=False))
+            lines.append("")
+
+    for analysis, title in [("first_attempts", "PRIMARY (final outcomes)"),
+                            ("all_attempts", "SECONDARY (all attempts)")]:
+        a = comparison["stats_a"][analysis]
+        b = comparison["stats_b"][analysis]
+        lines += ["", f"{title}:"]
+        for condition in ["control", "contaminated"]:
+            ca, cb = a[condition], b[condition]
+            lines.append(
+                f"  {condition.capitalize()} refusal rate: {ca['refusal_rate']:.2%} -> {cb['refusal_rate']:.2%} "
+                f"({ca['refusals']}/{ca['evaluable']} -> {cb['refusals']}/{cb['evaluable']}, "
+                f"shift {cb['refusal_rate'] - ca['refusal_rate']:+.2%})"
+            )
+        lines.append(f"  Odds ratio: {a['odds_ratio']:.2f} -> {b['odds_ratio']:.2f}")
+        lines.append(f"  Fisher p-value: {a['p_value']:.2e} -> {b['p_value']:.2e}")
+        lines.append(f"  Cohen's h: {a['cohen_h']:.2f} -> {b['cohen_h']:.2f}")
+
+        significant_a = a["p_value"] < SIGNIFICANCE_LEVEL
+        significant_b = b["p_value"] < SIGNIFICANCE_LEVEL
+        if significant_a != significant_b:
+            lines.append(f"  Significance at alpha = {SIGNIFICANCE_LEVEL} changed: "
+                         f"{'significant' if significant_a else 'not significant'} -> "
+                         f"{'significant' if significant_b else 'not significant'}")
+        else:
+            lines.append(f"  Significance at alpha = {SIGNIFICANCE_LEVEL} unchanged "
+                         f"({'significant' if significant_b else 'not significant'})")
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare the outputs of two analysis runs.")
+    parser.add_argument("run_a", help="Output directory of the baseline run (e.g., data/processed)")
+    parser.add_argument("run_b", help="Output directory of the new run")
+    parser.add_argument("--memory-mb", type=float, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help="Approximate memory budget for the join")
+    parser.add_argument("--max-examples", type=int, default=DEFAULT_MAX_EXAMPLES,
+                        help="Changed rows shown per table")
+    parser.add_argument("--output-dir", default=None,
+                        help="Write every changed row to <output-dir>/<table>_changes.csv")
+    args = parser.parse_args()
+
+    comparison = compare_runs(args.run_a, args.run_b, memory_budget_mb=args.memory_mb,
+                              max_examples=args.max_examples, output_dir=args.output_dir)
+    print(format_comparison_report(comparison))
@@ -0,0 +1,359 @@
+"""
+Packed corpus module for Violation State study.
+
+Opening tens of thousands of small transcript files is dominated by
+filesystem metadata calls, especially on network storage. This module packs
+a transcript directory into a single binary corpus file and loads threads
+straight from a memory mapping of it.
+
+File layout (all integers little-endian)::
+
+    magic      8 bytes   b"VSCORPUS"
+    version    uint32
+    index_at   uint64    byte offset of the index
+    index_len  uint64    byte length of the index
+    data                 concatenated UTF-8 transcripts, as stored on disk
+    index                UTF-8 JSON list, one entry per thread
+
+Each index entry holds thread_id, condition, format, metadata (the manifest
+row, if any), offset and length of the transcript within the file, and its
+SHA-256. When packed with turn boundaries, an entry also holds the
+transcript's front matter and, for each turn, its speaker and the byte
+ranges (relative to the transcript) whose lines make up the turn text, so
+loading skips parsing entirely. Threads whose turn text cannot be expressed
+as ranges of the raw file (e.g., HTML pages) are stored without boundaries
+and parsed from the mapping on load.
+"""
+
+import hashlib
+import io
+import json
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from parse_transcripts import (
+    MANIFEST_FILENAME,
+    build_conversation,
+    find_transcript_files,
+    load_manifest
+)
+from transcript_formats import SNIFF_BYTES, detect_format, get_format
+
+PACK_MAGIC = b"VSCORPUS"
+PACK_VERSION = 1
+PACK_HEADER = struct.Struct("<8sIQQ")
+
+DEFAULT_PACK_FILENAME = "corpus.pack"
+
+
+def pack_corpus(data_dir: str, output_path: str, turn_boundaries: bool = True) -> int:
+    """
+    Pack a transcript directory into a single corpus file.
+
+    Threads are stored in the order load_all_conversations() reads them
+    (control, then contaminated, each in filename order). If
+    transcripts/manifest.csv exists, its rows are stored as per-thread
+    metadata.
+
+    Args:
+        data_dir: Directory containing transcripts/control/ and transcripts/contaminated/
+        output_path: Path of the corpus file to write
+        turn_boundaries: Parse each transcript at pack time and store its
+            turn boundaries, so loading does not need to parse
+
+    Returns:
+        Number of threads packed
+    """
+    transcripts_dir = Path(data_dir) / "transcripts"
+    manifest_path = transcripts_dir / MANIFEST_FILENAME
+    manifest = load_manifest(str(manifest_path)) if manifest_path.exists() else {}
+
+    paths = []
+    for condition in ("control", "contaminated"):
+        condition_dir = transcripts_dir / condition
+        if condition_dir.exists():
+            paths.extend(find_transcript_files(condition_dir))
+
+    index = []
+    with open(output_path, "wb") as out:
+        out.write(b"\0" * PACK_HEADER.size)
+        offset = PACK_HEADER.size
+
+        for path in paths:
+            raw = path.read_bytes()
+            thread_id = path.stem
+            metadata = manifest.get(thread_id, {})
+            fmt = detect_format(raw[:SNIFF_BYTES], path.suffix)
+            front_matter, turns = fmt.parse(io.StringIO(raw.decode("utf-8"), newline=None))
+            conv = build_conversation(thread_id, turns, front_matter, metadata, fmt.name)
+
+            entry = {
+                "thread_id": thread_id,
+                "condition": conv["condition"],
+                "format": fmt.name,
+                "metadata": metadata,
+                "offset": offset,
+                "length": len(raw),
+                "sha256": hashlib.sha256(raw).hexdigest(),
+            }
+            if turn_boundaries:
+                boundaries = locate_turns(raw, turns)
+                if boundaries is not None:
+                    entry["front_matter"] = front_matter
+                    entry["turns"] = boundaries
+            index.append(entry)
+
+            out.write(raw)
+            offset += len(raw)
+
+        index_bytes = json.dumps(index, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        out.write(index_bytes)
+        out.seek(0)
+        out.write(PACK_HEADER.pack(PACK_MAGIC, PACK_VERSION, offset, len(index_bytes)))
+
+    return len(index)
+
+
+def locate_turns(raw: bytes, turns: List[Dict]) -> Optional[List[List]]:
+    """
+    Express parsed turns as byte ranges of the raw transcript.
+
+    Each turn's text is split into lines and each line is found in the raw
+    bytes after the previous one, so joining a turn's ranges with newlines
+    reproduces its text by construction. Ranges separated only by a newline
+    are merged, so a turn is usually a handful of ranges.
+
+    Args:
+        raw: Raw transcript bytes
+        turns: Turns parsed from raw
+
+    Returns:
+        List of [speaker, [start0, end0, start1, end1, ...]] per turn, such
+        that joining the decoded ranges with newlines reproduces each
+        turn's text. None if some line of a turn does not occur verbatim in
+        raw (e.g., text extracted from HTML markup).
+    """
+    boundaries = []
+    cursor = 0
+    for turn in turns:
+        ranges = []
+        for line in turn["text"].split("\n"):
+            encoded = line.encode("utf-8")
+            start = raw.find(encoded, cursor)
+            if start < 0:
+                return None
+            end = start + len(encoded)
+            if ranges and start == ranges[-1] + 1 and raw[ranges[-1]:start] == b"\n":
+                ranges[-1] = end
+            else:
+                ranges.extend([start, end])
+            cursor = end
+
+        boundaries.append([turn["speaker"], ranges])
+
+    return boundaries
+
+
+def _join_ranges(buffer, ranges: List[int], base: int = 0) -> str:
+    """Decode byte ranges (relative to base) of buffer and join them with newlines."""
+    return "\n".join(
+        str(buffer[base + start:base + end], "utf-8")
+        for start, end in zip(ranges[::2], ranges[1::2])
+    )
+
+
+class PackedCorpus:
+    """
+    Read-only, memory-mapped view of a packed corpus file.
+
+    Only the header and index are read on open; transcripts are decoded
+    from the mapping when a thread is requested.
+
+    Example:
+        with PackedCorpus("data/corpus.pack") as corpus:
+            conv = corpus.get("contaminated_07")
+            conversations = corpus.load_all()
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Path to a file written by pack_corpus()
+        """
+        self.path = Path(path)
+        self._file = open(self.path, "rb")
+        self._map = b""
+        try:
+            self._open()
+        except BaseException:
+            self.close()
+            raise
+
+    def _open(self) -> None:
+        """Map the file and read its header and index."""
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file; reported as a bad header below
+            pass
+
+        try:
+            magic, version, index_at, index_len = PACK_HEADER.unpack_from(self._map, 0)
+        except struct.error:
+            magic = None
+        if magic != PACK_MAGIC:
+            raise ValueError(f"{self.path} is not a packed corpus file")
+        if version != PACK_VERSION:
+            raise ValueError(f"{self.path} has unsupported pack version {version}")
+
+        try:
+            self.index = json.loads(str(self._map[index_at:index_at + index_len], "utf-8"))
+        except ValueError as e:
+            raise ValueError(f"{self.path} has a corrupt index: {e}") from e
+        self._positions = {entry["thread_id"]: i for i, entry in enumerate(self.index)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, thread_id: str) -> bool:
+        return thread_id in self._positions
+
+    def __iter__(self) -> Iterator[Dict]:
+        for entry in self.index:
+            yield self._conversation(entry)
+
+    def close(self) -> None:
+        """Release the mapping and the underlying file."""
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    @property
+    def thread_ids(self) -> List[str]:
+        return [entry["thread_id"] for entry in self.index]
+
+    def entry(self, thread_id: str) -> Dict:
+        """Index entry for a thread (raises KeyError if absent)."""
+        return self.index[self._positions[thread_id]]
+
+    def raw_bytes(self, thread_id: str) -> bytes:
+        """Raw transcript bytes of a thread, as packed."""
+        entry = self.entry(thread_id)
+        return self._map[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def get(self, thread_id: str) -> Dict:
+        """
+        Load a single thread by ID.
+
+        Args:
+            thread_id: Thread identifier (e.g., "control_01")
+
+        Returns:
+            Conversation dictionary, as from parse_single_transcript()
+        """
+        return self._conversation(self.entry(thread_id))
+
+    def load_all(self, condition: Optional[str] = None) -> List[Dict]:
+        """
+        Load every thread, in packed order.
+
+        Args:
+            condition: If given, only load threads of this condition
+                (filtered on the index, without decoding other threads)
+
+        Returns:
+            List of conversation dictionaries
+        """
+        return [self._conversation(entry) for entry in self.index
+                if condition is None or entry["condition"] == condition]
+
+    def verify(self) -> List[str]:
+        """
+        Check every transcript against its stored SHA-256.
+
+        Returns:
+            Thread IDs whose content does not match (empty if all match)
+        """
+        return [entry["thread_id"] for entry in self.index
+                if hashlib.sha256(self._map[entry["offset"]:entry["offset"] + entry["length"]]).hexdigest()
+                != entry["sha256"]]
+
+    def _conversation(self, entry: Dict) -> Dict:
+        """Build a conversation from an index entry and the mapped transcript."""
+        offset = entry["offset"]
+        if "turns" in entry:
+            front_matter = entry["front_matter"]
+            turns = [
+                {"speaker": speaker, "text": _join_ranges(self._map, ranges, offset), "turn_index": i}
+                for i, (speaker, ranges) in enumerate(entry["turns"])
+            ]
+        else:
+            content = str(self._map[offset:offset + entry["length"]], "utf-8")
+            fmt = get_format(entry["format"])
+            front_matter, turns = fmt.parse(io.StringIO(content, newline=None))
+
+        return build_conversation(entry["thread_id"], turns, front_matter,
+                                  entry["metadata"], entry["format"])
+
+
+def load_packed_conversations(pack_path: str) -> List[Dict]:
+    """
+    Load all conversations from a packed corpus file.
+
+    Args:
+        pack_path: Path to a file written by pack_corpus()
+
+    Returns:
+        List of conversation dictionaries, identical to what
+        load_all_conversations() returns for the packed directory
+    """
+    with PackedCorpus(pack_path) as corpus:
+        return corpus.load_all()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from parse_transcripts import load_all_conversations
+
+    data_dir = Path(__file__).parent.parent / "data"
+
+    parser = argparse.ArgumentParser(description="Pack a transcript directory into a single corpus file.")
+    parser.add_argument("--data-dir", default=str(data_dir),
+                        help="Directory containing transcripts/ (default: data/)")
+    parser.add_argument("--output", default=None,
+                        help=f"Corpus file to write (default: <data-dir>/{DEFAULT_PACK_FILENAME})")
+    parser.add_argument("--no-turn-boundaries", action="store_true",
+                        help="Do not store turn boundaries; threads are parsed on load")
+    args = parser.parse_args()
+
+    output_path = args.output or str(Path(args.data_dir) / DEFAULT_PACK_FILENAME)
+    n_threads = pack_corpus(args.data_dir, output_path, turn_boundaries=not args.no_turn_boundaries)
+
+    with PackedCorpus(output_path) as corpus:
+        with_boundaries = sum(1 for entry in corpus.index if "turns" in entry)
+        print(f"Packed {n_threads} threads ({with_boundaries} with turn boundaries) "
+              f"into {output_path} ({corpus.path.stat().st_size} bytes)")
+
+        mismatched = corpus.verify()
+        print(f"Content hashes: {'all match' if not mismatched else f'{len(mismatched)} mismatched'}")
+
+        start = time.perf_counter()
+        packed = corpus.load_all()
+        packed_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parsed = load_all_conversations(args.data_dir)
+    parsed_seconds = time.perf_counter() - start
+
+    print(f"Load time: packed {packed_seconds:.3f}s, directory {parsed_seconds:.3f}s")
+    print(f"Identical to directory load: {packed == parsed}")
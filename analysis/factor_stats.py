@@ -0,0 +1,262 @@
+"""
+Multi-factor statistics module for Violation State study.
+
+This module computes refusal rates, Fisher's exact tests and Cohen's h for
+every combination of per-thread metadata factors (model, date, UI surface,
+trigger variant, ...) and every standardized prompt (I1-I4, T1).
+
+All contingency tables are built from a single grouped aggregation of the
+final outcomes at the finest factor level. Coarser factor combinations are
+rolled up from those counts instead of re-filtering the DataFrame per cell.
+"""
+
+from itertools import combinations
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from batch_stats import batch_2x2_tests
+from classify_responses import ResponseClass
+
+IMAGE_PROMPTS = ['I1_KITCHEN', 'I2_BEDROOM', 'I3_ABSTRACT', 'I4_COFFEE']
+TEXT_PROMPTS = ['T1_MORTGAGE']
+
+# Label used for a prompt pooled over I1-I4
+ALL_IMAGE_PROMPTS = "ALL_IMAGE"
+
+# Missing and blank metadata values are grouped under this level. Real levels
+# are always non-empty strings, so marginalized factors hold NaN instead of a
+# label that a real level could also take.
+UNKNOWN_LEVEL = "unknown"
+
+# Final outcomes counted as refusals. For image prompts rate limits count as
+# failed attempts (matching the primary analysis); for text prompts only
+# explicit refusals count.
+IMAGE_REFUSAL_CLASSES = [
+    ResponseClass.POLICY_REFUSAL.value,
+    ResponseClass.CAPABILITY_REFUSAL.value,
+    ResponseClass.RATE_LIMIT.value,
+]
+TEXT_REFUSAL_CLASSES = [
+    ResponseClass.POLICY_REFUSAL.value,
+    ResponseClass.CAPABILITY_REFUSAL.value,
+]
+
+
+def build_metadata_frame(conversations: List[Dict]) -> pd.DataFrame:
+    """
+    Collect per-thread metadata into a DataFrame.
+
+    Args:
+        conversations: Conversation dictionaries from load_all_conversations()
+
+    Returns:
+        DataFrame with one row per thread: thread_id, condition, and one
+        column per metadata field found in any thread
+    """
+    rows = []
+    for conv in conversations:
+        row = {"thread_id": conv["thread_id"], "condition": conv["condition"]}
+        row.update(conv.get("metadata", {}))
+        rows.append(row)
+
+    return pd.DataFrame(rows, columns=_ordered_columns(rows))
+
+
+def _ordered_columns(rows: List[Dict]) -> List[str]:
+    """Column names in first-seen order, with thread_id and condition first."""
+    columns = ["thread_id", "condition"]
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    return columns
+
+
+def compute_final_outcomes(turns_df: pd.DataFrame,
+                           prompt_ids: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Determine the final outcome of each prompt in each thread.
+
+    If any attempt at an image prompt succeeded, the final outcome is
+    image_success. Otherwise it is the classification of the last attempt.
+
+    Args:
+        turns_df: Classified turns (as written to parsed_turns.csv)
+        prompt_ids: Prompts to include (default: I1-I4 and T1)
+
+    Returns:
+        DataFrame with columns thread_id, condition, prompt_id,
+        response_class, n_attempts and refused (bool)
+    """
+    if prompt_ids is None:
+        prompt_ids = IMAGE_PROMPTS + TEXT_PROMPTS
+
+    prompt_turns = turns_df[turns_df["prompt_id"].isin(prompt_ids)]
+    prompt_turns = prompt_turns.assign(
+        is_success=prompt_turns["response_class"] == ResponseClass.IMAGE_SUCCESS.value
+    )
+
+    grouped = prompt_turns.groupby(["thread_id", "prompt_id"], sort=False)
+    final = grouped.agg(
+        condition=("condition", "first"),
+        last_class=("response_class", "last"),
+        has_success=("is_success", "any"),
+        n_attempts=("response_class", "size"),
+    ).reset_index()
+
+    final["response_class"] = np.where(
+        final["has_success"], ResponseClass.IMAGE_SUCCESS.value, final["last_class"]
+    )
+
+    is_image = final["prompt_id"].isin(IMAGE_PROMPTS)
+    final["refused"] = np.where(
+        is_image,
+        final["response_class"].isin(IMAGE_REFUSAL_CLASSES),
+        final["response_class"].isin(TEXT_REFUSAL_CLASSES),
+    )
+
+    return final[["thread_id", "condition", "prompt_id", "response_class",
+                  "n_attempts", "refused"]]
+
+
+def compute_factor_stats(final_outcomes: pd.DataFrame,
+                         metadata_df: Optional[pd.DataFrame] = None,
+                         factors: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Compute control-vs-contaminated statistics for every factor combination.
+
+    For each subset of the factors (including the empty subset, i.e. the
+    whole corpus), each level combination of that subset, and each prompt
+    (plus I1-I4 pooled as "ALL_IMAGE"), this builds the 2x2 table
+    [[control_success, control_refusals], [contaminated_success, contaminated_refusals]]
+    and reports refusal rates, Fisher's exact test and Cohen's h.
+
+    Args:
+        final_outcomes: Output of compute_final_outcomes()
+        metadata_df: Output of build_metadata_frame(). If None, no factors
+            are available and only corpus-wide rows are produced.
+        factors: Metadata columns to break results down by (default: every
+            metadata column except thread_id and condition)
+
+    Returns:
+        DataFrame with one row per (factor levels, prompt_id). Marginalized
+        factors hold NaN.
+    """
+    if metadata_df is not None:
+        if factors is None:
+            factors = [c for c in metadata_df.columns if c not in ("thread_id", "condition")]
+        outcomes = final_outcomes.merge(
+            metadata_df[["thread_id"] + factors], on="thread_id", how="left"
+        )
+    else:
+        factors = []
+        outcomes = final_outcomes
+
+    outcomes = outcomes.copy()
+    for factor in factors:
+        outcomes[factor] = outcomes[factor].fillna(UNKNOWN_LEVEL).astype(str).replace("", UNKNOWN_LEVEL)
+
+    # Pool the image prompts alongside the per-prompt rows
+    pooled = outcomes[outcomes["prompt_id"].isin(IMAGE_PROMPTS)].assign(
+        prompt_id=ALL_IMAGE_PROMPTS
+    )
+    outcomes = pd.concat([outcomes, pooled], ignore_index=True)
+
+    # Single grouped aggregation at the finest level
+    finest = outcomes.groupby(factors + ["prompt_id", "condition"]).agg(
+        n=("refused", "size"),
+        refusals=("refused", "sum"),
+    )
+    finest = finest.unstack("condition", fill_value=0)
+    counts = pd.DataFrame({
+        "control_n": _condition_column(finest, "n", "control"),
+        "control_refusals": _condition_column(finest, "refusals", "control"),
+        "contaminated_n": _condition_column(finest, "n", "contaminated"),
+        "contaminated_refusals": _condition_column(finest, "refusals", "contaminated"),
+    }, index=finest.index).reset_index()
+
+    # Roll up every subset of factors from the finest-level counts. Each
+    # (factor subset, prompt) pair is one family for multiple-comparison
+    # correction: the levels of those factors, tested on that prompt.
+    count_columns = ["control_n", "control_refusals", "contaminated_n", "contaminated_refusals"]
+    rollups = []
+    families = []
+    for size in range(len(factors), -1, -1):
+        for subset in combinations(factors, size):
+            subset = list(subset)
+            rolled = counts.groupby(subset + ["prompt_id"], sort=True)[count_columns].sum()
+            rolled = rolled.reset_index()
+            for factor in factors:
+                if factor not in subset:
+                    rolled[factor] = np.nan
+            rollups.append(rolled)
+            families.extend("+".join(subset) + "|" + rolled["prompt_id"])
+
+    stats_df = pd.concat(rollups, ignore_index=True)
+    stats_df = stats_df[factors + ["prompt_id"] + count_columns]
+    stats_df[count_columns] = stats_df[count_columns].astype(int)
+
+    return add_table_statistics(stats_df, families)
+
+
+def _condition_column(frame: pd.DataFrame, measure: str, condition: str) -> pd.Series:
+    """Pick one condition's column from an unstacked aggregation (zeros if absent)."""
+    if (measure, condition) in frame.columns:
+        return frame[(measure, condition)]
+    return pd.Series(0, index=frame.index)
+
+
+def add_table_statistics(stats_df: pd.DataFrame, groups) -> pd.DataFrame:
+    """
+    Add refusal rates, Fisher's exact test and Cohen's h to a table of counts.
+
+    All tables are evaluated in one vectorized pass (see batch_stats). Holm
+    and Benjamini-Hochberg adjusted p-values are computed within each family
+    given by groups; untestable tables (no threads in a condition, or every
+    outcome the same) are left out and their adjusted p-values are NaN.
+
+    Args:
+        stats_df: DataFrame with control_n, control_refusals, contaminated_n
+            and contaminated_refusals columns
+        groups: Family label of each row (array-like, same length as
+            stats_df); pass None to treat all rows as one family
+
+    Returns:
+        Copy of stats_df with control_rate, contaminated_rate, odds_ratio,
+        p_value, p_holm, p_bh and cohen_h columns added
+    """
+    stats_df = stats_df.copy()
+
+    control_n = stats_df["control_n"].to_numpy()
+    control_refusals = stats_df["control_refusals"].to_numpy()
+    contaminated_n = stats_df["contaminated_n"].to_numpy()
+    contaminated_refusals = stats_df["contaminated_refusals"].to_numpy()
+
+    results = batch_2x2_tests(control_n - control_refusals, control_refusals,
+                              contaminated_n - contaminated_refusals, contaminated_refusals,
+                              groups=groups)
+
+    stats_df["control_rate"] = results["rate1"]
+    stats_df["contaminated_rate"] = results["rate2"]
+    stats_df["odds_ratio"] = results["odds_ratio"]
+    stats_df["p_value"] = results["p_value"]
+    stats_df["p_holm"] = results["p_holm"]
+    stats_df["p_bh"] = results["p_bh"]
+    stats_df["cohen_h"] = results["cohen_h"]
+
+    return stats_df
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    processed_dir = Path(__file__).parent.parent / "data" / "processed"
+    turns_df = pd.read_csv(processed_dir / "parsed_turns.csv")
+
+    final_outcomes = compute_final_outcomes(turns_df)
+    stats_df = compute_factor_stats(final_outcomes)
+
+    pd.set_option("display.width", 160)
+    print(stats_df.to_string(index=False))
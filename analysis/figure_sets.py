@@ -0,0 +1,441 @@
+"""
+Figure set rendering module for Violation State study.
+
+Once results are broken down by prompt, condition and metadata factor, a run
+needs dozens to hundreds of figures. This module describes each figure as a
+FigureSpec (a name, a figure kind and the plain data it plots) and renders
+the set:
+
+- with the object-oriented Agg API (matplotlib.figure.Figure on a
+  FigureCanvasAgg), so no global pyplot state is touched,
+- in a process pool, since figures are independent,
+- incrementally: a manifest in the output directory records a fingerprint
+  of each figure's data, formats and renderer version, and figures whose
+  fingerprint is unchanged are skipped,
+- byte-stably: timestamps and version strings are stripped from PNG, SVG and
+  PDF metadata and SVG ids use a fixed hash salt, so identical inputs give
+  identical files.
+
+Figure sets:
+    rates_<prompt>[_<factor>-<level>...]: control vs contaminated refusal
+        rate for each row of factor_stats (each prompt, I1-I4 pooled, and
+        each metadata factor level combination)
+    prompts_<condition>[_<factor>-<level>]: refusal rate per prompt within
+        a condition
+    outcomes_<condition>[_<factor>-<level>]: final outcome of each prompt
+        in each thread of a condition
+"""
+
+import hashlib
+import json
+import math
+import os
+import re
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import matplotlib
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import ListedColormap
+from matplotlib.figure import Figure
+from matplotlib.patches import Patch
+
+from classify_responses import ResponseClass
+from factor_stats import (
+    ALL_IMAGE_PROMPTS,
+    IMAGE_PROMPTS,
+    UNKNOWN_LEVEL
+)
+
+# Bump when a renderer's output changes, so cached figures are re-rendered
+RENDERER_VERSION = 1
+
+SUPPORTED_FORMATS = ("png", "svg", "pdf")
+DEFAULT_FORMATS = ("png",)
+DEFAULT_DPI = 300
+
+MANIFEST_FILENAME = "figure_manifest.json"
+
+# Metadata entries that would embed versions or timestamps in the output
+STABLE_METADATA = {
+    "png": {"Software": None},
+    "svg": {"Creator": None, "Date": None},
+    "pdf": {"Creator": None, "Producer": None, "CreationDate": None},
+}
+STABLE_RC_PARAMS = {"svg.hashsalt": "violation-state", "pdf.compression": 6}
+
+CONDITION_COLORS = {"control": "#2ecc71", "contaminated": "#e74c3c"}
+PROMPT_LABELS = {"I1_KITCHEN": "Kitchen", "I2_BEDROOM": "Bedroom",
+                 "I3_ABSTRACT": "Abstract", "I4_COFFEE": "Coffee",
+                 ALL_IMAGE_PROMPTS: "I1-I4 pooled"}
+
+# Outcome grid colors as in fig2_per_thread_heatmap.png; capability refusals
+# are drawn as refusals here. Classes not listed are drawn as other/missing.
+OUTCOME_COLORS = ["#cccccc", "#2ecc71", "#e74c3c", "#f39c12"]
+OUTCOME_LABELS = ["Missing/Other", "Success", "Refusal", "Rate Limit"]
+OUTCOME_CODES = {
+    ResponseClass.IMAGE_SUCCESS.value: 1,
+    ResponseClass.POLICY_REFUSAL.value: 2,
+    ResponseClass.CAPABILITY_REFUSAL.value: 2,
+    ResponseClass.RATE_LIMIT.value: 3,
+}
+
+FigureSpec = namedtuple("FigureSpec", ["name", "kind", "data"])
+
+
+def _new_figure(figsize) -> Figure:
+    """Figure drawn by Agg, independent of pyplot."""
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    return fig
+
+
+def render_condition_rates(data: Dict) -> Figure:
+    """Bar chart of control vs contaminated refusal rates for one table."""
+    fig = _new_figure((6, 5))
+    ax = fig.add_subplot()
+
+    conditions = ["control", "contaminated"]
+    rates = [100 * data[c]["refusals"] / data[c]["n"] if data[c]["n"] else 0.0 for c in conditions]
+    bars = ax.bar([c.capitalize() for c in conditions], rates,
+                  color=[CONDITION_COLORS[c] for c in conditions],
+                  alpha=0.8, edgecolor="black", linewidth=1.5)
+    for bar, condition in zip(bars, conditions):
+        ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height() + 2,
+                f"{bar.get_height():.1f}%\n({data[condition]['refusals']}/{data[condition]['n']})",
+                ha="center", va="bottom", fontsize=10, fontweight="bold")
+
+    ax.set_ylabel("Refusal Rate (%)", fontsize=12, fontweight="bold")
+    ax.set_ylim(0, 115)
+    ax.set_title(data["title"], fontsize=13, fontweight="bold", pad=15)
+    if data["p_value"] is not None:
+        ax.text(0.02, 0.97, f"Fisher p = {data['p_value']:.2e}\nCohen's h = {data['cohen_h']:.2f}",
+                transform=ax.transAxes, ha="left", va="top", fontsize=9)
+    ax.grid(axis="y", alpha=0.3, linestyle="--")
+    ax.set_axisbelow(True)
+    fig.tight_layout()
+    return fig
+
+
+def render_prompt_rates(data: Dict) -> Figure:
+    """Bar chart of refusal rate per prompt within one condition."""
+    fig = _new_figure((7, 5))
+    ax = fig.add_subplot()
+
+    rates = [100 * r / n if n else 0.0 for r, n in zip(data["refusals"], data["n"])]
+    bars = ax.bar([PROMPT_LABELS.get(p, p) for p in data["prompts"]], rates,
+                  color=CONDITION_COLORS.get(data["condition"], "#999999"),
+                  alpha=0.8, edgecolor="black", linewidth=1.5)
+    for bar, refusals, n in zip(bars, data["refusals"], data["n"]):
+        ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height() + 2, f"{refusals}/{n}",
+                ha="center", va="bottom", fontsize=10)
+
+    ax.set_ylabel("Refusal Rate (%)", fontsize=12, fontweight="bold")
+    ax.set_xlabel("Image Prompt", fontsize=12, fontweight="bold")
+    ax.set_ylim(0, 110)
+    ax.set_title(data["title"], fontsize=13, fontweight="bold", pad=15)
+    ax.grid(axis="y", alpha=0.3, linestyle="--")
+    ax.set_axisbelow(True)
+    fig.tight_layout()
+    return fig
+
+
+def render_outcome_grid(data: Dict) -> Figure:
+    """Thread x prompt grid of final outcomes within one condition."""
+    n_threads = len(data["threads"])
+    fig = _new_figure((8, max(3.0, 1.5 + 0.25 * n_threads)))
+    ax = fig.add_subplot()
+
+    matrix = np.array(data["codes"], dtype=float).reshape(n_threads, len(data["prompts"]))
+    ax.imshow(matrix, cmap=ListedColormap(OUTCOME_COLORS), aspect="auto", vmin=0, vmax=3,
+              interpolation="nearest")
+
+    ax.set_xticks(np.arange(len(data["prompts"])))
+    ax.set_xticklabels([PROMPT_LABELS.get(p, p) for p in data["prompts"]])
+    ax.set_yticks(np.arange(n_threads))
+    ax.set_yticklabels(data["threads"], fontsize=8)
+    ax.set_xticks(np.arange(len(data["prompts"])) - 0.5, minor=True)
+    ax.set_yticks(np.arange(n_threads) - 0.5, minor=True)
+    ax.grid(which="minor", color="white", linewidth=2)
+    ax.tick_params(which="minor", length=0)
+
+    ax.set_xlabel("Image Prompt", fontsize=12, fontweight="bold")
+    ax.set_ylabel("Thread ID", fontsize=12, fontweight="bold")
+    ax.set_title(data["title"], fontsize=13, fontweight="bold", pad=15)
+    ax.legend(handles=[Patch(facecolor=color, label=label)
+                       for color, label in zip(OUTCOME_COLORS, OUTCOME_LABELS)],
+              loc="upper left", bbox_to_anchor=(1.02, 1), fontsize=9)
+    fig.tight_layout()
+    return fig
+
+
+FIGURE_KINDS = {
+    "condition_rates": render_condition_rates,
+    "prompt_rates": render_prompt_rates,
+    "outcome_grid": render_outcome_grid,
+}
+
+
+def _slug(text: str) -> str:
+    """
+    File-name-safe version of a factor name or level.
+
+    "_" and "-" separate the parts of a figure name, so a label is kept as
+    is only if it consists of letters, digits and "."; otherwise its other
+    characters become "." and a short hash of the original is appended.
+    Distinct labels (e.g. "gpt-4o" and "gpt 4o", or "a_date-b") therefore
+    never produce the same figure name.
+    """
+    text = str(text)
+    if re.fullmatch(r"[A-Za-z0-9.]+", text):
+        return text
+    slug = re.sub(r"[^A-Za-z0-9.]+", ".", text).strip(".") or "blank"
+    return f"{slug}.{hashlib.sha1(text.encode('utf-8')).hexdigest()[:6]}"
+
+
+def _finite_or_none(value) -> Optional[float]:
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+def build_figure_specs(factor_stats: pd.DataFrame, final_outcomes: pd.DataFrame,
+                       metadata_df: Optional[pd.DataFrame] = None) -> List[FigureSpec]:
+    """
+    Describe the per-prompt and per-condition figure sets for a run.
+
+    Args:
+        factor_stats: Output of compute_factor_stats() (with add_table_statistics())
+        final_outcomes: Output of compute_final_outcomes()
+        metadata_df: Output of build_metadata_frame(); each metadata factor
+            level also gets its own per-condition figures
+
+    Returns:
+        List of FigureSpec, in a stable order
+    """
+    specs = []
+    count_columns = {"prompt_id", "control_n", "control_refusals", "contaminated_n",
+                     "contaminated_refusals", "control_rate", "contaminated_rate",
+                     "odds_ratio", "p_value", "p_holm", "p_bh", "cohen_h"}
+    factors = [c for c in factor_stats.columns if c not in count_columns]
+
+    # Control vs contaminated, one figure per factor_stats row
+    for row in factor_stats.to_dict("records"):
+        levels = [(factor, row[factor]) for factor in factors if not pd.isna(row[factor])]
+        # Prompt IDs are fixed identifiers and already file-name-safe
+        name = "_".join(["rates", row["prompt_id"]] +
+                        [f"{_slug(factor)}-{_slug(level)}" for factor, level in levels])
+        subtitle = ", ".join(f"{factor} = {level}" for factor, level in levels)
+        title = f"Refusal Rates: {PROMPT_LABELS.get(row['prompt_id'], row['prompt_id'])}"
+        specs.append(FigureSpec(name, "condition_rates", {
+            "title": title + (f"\n{subtitle}" if subtitle else ""),
+            "control": {"refusals": int(row["control_refusals"]), "n": int(row["control_n"])},
+            "contaminated": {"refusals": int(row["contaminated_refusals"]), "n": int(row["contaminated_n"])},
+            "p_value": _finite_or_none(row["p_value"]),
+            "cohen_h": _finite_or_none(row["cohen_h"]),
+        }))
+
+    # Per-condition figures for the whole corpus and each single metadata level
+    image_outcomes = final_outcomes[final_outcomes["prompt_id"].isin(IMAGE_PROMPTS)]
+    subsets = [("", "", image_outcomes)]
+    if metadata_df is not None:
+        for factor in [c for c in metadata_df.columns if c not in ("thread_id", "condition")]:
+            levels = metadata_df.set_index("thread_id")[factor].fillna(UNKNOWN_LEVEL).astype(str)
+            levels = levels.replace("", UNKNOWN_LEVEL)
+            thread_levels = image_outcomes["thread_id"].map(levels).fillna(UNKNOWN_LEVEL)
+            for level in sorted(thread_levels.unique()):
+                subsets.append((f"_{_slug(factor)}-{_slug(level)}", f" ({factor} = {level})",
+                                image_outcomes[thread_levels == level]))
+
+    for suffix, label, outcomes in subsets:
+        for condition in ["control", "contaminated"]:
+            cond_outcomes = outcomes[outcomes["condition"] == condition]
+            if cond_outcomes.empty:
+                continue
+
+            per_prompt = cond_outcomes.groupby("prompt_id")["refused"].agg(["sum", "size"])
+            per_prompt = per_prompt.reindex(IMAGE_PROMPTS, fill_value=0)
+            specs.append(FigureSpec(f"prompts_{condition}{suffix}", "prompt_rates", {
+                "title": f"Refusal Rate by Prompt: {condition.capitalize()}{label}",
+                "condition": condition,
+                "prompts": IMAGE_PROMPTS,
+                "refusals": [int(v) for v in per_prompt["sum"]],
+                "n": [int(v) for v in per_prompt["size"]],
+            }))
+
+            grid = cond_outcomes.pivot_table(index="thread_id", columns="prompt_id", values="response_class",
+                                             aggfunc="first").reindex(columns=IMAGE_PROMPTS)
+            grid = grid.sort_index()
+            codes = [[OUTCOME_CODES.get(value, 0) for value in row]
+                     for row in grid.itertuples(index=False)]
+            specs.append(FigureSpec(f"outcomes_{condition}{suffix}", "outcome_grid", {
+                "title": f"Final Outcomes: {condition.capitalize()}{label}",
+                "threads": list(grid.index),
+                "prompts": IMAGE_PROMPTS,
+                "codes": codes,
+            }))
+
+    return specs
+
+
+def figure_fingerprint(spec: FigureSpec, formats, dpi: int) -> str:
+    """
+    Fingerprint of everything that determines a figure's files.
+
+    Args:
+        spec: Figure to render
+        formats: Output formats
+        dpi: Raster resolution
+
+    Returns:
+        Hex SHA-256 of the kind, data, formats, dpi and renderer versions
+    """
+    payload = json.dumps({
+        "kind": spec.kind,
+        "data": spec.data,
+        "formats": sorted(formats),
+        "dpi": dpi,
+        "renderer_version": RENDERER_VERSION,
+        "matplotlib": matplotlib.__version__,
+    }, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_figure(spec: FigureSpec, output_dir: str, formats=DEFAULT_FORMATS,
+                  dpi: int = DEFAULT_DPI) -> List[str]:
+    """
+    Render one figure to every requested format.
+
+    Args:
+        spec: Figure to render
+        output_dir: Directory to write into
+        formats: Output formats (subset of SUPPORTED_FORMATS)
+        dpi: Raster resolution
+
+    Returns:
+        Names of the written files
+    """
+    filenames = []
+    with matplotlib.rc_context(STABLE_RC_PARAMS):
+        fig = FIGURE_KINDS[spec.kind](spec.data)
+        for fmt in formats:
+            filename = f"{spec.name}.{fmt}"
+            fig.savefig(Path(output_dir) / filename, format=fmt, dpi=dpi, bbox_inches="tight",
+                        metadata=STABLE_METADATA[fmt])
+            filenames.append(filename)
+    return filenames
+
+
+def _load_manifest(path: Path) -> Dict[str, Dict]:
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def render_figure_sets(specs: List[FigureSpec], output_dir: str, formats=DEFAULT_FORMATS,
+                       dpi: int = DEFAULT_DPI, max_workers: Optional[int] = None,
+                       force: bool = False) -> Dict[str, List[str]]:
+    """
+    Render figures whose inputs changed since the last run, in parallel.
+
+    Figures listed in the manifest but no longer in specs have their files
+    removed, so the directory always matches the current figure set.
+
+    Args:
+        specs: Figures to render (unique names)
+        output_dir: Directory to write figures and the manifest into
+        formats: Output formats (subset of SUPPORTED_FORMATS)
+        dpi: Raster resolution
+        max_workers: Worker processes (default: CPU count; 1 renders in
+            this process)
+        force: Re-render every figure regardless of the manifest
+
+    Returns:
+        Dictionary with "rendered", "skipped" and "removed" figure names
+    """
+    unsupported = set(formats) - set(SUPPORTED_FORMATS)
+    if unsupported:
+        raise ValueError(f"Unsupported formats: {sorted(unsupported)}")
+    names = [spec.name for spec in specs]
+    if len(set(names)) != len(names):
+        raise ValueError("Figure names must be unique")
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / MANIFEST_FILENAME
+    previous = _load_manifest(manifest_path)
+
+    manifest = {}
+    pending = []
+    skipped = []
+    for spec in specs:
+        fingerprint = figure_fingerprint(spec, formats, dpi)
+        entry = previous.get(spec.name)
+        up_to_date = (not force and entry is not None and entry["fingerprint"] == fingerprint and
+                      all((output_dir / filename).exists() for filename in entry["files"]))
+        if up_to_date:
+            manifest[spec.name] = entry
+            skipped.append(spec.name)
+        else:
+            manifest[spec.name] = {"fingerprint": fingerprint, "files": []}
+            pending.append(spec)
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_workers <= 1 or len(pending) <= 1:
+        results = [render_figure(spec, str(output_dir), formats, dpi) for spec in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+            results = list(pool.map(render_figure, pending, [str(output_dir)] * len(pending),
+                                    [tuple(formats)] * len(pending), [dpi] * len(pending)))
+    for spec, filenames in zip(pending, results):
+        manifest[spec.name]["files"] = filenames
+
+    # Remove files of figures (or formats) that are no longer produced
+    current_files = {filename for entry in manifest.values() for filename in entry["files"]}
+    removed = []
+    for name, entry in previous.items():
+        stale = [filename for filename in entry["files"] if filename not in current_files]
+        for filename in stale:
+            (output_dir / filename).unlink(missing_ok=True)
+        if name not in manifest:
+            removed.append(name)
+
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(dict(sorted(manifest.items())), f, indent=2)
+        f.write("\n")
+
+    return {"rendered": [spec.name for spec in pending], "skipped": skipped, "removed": removed}
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from run_analysis import AnalysisResults
+
+    repo_root = Path(__file__).parent.parent
+
+    parser = argparse.ArgumentParser(description="Render per-prompt and per-condition figure sets.")
+    parser.add_argument("--output-dir", default=str(repo_root / "analysis" / "figures" / "sets"),
+                        help="Directory for the figure set (default: analysis/figures/sets)")
+    parser.add_argument("--formats", default=",".join(DEFAULT_FORMATS),
+                        help=f"Comma-separated output formats ({', '.join(SUPPORTED_FORMATS)})")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI, help="Raster resolution")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--force", action="store_true", help="Re-render every figure")
+    args = parser.parse_args()
+
+    results = AnalysisResults(str(repo_root))
+    specs = build_figure_specs(results.factor_stats, results.final_outcomes, results.metadata)
+
+    start = time.perf_counter()
+    outcome = render_figure_sets(specs, args.output_dir, formats=args.formats.split(","),
+                                 dpi=args.dpi, max_workers=args.workers, force=args.force)
+    elapsed = time.perf_counter() - start
+    print(f"{len(specs)} figures: {len(outcome['rendered'])} rendered, {len(outcome['skipped'])} unchanged, "
+          f"{len(outcome['removed'])} removed ({elapsed:.2f}s) in {args.output_dir}")
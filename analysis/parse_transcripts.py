@@ -1,139 +1,178 @@
 """
 Transcript parsing module for Violation State study.
 
-This module parses ChatGPT Web conversation transcripts from .txt files
-into structured conversation data.
+This module parses ChatGPT Web conversation transcripts into structured
+conversation data. The format of each file (copy-pasted text, Markdown
+export or saved HTML page) is chosen by its extension, or sniffed from its
+first bytes for unregistered extensions, and dispatched to the matching
+parser in transcript_formats.
+
+Per-thread metadata (model, collection date, UI surface, trigger variant, ...)
+can be attached in two ways:
+
+1. A front-matter block at the top of a text or Markdown transcript::
+
+       ---
+       model: gpt-5.1
+       date: 2024-11-14
+       ---
+
+2. A sidecar manifest at ``transcripts/manifest.csv`` with a ``thread_id``
+   column and one column per metadata field. Manifest values take precedence
+   over front-matter values.
+
+A ``condition`` field in either source overrides the condition inferred from
+the filename prefix.
 """
 
+import csv
 import os
-import re
+import warnings
 from pathlib import Path
 from typing import List, Dict, Optional
 
+from transcript_formats import (
+    SNIFF_BYTES,
+    detect_format,
+    registered_extensions
+)
+
+MANIFEST_FILENAME = "manifest.csv"
+
+
+def load_manifest(manifest_path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Load a sidecar metadata manifest.
+
+    Args:
+        manifest_path: Path to a CSV file with a "thread_id" column
+
+    Returns:
+        Dictionary mapping thread_id to a dict of metadata fields. Empty
+        cells are omitted so they do not mask front-matter values.
+    """
+    manifest = {}
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames is None or "thread_id" not in reader.fieldnames:
+            raise ValueError(f"Manifest {manifest_path} has no 'thread_id' column")
+
+        for row in reader:
+            thread_id = row.pop("thread_id").strip()
+            manifest[thread_id] = {
+                key.strip().lower(): value.strip()
+                for key, value in row.items()
+                if key is not None and value is not None and value.strip()
+            }
+
+    return manifest
+
 
-def parse_single_transcript(file_path: str) -> Dict:
+def parse_single_transcript(file_path: str, metadata: Optional[Dict[str, str]] = None) -> Dict:
     """
     Parse a single ChatGPT transcript file into structured conversation data.
 
+    The file format is chosen by extension, or sniffed from the first bytes
+    for unregistered extensions (see transcript_formats.detect_format()).
+
     Args:
-        file_path: Path to the transcript .txt file
+        file_path: Path to the transcript file (.txt, .md, .html, ...)
+        metadata: Optional metadata for this thread (e.g., a manifest row).
+            Overrides any front-matter values.
 
     Returns:
         Dictionary containing:
             - thread_id: Filename without extension (e.g., "control_01")
             - condition: "control" or "contaminated"
+            - format: Name of the detected transcript format
+            - metadata: Dict of additional per-thread fields (model, date, ...)
             - turns: List of turn dictionaries with speaker, text, turn_index
     """
     file_path = Path(file_path)
     thread_id = file_path.stem  # e.g., "control_01" or "contaminated_01"
 
-    # Determine condition from filename
+    # Detect the format from the extension (or first bytes), then parse as text
+    with open(file_path, 'rb') as f:
+        fmt = detect_format(f.read(SNIFF_BYTES), file_path.suffix)
+
+    with open(file_path, 'r', encoding='utf-8') as f:
+        front_matter, turns = fmt.parse(f)
+
+    return build_conversation(thread_id, turns, front_matter, metadata, fmt.name)
+
+
+def infer_condition(thread_id: str) -> str:
+    """Determine condition from the thread ID (filename) prefix."""
     if thread_id.startswith("control"):
-        condition = "control"
+        return "control"
     elif thread_id.startswith("contaminated"):
-        condition = "contaminated"
+        return "contaminated"
     else:
-        condition = "unknown"
+        return "unknown"
 
-    # Read file content
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-
-    # Parse turns
-    turns = []
-
-    # Split on "You said:" and "ChatGPT said:" markers
-    # Use regex to find all occurrences and their positions
-    user_pattern = r'^(?:You said:|You:)\s*$'
-    assistant_pattern = r'^(?:ChatGPT said:|ChatGPT:)\s*$'
-
-    lines = content.split('\n')
-
-    current_speaker = None
-    current_text = []
-    turn_index = 0
-
-    # Check if file starts with content before any marker (first user turn)
-    first_marker_line = None
-    for i, line in enumerate(lines):
-        line_stripped = line.strip()
-        if re.match(user_pattern, line_stripped) or re.match(assistant_pattern, line_stripped):
-            first_marker_line = i
-            break
-
-    # If there's content before the first marker, treat it as the first user turn
-    if first_marker_line is not None and first_marker_line > 0:
-        initial_content = '\n'.join(lines[:first_marker_line]).strip()
-        if initial_content and initial_content != "Share":
-            current_speaker = "user"
-            current_text = lines[:first_marker_line]
-
-    for i, line in enumerate(lines):
-        # Skip lines we already processed as initial content
-        if first_marker_line is not None and i < first_marker_line:
-            continue
-
-        line_stripped = line.strip()
-
-        # Check if this is a speaker marker
-        if re.match(user_pattern, line_stripped):
-            # Save previous turn if exists
-            if current_speaker is not None and current_text:
-                text_content = '\n'.join(current_text).strip()
-                if text_content:  # Only add non-empty turns
-                    turns.append({
-                        "speaker": current_speaker,
-                        "text": text_content,
-                        "turn_index": turn_index
-                    })
-                    turn_index += 1
-
-            # Start new user turn
-            current_speaker = "user"
-            current_text = []
-
-        elif re.match(assistant_pattern, line_stripped):
-            # Save previous turn if exists
-            if current_speaker is not None and current_text:
-                text_content = '\n'.join(current_text).strip()
-                if text_content:  # Only add non-empty turns
-                    turns.append({
-                        "speaker": current_speaker,
-                        "text": text_content,
-                        "turn_index": turn_index
-                    })
-                    turn_index += 1
-
-            # Start new assistant turn
-            current_speaker = "assistant"
-            current_text = []
-
-        else:
-            # Add to current turn (skip common noise like "Share")
-            if current_speaker is not None and line_stripped and line_stripped != "Share":
-                current_text.append(line)
-
-    # Don't forget the last turn
-    if current_speaker is not None and current_text:
-        text_content = '\n'.join(current_text).strip()
-        if text_content:
-            turns.append({
-                "speaker": current_speaker,
-                "text": text_content,
-                "turn_index": turn_index
-            })
+
+def build_conversation(thread_id: str, turns: List[Dict],
+                       front_matter: Optional[Dict[str, str]] = None,
+                       metadata: Optional[Dict[str, str]] = None,
+                       format_name: str = "text") -> Dict:
+    """
+    Assemble a conversation dictionary from parsed turns and metadata.
+
+    Warns if turns is empty, since such a thread silently drops out of
+    every downstream statistic.
+
+    Args:
+        thread_id: Thread identifier
+        turns: Parsed turns
+        front_matter: Metadata found in the transcript itself
+        metadata: Caller-supplied metadata (e.g., a manifest row); takes
+            precedence over front_matter
+        format_name: Name of the transcript format
+
+    Returns:
+        Conversation dictionary (see parse_single_transcript())
+    """
+    # Merge metadata: front-matter first, then caller-supplied (manifest) values
+    thread_metadata = dict(front_matter or {})
+    if metadata:
+        thread_metadata.update(metadata)
+
+    condition = thread_metadata.pop("condition", None) or infer_condition(thread_id)
+
+    if not turns:
+        warnings.warn(f"{thread_id}: no turns found in {format_name} transcript", stacklevel=2)
 
     return {
         "thread_id": thread_id,
         "condition": condition,
+        "format": format_name,
+        "metadata": thread_metadata,
         "turns": turns
     }
 
 
+def find_transcript_files(directory: Path) -> List[Path]:
+    """
+    List transcript files in a directory, in filename order.
+
+    Args:
+        directory: Directory to scan
+
+    Returns:
+        Paths of files with an extension claimed by a registered format
+    """
+    extensions = set(registered_extensions())
+    return sorted(path for path in directory.iterdir()
+                  if path.is_file() and path.suffix.lower() in extensions)
+
+
 def load_all_conversations(base_dir: str) -> List[Dict]:
     """
     Load all conversation transcripts from the data directory.
 
+    If transcripts/manifest.csv exists, its rows are attached as per-thread
+    metadata (see load_manifest()).
+
     Args:
         base_dir: Base directory containing transcripts/control/ and transcripts/contaminated/
 
@@ -143,18 +182,21 @@ def load_all_conversations(base_dir: str) -> List[Dict]:
     base_path = Path(base_dir)
     conversations = []
 
+    manifest_path = base_path / "transcripts" / MANIFEST_FILENAME
+    manifest = load_manifest(str(manifest_path)) if manifest_path.exists() else {}
+
     # Load control transcripts
     control_dir = base_path / "transcripts" / "control"
     if control_dir.exists():
-        for txt_file in sorted(control_dir.glob("*.txt")):
-            conv = parse_single_transcript(str(txt_file))
+        for transcript_file in find_transcript_files(control_dir):
+            conv = parse_single_transcript(str(transcript_file), manifest.get(transcript_file.stem))
             conversations.append(conv)
 
     # Load contaminated transcripts
     contaminated_dir = base_path / "transcripts" / "contaminated"
     if contaminated_dir.exists():
-        for txt_file in sorted(contaminated_dir.glob("*.txt")):
-            conv = parse_single_transcript(str(txt_file))
+        for transcript_file in find_transcript_files(contaminated_dir):
+            conv = parse_single_transcript(str(transcript_file), manifest.get(transcript_file.stem))
             conversations.append(conv)
 
     return conversations
@@ -189,6 +231,8 @@ if __name__ == "__main__":
         result = parse_single_transcript(test_file)
         print(f"Thread ID: {result['thread_id']}")
         print(f"Condition: {result['condition']}")
+        print(f"Format: {result['format']}")
+        print(f"Metadata: {result['metadata']}")
         print(f"Number of turns: {len(result['turns'])}")
         print("\nTurns:")
         for turn in result['turns']:
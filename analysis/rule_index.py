@@ -0,0 +1,390 @@
+"""
+Rule impact index for Violation State study.
+
+Response classes are decided by phrase lists (see classify_responses). After
+a phrase is added to or removed from a list, only responses containing that
+phrase can change class, so re-running classification over the whole corpus
+is unnecessary.
+
+This module keeps a persistent index of the classified assistant turns: their
+current labels, their text, and an inverted index from character trigrams of
+the normalized (lowercased) text to the turns that contain them. Any phrase,
+including one that has never been a rule before, can then be looked up by
+intersecting the postings of its trigrams. When the rule set changes, only
+the turns containing an added or removed phrase are reclassified, and the
+report lists the label changes and the resulting shifts in the summary
+statistics.
+
+The index is a directory of four files, so an update reads only what it
+needs:
+
+    labels.json    rules, threads, trigram vocabulary and per-turn labels
+    postings.npy   posting lists of all trigrams, concatenated (int64 rows)
+    offsets.npy    byte offset of each turn's text in texts.bin
+    texts.bin      assistant texts, concatenated UTF-8
+
+postings.npy, offsets.npy and texts.bin are memory-mapped, so looking up a
+phrase touches the postings of its trigrams and the texts of the candidate
+turns only. An update rewrites labels.json alone.
+
+Usage:
+    python analysis/rule_index.py build
+    # edit the indicator lists in classify_responses.py, then
+    python analysis/rule_index.py update
+"""
+
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from classify_responses import CLASSIFICATION_COLUMNS, DEFAULT_RULES, classify_response
+from factor_stats import compute_final_outcomes
+from run_analysis import build_thread_summary, compute_summary_stats
+
+RULE_INDEX_VERSION = 2
+DEFAULT_INDEX_DIRNAME = "rule_index"
+
+LABELS_FILENAME = "labels.json"
+POSTINGS_FILENAME = "postings.npy"
+OFFSETS_FILENAME = "offsets.npy"
+TEXTS_FILENAME = "texts.bin"
+
+NGRAM_SIZE = 3
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text the way classify_response() does before matching."""
+    return text.lower()
+
+
+def text_ngrams(text: str) -> Set[str]:
+    """Distinct character n-grams (NGRAM_SIZE) of normalized text."""
+    text = normalize_text(text)
+    return {text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+def changed_phrases(old_rules: Dict[str, List[str]], new_rules: Dict[str, List[str]]) -> Set[str]:
+    """
+    Phrases added to or removed from any rule category.
+
+    Args:
+        old_rules: Rule set the current labels were computed with
+        new_rules: Proposed rule set
+
+    Returns:
+        Set of phrases whose membership differs in at least one category
+    """
+    phrases = set()
+    for category in set(old_rules) | set(new_rules):
+        phrases |= set(old_rules.get(category, [])) ^ set(new_rules.get(category, []))
+    return phrases
+
+
+class RuleIndex:
+    """
+    Classified assistant turns with a trigram index over their text.
+
+    Attributes:
+        rules: Rule set the stored labels were computed with
+        threads: Thread IDs and conditions of the corpus, in corpus order
+        turns: Classified turns (CLASSIFICATION_COLUMNS, without text)
+        vocabulary: Dict of trigram to (start, end) of its rows in postings
+        postings: Row positions in turns of every trigram, concatenated;
+            each trigram's slice is sorted
+        offsets: Byte offsets of the turn texts in texts (length n_turns + 1)
+        texts: Turn texts, concatenated UTF-8 (uint8 array)
+    """
+
+    def __init__(self, rules: Dict[str, List[str]], threads: List[Dict], turns: pd.DataFrame,
+                 vocabulary: Dict[str, Tuple[int, int]], postings: np.ndarray,
+                 offsets: np.ndarray, texts: np.ndarray):
+        self.rules = {category: list(phrases) for category, phrases in rules.items()}
+        self.threads = threads
+        self.turns = turns[CLASSIFICATION_COLUMNS].reset_index(drop=True)
+        self.vocabulary = vocabulary
+        self.postings = postings
+        self.offsets = offsets
+        self.texts = texts
+
+    @classmethod
+    def build(cls, conversations: List[Dict], turns_df: pd.DataFrame,
+              rules: Optional[Dict[str, List[str]]] = None) -> "RuleIndex":
+        """
+        Index a classified corpus.
+
+        Args:
+            conversations: Conversations the turns were extracted from
+            turns_df: Classified turns with CLASSIFICATION_COLUMNS and assistant_text
+                (e.g., AnalysisResults.turns_df)
+            rules: Rule set turns_df was classified with (default DEFAULT_RULES)
+
+        Returns:
+            RuleIndex for the corpus
+        """
+        threads = [{"thread_id": conv["thread_id"], "condition": conv["condition"]}
+                   for conv in conversations]
+
+        rows_by_ngram = {}
+        encoded = []
+        for row, text in enumerate(turns_df["assistant_text"]):
+            encoded.append(text.encode("utf-8"))
+            for ngram in text_ngrams(text):
+                rows_by_ngram.setdefault(ngram, []).append(row)
+
+        vocabulary = {}
+        start = 0
+        for ngram, rows in rows_by_ngram.items():
+            vocabulary[ngram] = (start, start + len(rows))
+            start += len(rows)
+        postings = np.fromiter((row for rows in rows_by_ngram.values() for row in rows),
+                               dtype=np.int64, count=start)
+
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(text) for text in encoded])
+        texts = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        return cls(rules or DEFAULT_RULES, threads, turns_df, vocabulary, postings, offsets, texts)
+
+    def save(self, path: str, labels_only: bool = False) -> None:
+        """
+        Write the index to a directory.
+
+        Args:
+            path: Index directory (created if needed)
+            labels_only: Only rewrite labels.json (rules and labels); the
+                other files must already hold this index's postings and texts
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        if not labels_only:
+            np.save(path / POSTINGS_FILENAME, np.asarray(self.postings))
+            np.save(path / OFFSETS_FILENAME, np.asarray(self.offsets))
+            with open(path / TEXTS_FILENAME, "wb") as f:
+                f.write(np.asarray(self.texts).tobytes())
+
+        turns = self.turns.astype(object).where(self.turns.notna(), None)
+        payload = {
+            "version": RULE_INDEX_VERSION,
+            "ngram_size": NGRAM_SIZE,
+            "rules": self.rules,
+            "threads": self.threads,
+            "vocabulary": {ngram: list(bounds) for ngram, bounds in self.vocabulary.items()},
+            "turns": {column: turns[column].tolist() for column in turns.columns},
+        }
+        # Write then rename, so an interrupted update leaves the old labels intact
+        labels_path = path / LABELS_FILENAME
+        partial_path = labels_path.with_suffix(".json.partial")
+        with open(partial_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        partial_path.replace(labels_path)
+
+    @classmethod
+    def load(cls, path: str) -> "RuleIndex":
+        """Open an index directory written by save(), memory-mapping postings and texts."""
+        path = Path(path)
+        if not (path / LABELS_FILENAME).is_file():
+            raise ValueError(f"{path} is not a rule index directory (an index from an older "
+                             f"version is a single file); rebuild it")
+        with open(path / LABELS_FILENAME, "r", encoding="utf-8") as f:
+            payload = json.load(f)
+        if payload.get("version") != RULE_INDEX_VERSION or payload.get("ngram_size") != NGRAM_SIZE:
+            raise ValueError(f"{path} was written by an incompatible version; rebuild it")
+
+        texts_path = path / TEXTS_FILENAME
+        if texts_path.stat().st_size:
+            texts = np.memmap(texts_path, dtype=np.uint8, mode="r")
+        else:
+            texts = np.zeros(0, dtype=np.uint8)
+        vocabulary = {ngram: tuple(bounds) for ngram, bounds in payload["vocabulary"].items()}
+        turns = pd.DataFrame(payload["turns"], columns=CLASSIFICATION_COLUMNS)
+        return cls(payload["rules"], payload["threads"], turns, vocabulary,
+                   np.load(path / POSTINGS_FILENAME, mmap_mode="r"),
+                   np.load(path / OFFSETS_FILENAME, mmap_mode="r"), texts)
+
+    def text(self, row: int) -> str:
+        """Assistant text of one turn."""
+        return bytes(self.texts[self.offsets[row]:self.offsets[row + 1]]).decode("utf-8")
+
+    def rows_with_ngram(self, ngram: str) -> np.ndarray:
+        """Sorted rows of turns whose normalized text contains a trigram."""
+        start, end = self.vocabulary.get(ngram, (0, 0))
+        return np.asarray(self.postings[start:end])
+
+    def turns_containing(self, phrase: str) -> np.ndarray:
+        """
+        Rows of turns whose normalized text contains a phrase.
+
+        Args:
+            phrase: Phrase to look up (normalized before matching)
+
+        Returns:
+            Sorted array of row positions in self.turns
+        """
+        phrase = normalize_text(phrase)
+        ngrams = text_ngrams(phrase)
+        if len(phrase) < NGRAM_SIZE:
+            # Too short to index: every turn is a candidate
+            candidates = np.arange(len(self.turns))
+        elif any(ngram not in self.vocabulary for ngram in ngrams):
+            return np.zeros(0, dtype=np.int64)
+        else:
+            # Intersect from the rarest trigram up
+            ngrams = sorted(ngrams, key=lambda ngram: self.vocabulary[ngram][1] - self.vocabulary[ngram][0])
+            candidates = self.rows_with_ngram(ngrams[0])
+            for ngram in ngrams[1:]:
+                if len(candidates) == 0:
+                    break
+                candidates = np.intersect1d(candidates, self.rows_with_ngram(ngram), assume_unique=True)
+
+        # Trigram hits are candidates; confirm the phrase itself occurs
+        return np.array([row for row in candidates if phrase in normalize_text(self.text(row))],
+                        dtype=np.int64)
+
+    def affected_turns(self, new_rules: Dict[str, List[str]]) -> np.ndarray:
+        """
+        Rows of turns whose class may differ under a new rule set.
+
+        Args:
+            new_rules: Proposed rule set
+
+        Returns:
+            Sorted array of row positions of turns containing a changed phrase
+        """
+        affected = [self.turns_containing(phrase) for phrase in changed_phrases(self.rules, new_rules)]
+        if not affected:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(affected))
+
+    def classified_turns(self) -> pd.DataFrame:
+        """Current labels as a classified-turns frame (CLASSIFICATION_COLUMNS)."""
+        return self.turns[CLASSIFICATION_COLUMNS]
+
+    def summary_stats(self) -> Dict:
+        """Summary statistics for the current labels (see compute_summary_stats())."""
+        turns = self.classified_turns()
+        return compute_summary_stats(compute_final_outcomes(turns),
+                                     build_thread_summary(self.threads, turns))
+
+    def apply_rules(self, new_rules: Dict[str, List[str]]) -> Dict:
+        """
+        Reclassify the turns affected by a rule change and update the index.
+
+        Args:
+            new_rules: New rule set (keys of DEFAULT_RULES)
+
+        Returns:
+            Dictionary with:
+                - n_turns: Number of indexed turns
+                - n_reclassified: Number of turns reclassified
+                - changed_phrases: Sorted list of added or removed phrases
+                - label_changes: DataFrame of turns whose class changed, with
+                  old_class and new_class columns
+                - stats_before, stats_after: Summary statistics before and
+                  after the change
+        """
+        phrases = changed_phrases(self.rules, new_rules)
+        rows = self.affected_turns(new_rules)
+        stats_before = self.summary_stats()
+
+        old_classes = self.turns["response_class"].to_numpy()[rows]
+        new_classes = np.array([
+            classify_response(prompt_id, self.text(row), new_rules).value
+            for prompt_id, row in zip(self.turns["prompt_id"].to_numpy()[rows], rows)
+        ], dtype=object)
+
+        changed = rows[old_classes != new_classes]
+        label_changes = self.turns.loc[changed, ["thread_id", "condition", "user_turn_index", "prompt_id"]].copy()
+        label_changes["old_class"] = old_classes[old_classes != new_classes]
+        label_changes["new_class"] = new_classes[old_classes != new_classes]
+
+        if len(rows):
+            self.turns.loc[rows, "response_class"] = new_classes
+        self.rules = {category: list(phrases) for category, phrases in new_rules.items()}
+
+        return {
+            "n_turns": len(self.turns),
+            "n_reclassified": len(rows),
+            "changed_phrases": sorted(phrases),
+            "label_changes": label_changes.reset_index(drop=True),
+            "stats_before": stats_before,
+            "stats_after": self.summary_stats(),
+        }
+
+
+def format_rule_change_report(change: Dict) -> str:
+    """
+    Format the result of RuleIndex.apply_rules() for the console.
+
+    Args:
+        change: Output of RuleIndex.apply_rules()
+
+    Returns:
+        Multi-line report text
+    """
+    lines = [
+        "RULE CHANGE IMPACT",
+        "-" * 70,
+        f"Changed phrases: {len(change['changed_phrases'])}",
+    ]
+    lines += [f"  {phrase!r}" for phrase in change["changed_phrases"]]
+    lines.append(f"Reclassified {change['n_reclassified']} of {change['n_turns']} turns; "
+                 f"{len(change['label_changes'])} changed class")
+
+    if len(change["label_changes"]):
+        lines += ["", change["label_changes"].to_string(index=False)]
+
+    for analysis, title in [("first_attempts", "PRIMARY (final outcomes)"),
+                            ("all_attempts", "SECONDARY (all attempts)")]:
+        before = change["stats_before"][analysis]
+        after = change["stats_after"][analysis]
+        lines += ["", f"{title}:"]
+        for condition in ["control", "contaminated"]:
+            b, a = before[condition], after[condition]
+            lines.append(
+                f"  {condition.capitalize()} refusal rate: {b['refusal_rate']:.2%} -> {a['refusal_rate']:.2%} "
+                f"({b['refusals']}/{b['evaluable']} -> {a['refusals']}/{a['evaluable']})"
+            )
+        lines.append(f"  Fisher p-value: {before['p_value']:.2e} -> {after['p_value']:.2e}")
+        lines.append(f"  Cohen's h: {before['cohen_h']:.2f} -> {after['cohen_h']:.2f}")
+
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from run_analysis import AnalysisResults
+
+    repo_root = Path(__file__).parent.parent
+    default_index = repo_root / "data" / "processed" / DEFAULT_INDEX_DIRNAME
+
+    parser = argparse.ArgumentParser(description="Reclassify only the turns affected by a rule change.")
+    parser.add_argument("command", choices=["build", "update"],
+                        help="build: index the corpus with the current rules; "
+                             "update: apply the current (or --rules) rule set to an existing index")
+    parser.add_argument("--index", default=str(default_index), help="Index directory")
+    parser.add_argument("--rules", default=None,
+                        help="JSON file mapping rule categories to proposed phrase lists "
+                             "(default: rules in classify_responses.py)")
+    parser.add_argument("--dry-run", action="store_true", help="Report the impact without saving the index")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        results = AnalysisResults(str(repo_root))
+        index = RuleIndex.build(results.conversations, results.turns_df)
+        index.save(args.index)
+        print(f"Indexed {len(index.turns)} turns ({len(index.vocabulary)} trigrams) into {args.index}")
+    else:
+        index = RuleIndex.load(args.index)
+        if args.rules:
+            # Categories missing from the file keep their indexed phrases
+            with open(args.rules, "r", encoding="utf-8") as f:
+                new_rules = {**index.rules, **json.load(f)}
+        else:
+            new_rules = DEFAULT_RULES
+        print(format_rule_change_report(index.apply_rules(new_rules)))
+        if not args.dry_run:
+            index.save(args.index, labels_only=True)
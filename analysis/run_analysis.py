@@ -7,11 +7,22 @@ This script:
 3. Generates summary statistics
 4. Produces visualization figures
 5. Runs statistical tests
+
+Every stage is exposed as an attribute of AnalysisResults and computed
+lazily on first access, so interactive sessions only pay for what they use:
+
+    results = AnalysisResults(repo_root)
+    results.stats["first_attempts"]["p_value"]   # no figures rendered
+
+analyze_conversations() runs the full pipeline with console output and
+file writing as optional sinks, and returns the AnalysisResults.
 """
 
 import os
 import sys
+from functools import cached_property
 from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
@@ -20,14 +31,28 @@ from scipy.stats import fisher_exact
 # Add analysis directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
-from parse_transcripts import load_all_conversations, get_user_assistant_pairs
+from parse_transcripts import load_all_conversations
 from classify_responses import (
-    identify_prompt_id,
-    classify_response,
+    CLASSIFICATION_COLUMNS,
+    classify_conversations,
     is_image_prompt,
     is_text_prompt,
     ResponseClass
 )
+from factor_stats import (
+    IMAGE_PROMPTS,
+    build_metadata_frame,
+    compute_final_outcomes,
+    compute_factor_stats
+)
+
+if TYPE_CHECKING:
+    from sequence_features import SequenceTensors
+
+FIGURE_FILENAMES = {
+    "refusal_rates": "fig1_refusal_rates.png",
+    "per_thread_heatmap": "fig2_per_thread_heatmap.png",
+}
 
 
 def cohen_h(p1: float, p2: float) -> float:
@@ -47,66 +72,17 @@ def cohen_h(p1: float, p2: float) -> float:
     return phi1 - phi2
 
 
-def analyze_conversations(base_dir: str):
+def build_thread_summary(conversations: List[Dict], turns_df: pd.DataFrame) -> pd.DataFrame:
     """
-    Run the complete analysis pipeline.
+    Build the per-thread summary (one row of thread_summary.csv per thread).
 
     Args:
-        base_dir: Base directory containing the data/ folder
-    """
-    print("=" * 70)
-    print("VIOLATION STATE ANALYSIS")
-    print("=" * 70)
-    print()
-
-    # Step 1: Load conversations
-    print("Step 1: Loading conversations...")
-    data_dir = Path(base_dir) / "data"
-    conversations = load_all_conversations(str(data_dir))
-    print(f"  Loaded {len(conversations)} conversations")
-    print(f"    Control: {sum(1 for c in conversations if c['condition'] == 'control')}")
-    print(f"    Contaminated: {sum(1 for c in conversations if c['condition'] == 'contaminated')}")
-    print()
+        conversations: Conversation dictionaries from load_all_conversations()
+        turns_df: Classified turns (text columns are not required)
 
-    # Step 2: Extract and classify turns
-    print("Step 2: Extracting and classifying turns...")
-    turns_data = []
-
-    for conv in conversations:
-        thread_id = conv["thread_id"]
-        condition = conv["condition"]
-        pairs = get_user_assistant_pairs(conv)
-
-        for user_turn, assistant_turn in pairs:
-            prompt_id = identify_prompt_id(user_turn["text"])
-            response_class = classify_response(prompt_id, assistant_turn["text"])
-
-            turns_data.append({
-                "thread_id": thread_id,
-                "condition": condition,
-                "user_turn_index": user_turn["turn_index"],
-                "assistant_turn_index": assistant_turn["turn_index"],
-                "prompt_id": prompt_id,
-                "user_text": user_turn["text"],
-                "assistant_text": assistant_turn["text"],
-                "response_class": response_class.value
-            })
-
-    turns_df = pd.DataFrame(turns_data)
-    print(f"  Extracted {len(turns_df)} user-assistant exchanges")
-    print()
-
-    # Step 3: Save parsed turns
-    output_dir = Path(base_dir) / "data" / "processed"
-    output_dir.mkdir(exist_ok=True)
-
-    turns_csv_path = output_dir / "parsed_turns.csv"
-    turns_df.to_csv(turns_csv_path, index=False)
-    print(f"Step 3: Saved parsed turns to {turns_csv_path}")
-    print()
-
-    # Step 4: Build thread summary
-    print("Step 4: Building thread-level summary...")
+    Returns:
+        DataFrame of per-thread image and text prompt outcome counts
+    """
     thread_summaries = []
 
     for conv in conversations:
@@ -145,195 +121,234 @@ def analyze_conversations(base_dir: str):
             "n_t1_refusals": n_t1_refusals
         })
 
-    summary_df = pd.DataFrame(thread_summaries)
-    summary_csv_path = output_dir / "thread_summary.csv"
-    summary_df.to_csv(summary_csv_path, index=False)
-    print(f"  Saved thread summary to {summary_csv_path}")
-    print()
+    return pd.DataFrame(thread_summaries)
 
-    # Step 5: Calculate statistics
-    print("Step 5: Statistical Analysis")
-    print("-" * 70)
 
-    # Image prompt statistics by condition
-    control_summary = summary_df[summary_df["condition"] == "control"]
-    contaminated_summary = summary_df[summary_df["condition"] == "contaminated"]
+def first_attempt_counts(final_outcomes: pd.DataFrame) -> Dict[str, Dict[str, int]]:
+    """
+    Per-condition counts of final outcomes of the I1-I4 prompts.
+
+    Args:
+        final_outcomes: Output of compute_final_outcomes()
+
+    Returns:
+        Dictionary mapping "control" and "contaminated" to total, success,
+        refusals and rate_limits counts
+    """
+    # PRIMARY: final outcome of each I1-I4 prompt per thread.
+    # If retried after rate limit and succeeded, count as success.
+    # If never succeeded (all attempts were refusals/rate limits), count as refusal.
+    image_outcomes = final_outcomes[final_outcomes["prompt_id"].isin(IMAGE_PROMPTS)]
+
+    counts = {}
+    for condition in ["control", "contaminated"]:
+        cond_outcomes = image_outcomes[image_outcomes["condition"] == condition]
+        counts[condition] = {
+            "total": len(cond_outcomes),
+            "success": int((cond_outcomes["response_class"] == ResponseClass.IMAGE_SUCCESS.value).sum()),
+            # Refusals INCLUDE rate limits, as they represent failed attempts
+            "refusals": int(cond_outcomes["refused"].sum()),
+            "rate_limits": int((cond_outcomes["response_class"] == ResponseClass.RATE_LIMIT.value).sum()),
+        }
+    return counts
+
+
+def all_attempt_counts(summary_df: pd.DataFrame) -> Dict[str, Dict[str, int]]:
+    """
+    Per-condition counts of all image prompt attempts, including retries.
+
+    Args:
+        summary_df: Output of build_thread_summary()
 
-    # Calculate statistics for FIRST ATTEMPTS ONLY (matching paper methodology)
-    print("\n=== FIRST ATTEMPTS ONLY (per-thread, per-prompt) ===")
+    Returns:
+        Dictionary mapping "control" and "contaminated" to threads, total,
+        success, refusals and rate_limits counts
+    """
+    counts = {}
+    for condition in ["control", "contaminated"]:
+        cond_summary = summary_df[summary_df["condition"] == condition]
+        counts[condition] = {
+            "threads": len(cond_summary),
+            "total": int(cond_summary["n_image_prompts"].sum()),
+            "success": int(cond_summary["n_image_success"].sum()),
+            # Refusals are policy + capability, excluding rate limits
+            "refusals": int(cond_summary["n_image_policy_refusals"].sum() +
+                            cond_summary["n_image_capability_refusals"].sum()),
+            "rate_limits": int(cond_summary["n_rate_limit"].sum()),
+        }
+    return counts
+
+
+def summary_stats_from_counts(first_counts: Dict[str, Dict[str, int]],
+                              all_counts: Dict[str, Dict[str, int]]) -> Dict:
+    """
+    Compute the primary and secondary statistics from per-condition counts.
 
-    # Get the FINAL OUTCOME for each I1-I4 prompt per thread
-    # If retried after rate limit and succeeded, count as success
-    # If never succeeded (all attempts were refusals/rate limits), count as refusal
-    image_prompts = ['I1_KITCHEN', 'I2_BEDROOM', 'I3_ABSTRACT', 'I4_COFFEE']
-    first_attempts = []
+    Args:
+        first_counts: Output of first_attempt_counts()
+        all_counts: Output of all_attempt_counts()
 
-    for _, thread_row in summary_df.iterrows():
-        thread_id = thread_row['thread_id']
-        condition = thread_row['condition']
-        thread_turns = turns_df[turns_df['thread_id'] == thread_id]
+    Returns:
+        Dictionary in the format of compute_summary_stats()
+    """
+    first_attempts = {}
+    for condition in ["control", "contaminated"]:
+        counts = first_counts[condition]
+        # All attempts are evaluable (rate limits count as failures, not excluded)
+        evaluable = counts["total"]
+        first_attempts[condition] = {
+            "total": counts["total"],
+            "success": counts["success"],
+            "refusals": counts["refusals"],
+            "rate_limits": counts["rate_limits"],
+            "evaluable": evaluable,
+            "refusal_rate": counts["refusals"] / evaluable if evaluable > 0 else 0,
+        }
+
+    all_attempts = {}
+    for condition in ["control", "contaminated"]:
+        counts = all_counts[condition]
+        # Refusal rates exclude rate limits
+        evaluable = counts["total"] - counts["rate_limits"]
+        all_attempts[condition] = {
+            "threads": counts["threads"],
+            "total": counts["total"],
+            "success": counts["success"],
+            "refusals": counts["refusals"],
+            "rate_limits": counts["rate_limits"],
+            "evaluable": evaluable,
+            "refusal_rate": counts["refusals"] / evaluable if evaluable > 0 else 0,
+        }
+
+    for analysis in [first_attempts, all_attempts]:
+        control, contaminated = analysis["control"], analysis["contaminated"]
+        # Contingency table: [[control_success, control_refusals], [contaminated_success, contaminated_refusals]]
+        odds_ratio, p_value = fisher_exact([
+            [control["success"], control["refusals"]],
+            [contaminated["success"], contaminated["refusals"]]
+        ])
+        analysis["odds_ratio"] = odds_ratio
+        analysis["p_value"] = p_value
+        analysis["cohen_h"] = cohen_h(contaminated["refusal_rate"], control["refusal_rate"])
 
-        for prompt in image_prompts:
-            prompt_turns = thread_turns[thread_turns['prompt_id'] == prompt]
-            if len(prompt_turns) > 0:
-                # Determine final outcome
-                # If ANY attempt succeeded, count as success
-                has_success = any(prompt_turns['response_class'] == ResponseClass.IMAGE_SUCCESS.value)
+    return {"first_attempts": first_attempts, "all_attempts": all_attempts}
 
-                if has_success:
-                    final_outcome = ResponseClass.IMAGE_SUCCESS.value
-                else:
-                    # Otherwise, use the last attempt's classification
-                    # (captures whether it ended in policy refusal, capability refusal, or rate limit)
-                    final_outcome = prompt_turns.iloc[-1]['response_class']
-
-                first_attempts.append({
-                    'thread_id': thread_id,
-                    'condition': condition,
-                    'prompt_id': prompt,
-                    'response_class': final_outcome
-                })
-
-    first_attempts_df = pd.DataFrame(first_attempts)
-
-    # Calculate stats for first attempts
-    control_first = first_attempts_df[first_attempts_df['condition'] == 'control']
-    contaminated_first = first_attempts_df[first_attempts_df['condition'] == 'contaminated']
-
-    control_first_total = len(control_first)
-    contaminated_first_total = len(contaminated_first)
-
-    # Count refusals (INCLUDING rate limits, as they represent failed attempts)
-    control_first_refusals = len(control_first[
-        (control_first['response_class'] == ResponseClass.POLICY_REFUSAL.value) |
-        (control_first['response_class'] == ResponseClass.CAPABILITY_REFUSAL.value) |
-        (control_first['response_class'] == ResponseClass.RATE_LIMIT.value)
-    ])
-    contaminated_first_refusals = len(contaminated_first[
-        (contaminated_first['response_class'] == ResponseClass.POLICY_REFUSAL.value) |
-        (contaminated_first['response_class'] == ResponseClass.CAPABILITY_REFUSAL.value) |
-        (contaminated_first['response_class'] == ResponseClass.RATE_LIMIT.value)
-    ])
-
-    # Also track rate limits separately for reporting
-    control_first_rate_limits = len(control_first[control_first['response_class'] == ResponseClass.RATE_LIMIT.value])
-    contaminated_first_rate_limits = len(contaminated_first[contaminated_first['response_class'] == ResponseClass.RATE_LIMIT.value])
-
-    control_first_success = len(control_first[control_first['response_class'] == ResponseClass.IMAGE_SUCCESS.value])
-    contaminated_first_success = len(contaminated_first[contaminated_first['response_class'] == ResponseClass.IMAGE_SUCCESS.value])
-
-    # All attempts are evaluable (rate limits count as failures, not excluded)
-    control_first_evaluable = control_first_total
-    contaminated_first_evaluable = contaminated_first_total
-
-    control_first_refusal_rate = control_first_refusals / control_first_evaluable if control_first_evaluable > 0 else 0
-    contaminated_first_refusal_rate = contaminated_first_refusals / contaminated_first_evaluable if contaminated_first_evaluable > 0 else 0
-
-    print(f"Control (first attempts):")
-    print(f"  Total: {control_first_total}")
-    print(f"  Successful: {control_first_success}")
-    print(f"  Refused: {control_first_refusals} (includes {control_first_rate_limits} rate limits)")
-    print(f"  Refusal rate: {control_first_refusal_rate:.2%} ({control_first_refusals}/{control_first_evaluable})")
-
-    print(f"\nContaminated (first attempts):")
-    print(f"  Total: {contaminated_first_total}")
-    print(f"  Successful: {contaminated_first_success}")
-    print(f"  Refused: {contaminated_first_refusals} (includes {contaminated_first_rate_limits} rate limits)")
-    print(f"  Refusal rate: {contaminated_first_refusal_rate:.2%} ({contaminated_first_refusals}/{contaminated_first_evaluable})")
-
-    # Fisher's exact test for first attempts
-    contingency_first = [
-        [control_first_success, control_first_refusals],
-        [contaminated_first_success, contaminated_first_refusals]
-    ]
-    odds_ratio_first, p_value_first = fisher_exact(contingency_first)
-    h_first = cohen_h(contaminated_first_refusal_rate, control_first_refusal_rate)
-
-    print(f"\nFisher's Exact Test (first attempts):")
-    print(f"  Odds ratio: {odds_ratio_first:.4f}")
-    print(f"  p-value: {p_value_first:.2e}")
-    print(f"\nEffect Size - Cohen's h (first attempts):")
-    print(f"  h = {h_first:.2f}")
-
-    # Now show ALL ATTEMPTS for comparison
-    print("\n\n=== ALL ATTEMPTS (including retries) ===")
-
-    # Total image prompts
-    control_total_image = control_summary["n_image_prompts"].sum()
-    contaminated_total_image = contaminated_summary["n_image_prompts"].sum()
-
-    # Total refusals (policy + capability, excluding rate limits)
-    control_refusals = (control_summary["n_image_policy_refusals"].sum() +
-                       control_summary["n_image_capability_refusals"].sum())
-    contaminated_refusals = (contaminated_summary["n_image_policy_refusals"].sum() +
-                            contaminated_summary["n_image_capability_refusals"].sum())
-
-    # Rate limits
-    control_rate_limits = control_summary["n_rate_limit"].sum()
-    contaminated_rate_limits = contaminated_summary["n_rate_limit"].sum()
-
-    # Success counts
-    control_success = control_summary["n_image_success"].sum()
-    contaminated_success = contaminated_summary["n_image_success"].sum()
-
-    print(f"\nControl condition:")
-    print(f"  Total image prompts: {control_total_image}")
-    print(f"  Successful: {control_success}")
-    print(f"  Refused: {control_refusals}")
-    print(f"  Rate limited: {control_rate_limits}")
-
-    print(f"\nContaminated condition:")
-    print(f"  Total image prompts: {contaminated_total_image}")
-    print(f"  Successful: {contaminated_success}")
-    print(f"  Refused: {contaminated_refusals}")
-    print(f"  Rate limited: {contaminated_rate_limits}")
-
-    # Calculate refusal rates (excluding rate limits)
-    control_evaluable = control_total_image - control_rate_limits
-    contaminated_evaluable = contaminated_total_image - contaminated_rate_limits
-
-    control_refusal_rate = control_refusals / control_evaluable if control_evaluable > 0 else 0
-    contaminated_refusal_rate = contaminated_refusals / contaminated_evaluable if contaminated_evaluable > 0 else 0
-
-    print(f"\nRefusal rates (excluding rate limits):")
-    print(f"  Control: {control_refusals}/{control_evaluable} = {control_refusal_rate:.1%}")
-    print(f"  Contaminated: {contaminated_refusals}/{contaminated_evaluable} = {contaminated_refusal_rate:.1%}")
-
-    # Fisher's exact test
-    # Contingency table: [[control_success, control_refusals], [contaminated_success, contaminated_refusals]]
-    contingency_table = [
-        [control_success, control_refusals],
-        [contaminated_success, contaminated_refusals]
-    ]
 
-    odds_ratio, p_value = fisher_exact(contingency_table)
+def compute_summary_stats(final_outcomes: pd.DataFrame, summary_df: pd.DataFrame) -> Dict:
+    """
+    Compute the primary (final outcome) and secondary (all attempts) statistics.
 
-    print(f"\nFisher's Exact Test:")
-    print(f"  Odds ratio: {odds_ratio:.4f}")
-    print(f"  p-value: {p_value:.2e}")
+    Args:
+        final_outcomes: Output of compute_final_outcomes()
+        summary_df: Output of build_thread_summary()
+
+    Returns:
+        Dictionary with "first_attempts" and "all_attempts" entries. Each holds
+        per-condition counts under "control" and "contaminated" plus
+        odds_ratio, p_value and cohen_h for the control-vs-contaminated test.
+    """
+    return summary_stats_from_counts(first_attempt_counts(final_outcomes),
+                                     all_attempt_counts(summary_df))
 
-    # Cohen's h
-    h = cohen_h(contaminated_refusal_rate, control_refusal_rate)
 
-    print(f"\nEffect Size (Cohen's h):")
-    print(f"  h = {h:.2f}")
-    print(f"  Interpretation: ", end="")
+def effect_size_label(h: float) -> str:
+    """Verbal label for a Cohen's h value, as printed in the console report."""
     if abs(h) < 0.2:
-        print("small effect")
+        return "small effect"
     elif abs(h) < 0.5:
-        print("medium effect")
+        return "medium effect"
     else:
-        print("large effect")
+        return "large effect"
+
+
+def format_stats_report(stats: Dict) -> str:
+    """
+    Format the console report for Step 5 (statistical analysis).
+
+    Args:
+        stats: Output of compute_summary_stats()
+
+    Returns:
+        Multi-line report text
+    """
+    first = stats["first_attempts"]
+    every = stats["all_attempts"]
+    fc, fx = first["control"], first["contaminated"]
+    ac, ax = every["control"], every["contaminated"]
+
+    return f"""
+=== FIRST ATTEMPTS ONLY (per-thread, per-prompt) ===
+Control (first attempts):
+  Total: {fc['total']}
+  Successful: {fc['success']}
+  Refused: {fc['refusals']} (includes {fc['rate_limits']} rate limits)
+  Refusal rate: {fc['refusal_rate']:.2%} ({fc['refusals']}/{fc['evaluable']})
+
+Contaminated (first attempts):
+  Total: {fx['total']}
+  Successful: {fx['success']}
+  Refused: {fx['refusals']} (includes {fx['rate_limits']} rate limits)
+  Refusal rate: {fx['refusal_rate']:.2%} ({fx['refusals']}/{fx['evaluable']})
+
+Fisher's Exact Test (first attempts):
+  Odds ratio: {first['odds_ratio']:.4f}
+  p-value: {first['p_value']:.2e}
+
+Effect Size - Cohen's h (first attempts):
+  h = {first['cohen_h']:.2f}
+
+
+=== ALL ATTEMPTS (including retries) ===
+
+Control condition:
+  Total image prompts: {ac['total']}
+  Successful: {ac['success']}
+  Refused: {ac['refusals']}
+  Rate limited: {ac['rate_limits']}
+
+Contaminated condition:
+  Total image prompts: {ax['total']}
+  Successful: {ax['success']}
+  Refused: {ax['refusals']}
+  Rate limited: {ax['rate_limits']}
+
+Refusal rates (excluding rate limits):
+  Control: {ac['refusals']}/{ac['evaluable']} = {ac['refusal_rate']:.1%}
+  Contaminated: {ax['refusals']}/{ax['evaluable']} = {ax['refusal_rate']:.1%}
 
-    # Save summary statistics
-    stats_text = f"""VIOLATION STATE SUMMARY STATISTICS
+Fisher's Exact Test:
+  Odds ratio: {every['odds_ratio']:.4f}
+  p-value: {every['p_value']:.2e}
+
+Effect Size (Cohen's h):
+  h = {every['cohen_h']:.2f}
+  Interpretation: {effect_size_label(every['cohen_h'])}"""
+
+
+def format_summary_stats(stats: Dict, n_conversations: int) -> str:
+    """
+    Format the contents of summary_stats.txt.
+
+    Args:
+        stats: Output of compute_summary_stats()
+        n_conversations: Total number of conversations analyzed
+
+    Returns:
+        Summary statistics text
+    """
+    first = stats["first_attempts"]
+    every = stats["all_attempts"]
+    fc, fx = first["control"], first["contaminated"]
+    ac, ax = every["control"], every["contaminated"]
+
+    return f"""VIOLATION STATE SUMMARY STATISTICS
 {'=' * 70}
 
 SAMPLE SIZE
 -----------
-Total conversations: {len(conversations)}
-  Control: {len(control_summary)}
-  Contaminated: {len(contaminated_summary)}
+Total conversations: {n_conversations}
+  Control: {ac['threads']}
+  Contaminated: {ax['threads']}
 
 PRIMARY ANALYSIS: FIRST ATTEMPTS ONLY
 --------------------------------------
@@ -341,88 +356,309 @@ PRIMARY ANALYSIS: FIRST ATTEMPTS ONLY
 (Note: Rate limits are counted as refusals - failed attempts)
 
 Control:
-  Total prompts: {control_first_total}
-  Successful: {control_first_success}
-  Refused: {control_first_refusals} (includes {control_first_rate_limits} rate limits)
-  Refusal rate: {control_first_refusal_rate:.2%} ({control_first_refusals}/{control_first_evaluable})
+  Total prompts: {fc['total']}
+  Successful: {fc['success']}
+  Refused: {fc['refusals']} (includes {fc['rate_limits']} rate limits)
+  Refusal rate: {fc['refusal_rate']:.2%} ({fc['refusals']}/{fc['evaluable']})
 
 Contaminated:
-  Total prompts: {contaminated_first_total}
-  Successful: {contaminated_first_success}
-  Refused: {contaminated_first_refusals} (includes {contaminated_first_rate_limits} rate limits)
-  Refusal rate: {contaminated_first_refusal_rate:.2%} ({contaminated_first_refusals}/{contaminated_first_evaluable})
+  Total prompts: {fx['total']}
+  Successful: {fx['success']}
+  Refused: {fx['refusals']} (includes {fx['rate_limits']} rate limits)
+  Refusal rate: {fx['refusal_rate']:.2%} ({fx['refusals']}/{fx['evaluable']})
 
 STATISTICAL TESTS (First Attempts)
 -----------------------------------
 Fisher's Exact Test:
-  Odds ratio: {odds_ratio_first:.4f}
-  p-value: {p_value_first:.2e}
+  Odds ratio: {first['odds_ratio']:.4f}
+  p-value: {first['p_value']:.2e}
 
 Effect Size (Cohen's h):
-  h = {h_first:.2f} (large effect)
+  h = {first['cohen_h']:.2f} (large effect)
 
 SECONDARY ANALYSIS: ALL ATTEMPTS
 ---------------------------------
 (Includes retry attempts after rate limits or continued refusals)
 
 Control:
-  Total prompts: {control_total_image}
-  Successful: {control_success}
-  Refused: {control_refusals}
-  Rate limited: {control_rate_limits}
-  Refusal rate: {control_refusal_rate:.1%} ({control_refusals}/{control_evaluable})
+  Total prompts: {ac['total']}
+  Successful: {ac['success']}
+  Refused: {ac['refusals']}
+  Rate limited: {ac['rate_limits']}
+  Refusal rate: {ac['refusal_rate']:.1%} ({ac['refusals']}/{ac['evaluable']})
 
 Contaminated:
-  Total prompts: {contaminated_total_image}
-  Successful: {contaminated_success}
-  Refused: {contaminated_refusals}
-  Rate limited: {contaminated_rate_limits}
-  Refusal rate: {contaminated_refusal_rate:.1%} ({contaminated_refusals}/{contaminated_evaluable})
+  Total prompts: {ax['total']}
+  Successful: {ax['success']}
+  Refused: {ax['refusals']}
+  Rate limited: {ax['rate_limits']}
+  Refusal rate: {ax['refusal_rate']:.1%} ({ax['refusals']}/{ax['evaluable']})
 
 INTERPRETATION
 --------------
 The contaminated condition shows a statistically significant increase in
 refusal rates compared to control (p < 0.001). The effect size is very large
-(Cohen's h = {h_first:.2f}), indicating that the copyright-related trigger has a
+(Cohen's h = {first['cohen_h']:.2f}), indicating that the copyright-related trigger has a
 substantial impact on subsequent image generation requests in the same conversation.
 
 The primary analysis uses first attempts only to avoid inflating counts from
 retry attempts, which is methodologically cleaner for reporting the core effect.
 """
 
-    figures_dir = Path(base_dir) / "analysis" / "figures"
-    figures_dir.mkdir(exist_ok=True, parents=True)
 
-    stats_path = figures_dir / "summary_stats.txt"
-    with open(stats_path, 'w') as f:
-        f.write(stats_text)
+class AnalysisResults:
+    """
+    Lazily evaluated results of the analysis pipeline.
+
+    Each attribute is computed on first access and memoized. Accessing
+    stats, for example, parses and classifies the corpus but never builds
+    the text-carrying turns frame or renders figures.
+
+    Attributes:
+        conversations: Parsed conversations (list of dicts)
+        turns_df: Classified exchanges including user/assistant text
+            (the contents of parsed_turns.csv)
+        classified_turns: Same rows as turns_df without the text columns
+        thread_summary: Per-thread outcome counts (thread_summary.csv)
+        final_outcomes: Final outcome of each prompt per thread
+        metadata: Per-thread metadata factors
+        stats: Primary and secondary statistics (see compute_summary_stats())
+        factor_stats: Per-prompt, per-factor statistics
+        sequence_tensors: Thread x position feature arrays (see sequence_features)
+        summary_text: Contents of summary_stats.txt
+        figures: Dict of figure name to matplotlib Figure
+    """
+
+    def __init__(self, base_dir: str, conversations: Optional[List[Dict]] = None,
+                 corpus_path: Optional[str] = None):
+        """
+        Args:
+            base_dir: Base directory containing the data/ folder
+            conversations: Pre-loaded conversations. If None, they are loaded
+                from base_dir/data on first access.
+            corpus_path: Optional packed corpus file (see corpus_pack) to
+                load conversations from instead of the transcript directory
+        """
+        self.base_dir = Path(base_dir)
+        self.corpus_path = corpus_path
+        if conversations is not None:
+            self.conversations = conversations
+
+    @property
+    def output_dir(self) -> Path:
+        return self.base_dir / "data" / "processed"
+
+    @property
+    def figures_dir(self) -> Path:
+        return self.base_dir / "analysis" / "figures"
+
+    @cached_property
+    def conversations(self) -> List[Dict]:
+        if self.corpus_path is not None:
+            from corpus_pack import load_packed_conversations
+
+            return load_packed_conversations(self.corpus_path)
+        return load_all_conversations(str(self.base_dir / "data"))
+
+    @cached_property
+    def _turn_records(self) -> List[Dict]:
+        return classify_conversations(self.conversations)
+
+    @cached_property
+    def turns_df(self) -> pd.DataFrame:
+        return pd.DataFrame(self._turn_records)
+
+    @cached_property
+    def classified_turns(self) -> pd.DataFrame:
+        if "turns_df" in self.__dict__:
+            return self.turns_df[CLASSIFICATION_COLUMNS]
+        return pd.DataFrame(
+            [{column: record[column] for column in CLASSIFICATION_COLUMNS}
+             for record in self._turn_records],
+            columns=CLASSIFICATION_COLUMNS
+        )
+
+    @cached_property
+    def thread_summary(self) -> pd.DataFrame:
+        return build_thread_summary(self.conversations, self.classified_turns)
+
+    @cached_property
+    def final_outcomes(self) -> pd.DataFrame:
+        return compute_final_outcomes(self.classified_turns)
+
+    @cached_property
+    def metadata(self) -> pd.DataFrame:
+        return build_metadata_frame(self.conversations)
+
+    @cached_property
+    def stats(self) -> Dict:
+        return compute_summary_stats(self.final_outcomes, self.thread_summary)
+
+    @cached_property
+    def factor_stats(self) -> pd.DataFrame:
+        return compute_factor_stats(self.final_outcomes, self.metadata)
+
+    @cached_property
+    def sequence_tensors(self) -> "SequenceTensors":
+        from sequence_features import build_sequence_tensors
+
+        return build_sequence_tensors(self.classified_turns)
+
+    @cached_property
+    def summary_text(self) -> str:
+        return format_summary_stats(self.stats, len(self.conversations))
+
+    @cached_property
+    def figures(self) -> Dict[str, plt.Figure]:
+        return build_figures(self.thread_summary, self.classified_turns,
+                             self.stats["first_attempts"])
+
+
+def analyze_conversations(base_dir: str, verbose: bool = True,
+                          write_files: bool = True,
+                          corpus_path: Optional[str] = None) -> AnalysisResults:
+    """
+    Run the complete analysis pipeline.
+
+    Args:
+        base_dir: Base directory containing the data/ folder
+        verbose: Print a step-by-step report to stdout
+        write_files: Write CSVs, summary statistics and figures under base_dir
+        corpus_path: Optional packed corpus file to load instead of the
+            transcript directory (see corpus_pack)
+
+    Returns:
+        AnalysisResults for the corpus, with every stage evaluated
+    """
+    log = print if verbose else _silent
+    results = AnalysisResults(base_dir, corpus_path=corpus_path)
+
+    log("=" * 70)
+    log("VIOLATION STATE ANALYSIS")
+    log("=" * 70)
+    log()
+
+    # Step 1: Load conversations
+    log("Step 1: Loading conversations...")
+    conversations = results.conversations
+    log(f"  Loaded {len(conversations)} conversations")
+    log(f"    Control: {sum(1 for c in conversations if c['condition'] == 'control')}")
+    log(f"    Contaminated: {sum(1 for c in conversations if c['condition'] == 'contaminated')}")
+    log()
+
+    # Step 2: Extract and classify turns
+    log("Step 2: Extracting and classifying turns...")
+    turns_df = results.turns_df
+    log(f"  Extracted {len(turns_df)} user-assistant exchanges")
+    log()
+
+    # Step 3: Save parsed turns
+    output_dir = results.output_dir
+    figures_dir = results.figures_dir
+    if write_files:
+        output_dir.mkdir(exist_ok=True)
+        figures_dir.mkdir(exist_ok=True, parents=True)
+
+        turns_csv_path = output_dir / "parsed_turns.csv"
+        turns_df.to_csv(turns_csv_path, index=False)
+        log(f"Step 3: Saved parsed turns to {turns_csv_path}")
+    else:
+        log("Step 3: Not saving parsed turns (write_files=False)")
+    log()
+
+    # Step 4: Build thread summary
+    log("Step 4: Building thread-level summary...")
+    summary_df = results.thread_summary
+    if write_files:
+        summary_csv_path = output_dir / "thread_summary.csv"
+        summary_df.to_csv(summary_csv_path, index=False)
+        log(f"  Saved thread summary to {summary_csv_path}")
+
+        final_outcomes_path = output_dir / "final_outcomes.csv"
+        results.final_outcomes.to_csv(final_outcomes_path, index=False)
+        log(f"  Saved final outcomes to {final_outcomes_path}")
+    log()
+
+    # Step 5: Calculate statistics
+    log("Step 5: Statistical Analysis")
+    log("-" * 70)
+    log(format_stats_report(results.stats))
 
-    print(f"\nSaved summary statistics to {stats_path}")
+    if write_files:
+        stats_path = figures_dir / "summary_stats.txt"
+        with open(stats_path, 'w') as f:
+            f.write(results.summary_text)
+        log(f"\nSaved summary statistics to {stats_path}")
 
     # Step 6: Generate figures
-    print("\nStep 6: Generating figures...")
-    generate_figures(summary_df, figures_dir, control_first_refusal_rate, contaminated_first_refusal_rate,
-                    control_first_refusals, control_first_evaluable,
-                    contaminated_first_refusals, contaminated_first_evaluable,
-                    odds_ratio_first, p_value_first, h_first)
+    log("\nStep 6: Generating figures...")
+    figures = results.figures
+    if write_files:
+        for fig_path in save_figures(figures, figures_dir):
+            log(f"  Generated {fig_path}")
+
+    # Step 7: Per-prompt, per-factor statistics
+    log("\nStep 7: Computing per-prompt and per-factor statistics...")
+    factor_stats_df = results.factor_stats
+    n_factors = len(results.metadata.columns) - 2
+    log(f"  Computed {len(factor_stats_df)} contingency tables over {n_factors} metadata factors")
+    if write_files:
+        factor_stats_path = output_dir / "factor_stats.csv"
+        factor_stats_df.to_csv(factor_stats_path, index=False)
+        log(f"  Saved factor statistics to {factor_stats_path}")
+
+    log()
+    log("=" * 70)
+    log("ANALYSIS COMPLETE")
+    log("=" * 70)
 
-    print()
-    print("=" * 70)
-    print("ANALYSIS COMPLETE")
-    print("=" * 70)
+    return results
 
 
-def generate_figures(summary_df, figures_dir, control_rate, contaminated_rate,
-                    control_refusals, control_evaluable,
-                    contaminated_refusals, contaminated_evaluable,
-                    odds_ratio, p_value, cohen_h_value):
-    """Generate visualization figures."""
+def _silent(*args, **kwargs):
+    """Console sink that discards output."""
+
+
+def save_figures(figures: Dict[str, plt.Figure], figures_dir: Path) -> List[Path]:
+    """
+    Write figures to disk as 300 dpi PNGs.
+
+    Args:
+        figures: Output of build_figures()
+        figures_dir: Directory to write into
+
+    Returns:
+        List of written paths
+    """
+    paths = []
+    for name, fig in figures.items():
+        fig_path = Path(figures_dir) / FIGURE_FILENAMES.get(name, f"{name}.png")
+        fig.savefig(fig_path, dpi=300, bbox_inches='tight')
+        paths.append(fig_path)
+    return paths
+
+
+def build_figures(summary_df: pd.DataFrame, turns_df: pd.DataFrame,
+                  first_attempts: Dict) -> Dict[str, plt.Figure]:
+    """
+    Build visualization figures.
+
+    Args:
+        summary_df: Output of build_thread_summary()
+        turns_df: Classified turns (text columns are not required)
+        first_attempts: The "first_attempts" entry of compute_summary_stats()
+
+    Returns:
+        Dict of figure name to matplotlib Figure (not yet saved)
+    """
+    figures = {}
 
     # Figure 1: Refusal rates bar chart
     fig, ax = plt.subplots(figsize=(8, 6))
 
     conditions = ['Control', 'Contaminated']
-    rates = [control_rate * 100, contaminated_rate * 100]
+    rates = [first_attempts["control"]["refusal_rate"] * 100,
+             first_attempts["contaminated"]["refusal_rate"] * 100]
     colors = ['#2ecc71', '#e74c3c']
 
     bars = ax.bar(conditions, rates, color=colors, alpha=0.8, edgecolor='black', linewidth=1.5)
@@ -442,12 +678,10 @@ def generate_figures(summary_df, figures_dir, control_rate, contaminated_rate,
     ax.grid(axis='y', alpha=0.3, linestyle='--')
     ax.set_axisbelow(True)
 
-    plt.tight_layout()
-    fig1_path = figures_dir / "fig1_refusal_rates.png"
-    plt.savefig(fig1_path, dpi=300, bbox_inches='tight')
-    plt.close()
-
-    print(f"  Generated {fig1_path}")
+    fig.tight_layout()
+    # Detach from pyplot so figures held by AnalysisResults don't accumulate
+    plt.close(fig)
+    figures["refusal_rates"] = fig
 
     # Figure 2: Per-thread heatmap
     fig, ax = plt.subplots(figsize=(10, 8))
@@ -458,12 +692,8 @@ def generate_figures(summary_df, figures_dir, control_rate, contaminated_rate,
     # Sort by condition and thread_id
     summary_sorted = summary_df.sort_values(['condition', 'thread_id'])
 
-    # We need to get detailed turn data
-    turns_csv_path = Path(figures_dir).parent.parent / "data" / "processed" / "parsed_turns.csv"
-    turns_df = pd.read_csv(turns_csv_path)
-
     # Create matrix: rows = threads, columns = prompts (I1, I2, I3, I4)
-    prompts_ordered = ['I1_KITCHEN', 'I2_BEDROOM', 'I3_ABSTRACT', 'I4_COFFEE']
+    prompts_ordered = IMAGE_PROMPTS
 
     matrix_data = []
     thread_labels = []
@@ -533,15 +763,48 @@ def generate_figures(summary_df, figures_dir, control_rate, contaminated_rate,
     ]
     ax.legend(handles=legend_elements, loc='upper left', bbox_to_anchor=(1.05, 1), fontsize=10)
 
-    plt.tight_layout()
-    fig2_path = figures_dir / "fig2_per_thread_heatmap.png"
-    plt.savefig(fig2_path, dpi=300, bbox_inches='tight')
-    plt.close()
+    fig.tight_layout()
+    plt.close(fig)
+    figures["per_thread_heatmap"] = fig
 
-    print(f"  Generated {fig2_path}")
+    return figures
 
 
 if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run the Violation State analysis pipeline.")
+    parser.add_argument("--corpus", default=None,
+                        help="Load transcripts from a packed corpus file (see corpus_pack.py)")
+    parser.add_argument("--approximate", action="store_true",
+                        help="Estimate the primary statistics from a stratified sample of threads")
+    parser.add_argument("--precision", type=float, default=0.02,
+                        help="Target half-width of the refusal-rate bounds (approximate mode)")
+    parser.add_argument("--initial", type=int, default=20,
+                        help="Threads per condition in the first sampling round (approximate mode)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed for sampling (approximate mode)")
+    parser.add_argument("--figure-sets", action="store_true",
+                        help="Also render per-prompt and per-condition figure sets (see figure_sets.py)")
+    parser.add_argument("--figure-formats", default="png",
+                        help="Comma-separated formats for --figure-sets (png, svg, pdf)")
+    args = parser.parse_args()
+
     # Run analysis from repository root
     repo_root = Path(__file__).parent.parent
-    analyze_conversations(str(repo_root))
+    if args.approximate:
+        from approximate import approximate_analysis, format_approximate_report
+
+        estimate = approximate_analysis(str(repo_root), precision=args.precision,
+                                        initial_per_condition=args.initial, seed=args.seed)
+        print(format_approximate_report(estimate))
+    else:
+        results = analyze_conversations(str(repo_root), corpus_path=args.corpus)
+        if args.figure_sets:
+            from figure_sets import build_figure_specs, render_figure_sets
+
+            sets_dir = results.figures_dir / "sets"
+            specs = build_figure_specs(results.factor_stats, results.final_outcomes, results.metadata)
+            rendered = render_figure_sets(specs, str(sets_dir), formats=args.figure_formats.split(","))
+            print(f"Figure sets: {len(rendered['rendered'])} rendered, "
+                  f"{len(rendered['skipped'])} unchanged in {sets_dir}")
@@ -0,0 +1,290 @@
+"""
+Sequence feature module for Violation State study.
+
+This module packs the classified corpus into compact NumPy arrays indexed by
+thread and turn position, so positional questions (refusal probability
+versus distance from the trigger, whether retries after a rate limit
+succeed, ...) are answered with vectorized operations instead of walking
+DataFrames row by row.
+
+Arrays are stored ragged: one entry per user-assistant exchange, threads
+laid out contiguously, and thread t occupying exchanges
+offsets[t]:offsets[t + 1]. SequenceTensors.to_padded() gives the dense
+thread x position view.
+"""
+
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from classify_responses import ResponseClass
+
+# Code tables. Prompt code -1 marks an unrecognized prompt.
+PROMPT_CODES = [
+    "TRIGGER", "CLEAN_RECREATION",
+    "I1_KITCHEN", "I2_BEDROOM", "I3_ABSTRACT", "I4_COFFEE",
+    "T1_MORTGAGE",
+]
+RESPONSE_CODES = [response_class.value for response_class in ResponseClass]
+CONDITION_CODES = ["control", "contaminated", "unknown"]
+
+UNKNOWN_CODE = -1
+
+
+class SequenceTensors:
+    """
+    Ragged per-exchange feature arrays for a classified corpus.
+
+    Attributes:
+        thread_ids: Thread ID of each thread (length n_threads)
+        condition: Condition code of each thread (index into CONDITION_CODES)
+        offsets: Start of each thread in the exchange arrays (length n_threads + 1)
+        prompt: Prompt code of each exchange (index into PROMPT_CODES, -1 if unknown)
+        response: Response class code of each exchange (index into RESPONSE_CODES)
+        position: Position of the exchange within its thread (0-based)
+        post_trigger: True for exchanges after the thread's TRIGGER exchange
+        trigger_distance: Exchanges since the TRIGGER (1 = immediately after),
+            or -1 if the exchange is not post-trigger
+        attempt: Attempt number at this prompt within the thread (1-based),
+            or 0 for unrecognized prompts, which cannot be told apart
+    """
+
+    def __init__(self, thread_ids: np.ndarray, condition: np.ndarray, offsets: np.ndarray,
+                 prompt: np.ndarray, response: np.ndarray, attempt: np.ndarray):
+        self.thread_ids = thread_ids
+        self.condition = condition
+        self.offsets = offsets
+        self.prompt = prompt
+        self.response = response
+        self.attempt = attempt
+
+        lengths = np.diff(offsets)
+        self.thread_index = np.repeat(np.arange(len(lengths)), lengths)
+        self.position = np.arange(len(prompt)) - offsets[self.thread_index]
+
+        # Position of the first TRIGGER in each thread (thread length if none)
+        is_trigger = prompt == PROMPT_CODES.index("TRIGGER")
+        trigger_position = lengths.copy()
+        np.minimum.at(trigger_position, self.thread_index[is_trigger], self.position[is_trigger])
+
+        distance = self.position - trigger_position[self.thread_index]
+        self.post_trigger = distance > 0
+        self.trigger_distance = np.where(self.post_trigger, distance, -1)
+
+    @property
+    def n_threads(self) -> int:
+        return len(self.thread_ids)
+
+    @property
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def exchange_condition(self) -> np.ndarray:
+        """Condition code broadcast to each exchange."""
+        return self.condition[self.thread_index]
+
+    def to_padded(self, values: np.ndarray, fill=UNKNOWN_CODE) -> np.ndarray:
+        """
+        Scatter a per-exchange array into a dense thread x position matrix.
+
+        Args:
+            values: Per-exchange array (e.g., self.response)
+            fill: Value for positions past the end of a thread
+
+        Returns:
+            Array of shape (n_threads, max thread length)
+        """
+        max_length = int(self.lengths.max()) if self.n_threads else 0
+        padded = np.full((self.n_threads, max_length), fill, dtype=np.result_type(values, np.min_scalar_type(fill)))
+        padded[self.thread_index, self.position] = values
+        return padded
+
+
+def build_sequence_tensors(turns_df: pd.DataFrame) -> SequenceTensors:
+    """
+    Build SequenceTensors from classified turns.
+
+    Args:
+        turns_df: Classified turns with thread_id, condition, user_turn_index,
+            prompt_id and response_class columns (text columns not needed)
+
+    Returns:
+        SequenceTensors with threads in order of first appearance
+    """
+    thread_codes, thread_ids = pd.factorize(turns_df["thread_id"])
+    order = np.lexsort((turns_df["user_turn_index"].to_numpy(), thread_codes))
+
+    thread_codes = thread_codes[order]
+    prompt = _encode(turns_df["prompt_id"].to_numpy()[order], PROMPT_CODES)
+    response = _encode(turns_df["response_class"].to_numpy()[order], RESPONSE_CODES)
+
+    offsets = np.zeros(len(thread_ids) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(thread_codes, minlength=len(thread_ids)))
+
+    # Condition of each thread from its first exchange
+    condition = _encode(turns_df["condition"].to_numpy()[order][offsets[:-1]], CONDITION_CODES)
+    condition[condition == UNKNOWN_CODE] = CONDITION_CODES.index("unknown")
+
+    # Attempt number: running count of each (thread, prompt) pair. Two
+    # unrecognized prompts are not retries of each other, so they get 0.
+    attempt = pd.Series(np.ones(len(order), dtype=np.int16)).groupby(
+        [thread_codes, prompt]
+    ).cumsum().to_numpy(dtype=np.int16, copy=True)
+    attempt[prompt == UNKNOWN_CODE] = 0
+
+    return SequenceTensors(np.asarray(thread_ids, dtype=object), condition, offsets,
+                           prompt, response, attempt)
+
+
+def _encode(values: np.ndarray, codes: List[str]) -> np.ndarray:
+    """Map labels to their index in codes (UNKNOWN_CODE for anything else)."""
+    lookup = pd.Index(codes)
+    return lookup.get_indexer(pd.Index(values)).astype(np.int8)
+
+
+def response_mask(tensors: SequenceTensors, classes: List[str]) -> np.ndarray:
+    """Per-exchange boolean mask of responses in the given classes."""
+    return np.isin(tensors.response, [RESPONSE_CODES.index(c) for c in classes])
+
+
+def prompt_mask(tensors: SequenceTensors, prompt_ids: List[str]) -> np.ndarray:
+    """Per-exchange boolean mask of exchanges at the given prompts."""
+    return np.isin(tensors.prompt, [PROMPT_CODES.index(p) for p in prompt_ids])
+
+
+def rate_by_position(positions: np.ndarray, event: np.ndarray,
+                     mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Event rate at each position.
+
+    Example: refusal probability versus distance from the trigger is
+    rate_by_position(t.trigger_distance, refused, mask=t.post_trigger).
+
+    Args:
+        positions: Per-exchange nonnegative position (e.g., t.position or
+            t.trigger_distance)
+        event: Per-exchange boolean event indicator
+        mask: Optional per-exchange boolean mask of exchanges to include
+
+    Returns:
+        Tuple of (rate, n_events, n_exchanges), each indexed by position.
+        Rates are NaN where no exchanges occur.
+    """
+    if mask is None:
+        mask = np.ones(len(positions), dtype=bool)
+    included = mask & (positions >= 0)
+
+    n_exchanges = np.bincount(positions[included])
+    n_events = np.bincount(positions[included & event], minlength=len(n_exchanges))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rate = np.where(n_exchanges > 0, n_events / n_exchanges, np.nan)
+    return rate, n_events, n_exchanges
+
+
+def hazard_curve(tensors: SequenceTensors, positions: np.ndarray, event: np.ndarray,
+                 mask: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Discrete-time hazard of the first event in each thread.
+
+    The hazard at position k is the fraction of threads at risk at k (with
+    an included exchange at k and no event at any earlier included
+    exchange) whose event occurs at k.
+
+    Example: hazard of the first successful image after the trigger is
+    hazard_curve(t, t.trigger_distance, success, mask=t.post_trigger & is_image).
+
+    Args:
+        tensors: SequenceTensors the arrays belong to
+        positions: Per-exchange nonnegative position
+        event: Per-exchange boolean event indicator
+        mask: Optional per-exchange boolean mask of exchanges to include
+
+    Returns:
+        Tuple of (hazard, n_events, n_at_risk), each indexed by position
+    """
+    if mask is None:
+        mask = np.ones(len(positions), dtype=bool)
+    included = mask & (positions >= 0)
+    counted_event = (included & event).astype(np.int64)
+
+    # Events strictly before each exchange within its thread
+    running = np.cumsum(counted_event)
+    thread_start_total = np.concatenate([[0], running])[tensors.offsets[:-1]]
+    prior_events = running - counted_event - thread_start_total[tensors.thread_index]
+
+    at_risk = included & (prior_events == 0)
+    n_at_risk = np.bincount(positions[at_risk])
+    n_events = np.bincount(positions[at_risk & event], minlength=len(n_at_risk))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        hazard = np.where(n_at_risk > 0, n_events / n_at_risk, np.nan)
+    return hazard, n_events, n_at_risk
+
+
+def transition_matrix(tensors: SequenceTensors, mask: Optional[np.ndarray] = None,
+                      same_prompt: bool = False, normalize: bool = True) -> np.ndarray:
+    """
+    Transition matrix between response classes.
+
+    Args:
+        tensors: SequenceTensors to analyze
+        mask: Optional per-exchange boolean mask; a transition is counted
+            when its source exchange is included
+        same_prompt: If True, link each attempt at a prompt to the next
+            attempt at the same prompt in the same thread (retries);
+            unrecognized prompts are never linked. Otherwise link
+            consecutive exchanges within a thread.
+        normalize: Return row-normalized probabilities instead of counts
+
+    Returns:
+        Array of shape (len(RESPONSE_CODES), len(RESPONSE_CODES)); rows are
+        the source class, columns the following class
+    """
+    n_exchanges = len(tensors.response)
+    if same_prompt:
+        order = np.lexsort((tensors.position, tensors.prompt, tensors.thread_index))
+    else:
+        order = np.arange(n_exchanges)
+
+    source = order[:-1]
+    target = order[1:]
+    linked = tensors.thread_index[source] == tensors.thread_index[target]
+    if same_prompt:
+        linked &= (tensors.prompt[source] == tensors.prompt[target]) & (tensors.prompt[source] != UNKNOWN_CODE)
+    if mask is not None:
+        linked &= mask[source]
+
+    n_classes = len(RESPONSE_CODES)
+    pairs = tensors.response[source[linked]].astype(np.int64) * n_classes + tensors.response[target[linked]]
+    counts = np.bincount(pairs, minlength=n_classes * n_classes).reshape(n_classes, n_classes)
+
+    if not normalize:
+        return counts
+    row_totals = counts.sum(axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(row_totals > 0, counts / row_totals, np.nan)
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    processed_dir = Path(__file__).parent.parent / "data" / "processed"
+    turns_df = pd.read_csv(processed_dir / "parsed_turns.csv")
+    tensors = build_sequence_tensors(turns_df)
+
+    print(f"{tensors.n_threads} threads, {len(tensors.response)} exchanges")
+
+    refused = response_mask(tensors, [ResponseClass.POLICY_REFUSAL.value,
+                                      ResponseClass.CAPABILITY_REFUSAL.value])
+    image = prompt_mask(tensors, ["I1_KITCHEN", "I2_BEDROOM", "I3_ABSTRACT", "I4_COFFEE"])
+    rate, n_events, n_exchanges = rate_by_position(
+        tensors.trigger_distance, refused, mask=tensors.post_trigger & image
+    )
+    print("\nImage refusal rate by distance from trigger:")
+    for distance in range(1, len(rate)):
+        if n_exchanges[distance]:
+            print(f"  {distance}: {rate[distance]:.2f} ({n_events[distance]}/{n_exchanges[distance]})")
+
+    retries = transition_matrix(tensors, mask=image, same_prompt=True, normalize=False)
+    print("\nImage retry transitions (row = attempt, column = next attempt):")
+    print(pd.DataFrame(retries, index=RESPONSE_CODES, columns=RESPONSE_CODES).to_string())
@@ -0,0 +1,590 @@
+"""
+Sequential testing module for Violation State study.
+
+Each session costs real time and quota, so rather than testing once after
+all threads are collected, this module monitors the control-vs-contaminated
+comparison as each new thread arrives. It reports when the evidence is
+conclusive at a pre-registered two-sided error rate, so collection can stop
+early.
+
+The design is a group-sequential test with a Lan-DeMets alpha-spending
+function (O'Brien-Fleming-type by default, Pocock-type optional). Looks
+may happen at any information fraction, so they need not be planned in
+advance. The statistic is a pooled two-proportion z-test of refusal rates
+(final outcomes of I1-I4), with the variance of each condition's rate
+inflated by its design effect, because prompts within a thread are
+correlated. The design effect is estimated from the threads seen so far,
+but never taken below the value implied by a pre-registered upper bound on
+the intra-thread correlation (SequentialDesign.icc): with few threads the
+estimate is noisy, and underestimating it inflates the type I error. The information fraction of a look is n_c*n_t/(n_c + n_t) over
+its value at the planned maximum sample.
+
+Boundaries are calibrated by Monte Carlo on the canonical joint
+distribution of the z-statistics (Brownian motion in information time),
+extended one look at a time: at each look the boundary is the threshold
+that spends exactly the alpha allotted to it among simulated paths that
+have not yet crossed.
+
+simulate_design() estimates power and expected sample size under assumed
+refusal rates, vectorized over many simulated trials. achieved_alpha()
+simulates the clustered null at the design's correlation bound and reports
+the type I error the design actually achieves (e.g., about 0.04 for
+10 + 30 threads at an intra-thread correlation of 0.2; without the bound
+it would be about 0.07).
+"""
+
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from batch_stats import cohen_h_batch, fisher_exact_batch
+from factor_stats import IMAGE_PROMPTS
+
+SPENDING_FUNCTIONS = ("obrien_fleming", "pocock")
+
+DEFAULT_SIMULATIONS = 200_000
+
+# Default bound on the intra-thread correlation of refusals
+DEFAULT_ICC = 0.2
+
+# Refusal rates at which achieved_alpha() simulates the null
+NULL_RATES = (0.1, 0.3, 0.5)
+
+CONDITIONS = ["control", "contaminated"]
+
+
+def spent_alpha(t, alpha: float = 0.05, spending: str = "obrien_fleming") -> np.ndarray:
+    """
+    Cumulative alpha spent by information fraction t.
+
+    Args:
+        t: Information fraction(s) in [0, 1]
+        alpha: Overall two-sided type I error rate
+        spending: "obrien_fleming" (spends almost nothing early) or
+            "pocock" (spends more evenly)
+
+    Returns:
+        Array of cumulative alpha, reaching alpha at t = 1
+    """
+    t = np.clip(np.asarray(t, dtype=float), 0.0, 1.0)
+    if spending == "obrien_fleming":
+        with np.errstate(divide="ignore"):
+            return np.where(t > 0, 2 * norm.sf(norm.isf(alpha / 2) / np.sqrt(t)), 0.0)
+    if spending == "pocock":
+        return alpha * np.log1p((np.e - 1) * t)
+    raise ValueError(f"spending must be one of {SPENDING_FUNCTIONS}, got {spending!r}")
+
+
+class SpendingBoundary:
+    """
+    Monte Carlo calibration of alpha-spending boundaries, one look at a time.
+
+    The simulated paths are extended with every look, so boundaries of
+    earlier looks never change when later looks are added, and the same
+    seed and look schedule always give the same boundaries.
+    """
+
+    def __init__(self, alpha: float = 0.05, spending: str = "obrien_fleming",
+                 n_simulations: int = DEFAULT_SIMULATIONS, seed: int = 0):
+        spent_alpha(0.5, alpha, spending)  # validate spending
+        self.alpha = alpha
+        self.spending = spending
+        self.n_simulations = n_simulations
+        self._rng = np.random.default_rng(seed)
+        self._brownian = np.zeros(n_simulations)
+        self._alive = np.ones(n_simulations, dtype=bool)
+        self._n_rejected = 0
+        self.information = 0.0
+
+    def next(self, t: float) -> float:
+        """
+        Boundary for the next look.
+
+        Args:
+            t: Information fraction of the look (> previous look; capped at 1)
+
+        Returns:
+            Critical value c: the test rejects at this look if |z| >= c
+            (infinite if no alpha is spent at this look)
+        """
+        t = min(float(t), 1.0)
+        if t <= self.information:
+            raise ValueError(f"Information fraction must increase (got {t} after {self.information})")
+
+        self._brownian += np.sqrt(t - self.information) * self._rng.standard_normal(self.n_simulations)
+        self.information = t
+        abs_z = np.abs(self._brownian) / np.sqrt(t)
+
+        target = int(round(float(spent_alpha(t, self.alpha, self.spending)) * self.n_simulations))
+        n_reject = target - self._n_rejected
+        alive_z = abs_z[self._alive]
+        if n_reject <= 0 or len(alive_z) == 0:
+            return np.inf
+        n_reject = min(n_reject, len(alive_z))
+        boundary = float(np.partition(alive_z, len(alive_z) - n_reject)[len(alive_z) - n_reject])
+
+        crossed = self._alive & (abs_z >= boundary)
+        self._n_rejected += int(crossed.sum())
+        self._alive &= ~crossed
+        return boundary
+
+
+def design_effect(m, n, r, nn, rn, rr) -> np.ndarray:
+    """
+    Design effect of a condition's refusal rate from thread-level sums.
+
+    Args:
+        m: Number of threads
+        n: Total prompts (sum of n_i)
+        r: Total refusals (sum of r_i)
+        nn, rn, rr: Sums of n_i^2, r_i*n_i and r_i^2 over threads
+
+    Returns:
+        Ratio of the cluster (between-thread) variance of the rate to its
+        binomial variance, at least 1 (1 when undefined)
+    """
+    m, n, r, nn, rn, rr = (np.asarray(x, dtype=float) for x in (m, n, r, nn, rn, rr))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = r / n
+        residual_ss = rr - 2 * rate * rn + rate ** 2 * nn
+        cluster_var = residual_ss / (m * (m - 1) * (n / m) ** 2)
+        binomial_var = rate * (1 - rate) / n
+        deff = np.maximum(1.0, cluster_var / binomial_var)
+    return np.where((m > 1) & (rate > 0) & (rate < 1), deff, 1.0)
+
+
+def z_statistic(control: Dict[str, np.ndarray], contaminated: Dict[str, np.ndarray],
+                min_design_effect: float = 1.0) -> np.ndarray:
+    """
+    Design-effect-adjusted pooled z-statistic (contaminated minus control).
+
+    Args:
+        control, contaminated: Thread-level sums with keys m, n, r, nn, rn,
+            rr (see design_effect()); values may be arrays
+        min_design_effect: Lower bound on each condition's design effect
+
+    Returns:
+        Array of z (0 where either condition has no prompts or the pooled
+        rate is 0 or 1)
+    """
+    n_c, n_t = np.asarray(control["n"], dtype=float), np.asarray(contaminated["n"], dtype=float)
+    r_c, r_t = np.asarray(control["r"], dtype=float), np.asarray(contaminated["r"], dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pooled = (r_c + r_t) / (n_c + n_t)
+        deff_c = np.maximum(design_effect(**control), min_design_effect)
+        deff_t = np.maximum(design_effect(**contaminated), min_design_effect)
+        variance = pooled * (1 - pooled) * (deff_c / n_c + deff_t / n_t)
+        z = (r_t / n_t - r_c / n_c) / np.sqrt(variance)
+    return np.where((n_c > 0) & (n_t > 0) & (variance > 0), z, 0.0)
+
+
+class SequentialDesign:
+    """
+    Pre-registered sequential design.
+
+    Attributes:
+        max_threads: Planned maximum threads per condition
+        prompts_per_thread: Planned image prompts per thread (I1-I4)
+        alpha: Two-sided type I error rate
+        spending: Alpha-spending function (see spent_alpha())
+        icc: Pre-registered upper bound on the intra-thread correlation of
+            refusals; the design effect is never taken below
+            1 + (prompts_per_thread - 1) * icc
+        min_threads: Threads per condition required before the first look
+        n_simulations: Monte Carlo paths for boundary calibration
+        seed: Seed for boundary calibration
+    """
+
+    def __init__(self, max_control_threads: int, max_contaminated_threads: int,
+                 alpha: float = 0.05, spending: str = "obrien_fleming",
+                 prompts_per_thread: int = len(IMAGE_PROMPTS), icc: float = DEFAULT_ICC,
+                 min_threads: int = 2, n_simulations: int = DEFAULT_SIMULATIONS, seed: int = 0):
+        if not 0 <= icc < 1:
+            raise ValueError(f"icc must be in [0, 1), got {icc}")
+        self.max_threads = {"control": max_control_threads, "contaminated": max_contaminated_threads}
+        self.prompts_per_thread = prompts_per_thread
+        self.icc = icc
+        self.alpha = alpha
+        self.spending = spending
+        self.min_threads = min_threads
+        self.n_simulations = n_simulations
+        self.seed = seed
+        spent_alpha(0.5, alpha, spending)  # validate spending
+
+    @property
+    def max_information(self) -> float:
+        n_c = self.max_threads["control"] * self.prompts_per_thread
+        n_t = self.max_threads["contaminated"] * self.prompts_per_thread
+        return n_c * n_t / (n_c + n_t)
+
+    @property
+    def min_design_effect(self) -> float:
+        return 1 + (self.prompts_per_thread - 1) * self.icc
+
+    def information_fraction(self, n_control, n_contaminated) -> np.ndarray:
+        """Information fraction for the given numbers of prompts per condition."""
+        n_c = np.asarray(n_control, dtype=float)
+        n_t = np.asarray(n_contaminated, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            information = np.where(n_c + n_t > 0, n_c * n_t / (n_c + n_t), 0.0)
+        return information / self.max_information
+
+    def boundary(self) -> SpendingBoundary:
+        """Fresh boundary calibrator for this design."""
+        return SpendingBoundary(self.alpha, self.spending, self.n_simulations, self.seed)
+
+
+class SequentialMonitor:
+    """
+    Applies a SequentialDesign to threads as they arrive.
+
+    Attributes:
+        looks: List of look records (see update())
+        stopped: True once the test is conclusive or the planned maximum
+            information has been reached
+    """
+
+    def __init__(self, design: SequentialDesign):
+        self.design = design
+        self.looks = []
+        self.stopped = False
+        self._boundary = design.boundary()
+        self._sums = {condition: dict.fromkeys(["m", "n", "r", "nn", "rn", "rr"], 0)
+                      for condition in CONDITIONS}
+
+    def update(self, condition: str, n_prompts: int, n_refused: int) -> Optional[Dict]:
+        """
+        Add one thread and look at the data.
+
+        Args:
+            condition: "control" or "contaminated"
+            n_prompts: Image prompts in the thread (final outcomes)
+            n_refused: Refused image prompts in the thread
+
+        Returns:
+            Look record with threads_control, threads_contaminated,
+            control_rate, contaminated_rate, information, z, boundary,
+            cohen_h, fisher_p (nominal, for reference only), conclusive and
+            final; None if no look was taken (too few threads, no new
+            information, or already stopped)
+        """
+        if self.stopped or condition not in self._sums:
+            return None
+
+        sums = self._sums[condition]
+        sums["m"] += 1
+        sums["n"] += n_prompts
+        sums["r"] += n_refused
+        sums["nn"] += n_prompts * n_prompts
+        sums["rn"] += n_refused * n_prompts
+        sums["rr"] += n_refused * n_refused
+
+        control, contaminated = self._sums["control"], self._sums["contaminated"]
+        if min(control["m"], contaminated["m"]) < self.design.min_threads:
+            return None
+        t = float(self.design.information_fraction(control["n"], contaminated["n"]))
+        if t <= self._boundary.information:
+            return None
+
+        boundary = self._boundary.next(t)
+        z = float(z_statistic(control, contaminated, self.design.min_design_effect))
+        control_rate = control["r"] / control["n"]
+        contaminated_rate = contaminated["r"] / contaminated["n"]
+        conclusive = abs(z) >= boundary
+        final = t >= 1.0
+
+        look = {
+            "look": len(self.looks) + 1,
+            "threads_control": control["m"],
+            "threads_contaminated": contaminated["m"],
+            "control_rate": control_rate,
+            "contaminated_rate": contaminated_rate,
+            "information": min(t, 1.0),
+            "z": z,
+            "boundary": boundary,
+            "cohen_h": float(cohen_h_batch(contaminated_rate, control_rate)),
+            "fisher_p": float(fisher_exact_batch(control["n"] - control["r"], control["r"],
+                                                 contaminated["n"] - contaminated["r"], contaminated["r"])),
+            "conclusive": conclusive,
+            "final": final,
+        }
+        self.looks.append(look)
+        self.stopped = conclusive or final
+        return look
+
+
+def thread_outcome_counts(final_outcomes: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-thread image prompt and refusal counts from final outcomes (primary analysis).
+
+    Args:
+        final_outcomes: Output of compute_final_outcomes()
+
+    Returns:
+        DataFrame with thread_id, condition, n_prompts and n_refused, in
+        order of first appearance
+    """
+    image_outcomes = final_outcomes[final_outcomes["prompt_id"].isin(IMAGE_PROMPTS)]
+    counts = image_outcomes.groupby("thread_id", sort=False).agg(
+        condition=("condition", "first"),
+        n_prompts=("refused", "size"),
+        n_refused=("refused", "sum"),
+    ).reset_index()
+    return counts.astype({"n_prompts": np.int64, "n_refused": np.int64})
+
+
+def thread_attempt_counts(summary_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-thread evaluable attempts and refusals from thread summaries (secondary analysis).
+
+    Args:
+        summary_df: Output of build_thread_summary() (thread_summary.csv)
+
+    Returns:
+        DataFrame with thread_id, condition, n_prompts (image attempts
+        excluding rate limits) and n_refused (policy + capability)
+    """
+    return pd.DataFrame({
+        "thread_id": summary_df["thread_id"],
+        "condition": summary_df["condition"],
+        "n_prompts": summary_df["n_image_prompts"] - summary_df["n_rate_limit"],
+        "n_refused": summary_df["n_image_policy_refusals"] + summary_df["n_image_capability_refusals"],
+    })
+
+
+def arrival_order(n_control: int, n_contaminated: int) -> np.ndarray:
+    """
+    Interleave two conditions so arrivals stay in proportion to their sizes.
+
+    Args:
+        n_control: Number of control threads
+        n_contaminated: Number of contaminated threads
+
+    Returns:
+        Array of condition indices into CONDITIONS (0 = control), one per arrival
+    """
+    positions = np.concatenate([(np.arange(n_control) + 0.5) / max(n_control, 1),
+                                (np.arange(n_contaminated) + 0.5) / max(n_contaminated, 1)])
+    codes = np.concatenate([np.zeros(n_control, dtype=np.int8), np.ones(n_contaminated, dtype=np.int8)])
+    return codes[np.argsort(positions, kind="stable")]
+
+
+def monitor_threads(thread_counts: pd.DataFrame, design: SequentialDesign) -> pd.DataFrame:
+    """
+    Run a sequential test over threads in arrival order.
+
+    Args:
+        thread_counts: Output of thread_outcome_counts() or
+            thread_attempt_counts(), one row per thread in arrival order
+        design: Pre-registered design
+
+    Returns:
+        DataFrame of looks (see SequentialMonitor.update()) with the
+        thread_id that triggered each look, ending at the first conclusive
+        look or the final one
+    """
+    monitor = SequentialMonitor(design)
+    rows = []
+    for thread in thread_counts.itertuples(index=False):
+        look = monitor.update(thread.condition, int(thread.n_prompts), int(thread.n_refused))
+        if look is not None:
+            rows.append({"thread_id": thread.thread_id, **look})
+        if monitor.stopped:
+            break
+    return pd.DataFrame(rows)
+
+
+def simulate_design(design: SequentialDesign, control_rate: float, contaminated_rate: float,
+                    n_trials: int = 10_000, icc: Optional[float] = None, seed: int = 1) -> Dict:
+    """
+    Estimate power and expected sample size by simulation.
+
+    Threads arrive interleaved in proportion to the planned maxima (see
+    arrival_order()), each with prompts_per_thread prompts. Within a thread,
+    refusals are beta-binomial with intra-thread correlation icc.
+
+    Args:
+        design: Sequential design to evaluate
+        control_rate: Assumed control refusal rate
+        contaminated_rate: Assumed contaminated refusal rate
+        n_trials: Number of simulated trials
+        icc: Intra-thread correlation of refusals (0 = independent
+            prompts; default: the design's bound)
+        seed: Random seed for the simulated data
+
+    Returns:
+        Dictionary with rejection_rate (power, or type I error if the rates
+        are equal), expected_threads (total), expected_threads_control,
+        expected_threads_contaminated, max_threads, stop_fraction (fraction
+        of trials stopping early) and boundaries (DataFrame of look
+        thread counts, information and critical values)
+    """
+    if icc is None:
+        icc = design.icc
+    rng = np.random.default_rng(seed)
+    n_max = design.max_threads
+    arrivals = arrival_order(n_max["control"], n_max["contaminated"])
+    k = design.prompts_per_thread
+
+    # Per-thread refusal counts for every trial and arrival
+    rates = np.where(arrivals == 0, control_rate, contaminated_rate)
+    thread_rates = np.broadcast_to(rates, (n_trials, len(arrivals)))
+    if icc > 0:
+        inner = (rates > 0) & (rates < 1)
+        a = np.where(inner, rates * (1 - icc) / icc, 1.0)
+        b = np.where(inner, (1 - rates) * (1 - icc) / icc, 1.0)
+        thread_rates = np.where(inner, rng.beta(a, b, size=(n_trials, len(arrivals))), rates)
+    refusals = rng.binomial(k, thread_rates)
+
+    # Cumulative thread-level sums per condition at each arrival
+    sums = {}
+    for code, condition in enumerate(CONDITIONS):
+        in_condition = arrivals == code
+        r = np.where(in_condition, refusals, 0)
+        m = np.cumsum(in_condition)
+        n = m * k
+        sums[condition] = {
+            "m": m, "n": n, "nn": m * k * k,
+            "r": np.cumsum(r, axis=1), "rn": np.cumsum(r * k, axis=1), "rr": np.cumsum(r * r, axis=1),
+        }
+
+    # Looks: every arrival with enough threads and new information
+    m_c, m_t = sums["control"]["m"], sums["contaminated"]["m"]
+    t = design.information_fraction(sums["control"]["n"], sums["contaminated"]["n"])
+    eligible = (m_c >= design.min_threads) & (m_t >= design.min_threads)
+    look_index = []
+    previous = 0.0
+    for i in np.flatnonzero(eligible):
+        if t[i] > previous:
+            look_index.append(i)
+            previous = t[i]
+    look_index = np.array(look_index, dtype=np.int64)
+
+    calibrator = design.boundary()
+    boundaries = np.array([calibrator.next(t[i]) for i in look_index])
+
+    z = z_statistic({key: value[..., look_index] for key, value in sums["control"].items()},
+                    {key: value[..., look_index] for key, value in sums["contaminated"].items()},
+                    design.min_design_effect)
+    crossed = np.abs(z) >= boundaries
+    rejected = crossed.any(axis=1)
+    stop_look = np.where(rejected, crossed.argmax(axis=1), len(look_index) - 1)
+    stop_arrival = look_index[stop_look]
+
+    return {
+        "rejection_rate": float(rejected.mean()),
+        "expected_threads": float((stop_arrival + 1).mean()),
+        "expected_threads_control": float(m_c[stop_arrival].mean()),
+        "expected_threads_contaminated": float(m_t[stop_arrival].mean()),
+        "max_threads": len(arrivals),
+        "stop_fraction": float((stop_arrival < len(arrivals) - 1).mean()),
+        "boundaries": pd.DataFrame({
+            "threads_control": m_c[look_index],
+            "threads_contaminated": m_t[look_index],
+            "information": np.minimum(t[look_index], 1.0),
+            "boundary": boundaries,
+        }),
+    }
+
+
+def achieved_alpha(design: SequentialDesign, null_rates=NULL_RATES, n_trials: int = 20_000,
+                   icc: Optional[float] = None, seed: int = 2) -> float:
+    """
+    Type I error the design achieves under the clustered null, by simulation.
+
+    Args:
+        design: Sequential design to evaluate
+        null_rates: Refusal rates (equal in both conditions) to simulate
+        n_trials: Simulated trials per rate
+        icc: Intra-thread correlation of the simulated refusals (default:
+            the design's bound)
+        seed: Random seed for the simulated data
+
+    Returns:
+        Largest rejection rate over null_rates
+    """
+    return max(simulate_design(design, rate, rate, n_trials, icc, seed)["rejection_rate"]
+               for rate in null_rates)
+
+
+def format_monitor_report(looks: pd.DataFrame, design: SequentialDesign,
+                          alpha_achieved: Optional[float] = None) -> str:
+    """
+    Format the looks of a sequential test for the console.
+
+    Args:
+        looks: Output of monitor_threads()
+        design: Design the looks were taken under
+        alpha_achieved: Simulated type I error of the design (see
+            achieved_alpha()), reported if given
+
+    Returns:
+        Multi-line report text
+    """
+    lines = [
+        f"SEQUENTIAL TEST ({design.spending.replace('_', '-')} spending, two-sided alpha = {design.alpha})",
+        "-" * 70,
+        f"Planned maximum: {design.max_threads['control']} control, "
+        f"{design.max_threads['contaminated']} contaminated threads",
+    ]
+    if alpha_achieved is not None:
+        lines.append(f"Achieved type I error (simulated, intra-thread correlation {design.icc}): "
+                     f"{alpha_achieved:.3f}")
+    if looks.empty:
+        lines.append("No looks taken yet")
+        return "\n".join(lines)
+
+    for look in looks.itertuples(index=False):
+        lines.append(
+            f"  Look {look.look:>3} ({look.threads_control:>3} ctl, {look.threads_contaminated:>3} cont, "
+            f"t={look.information:.2f}): z={look.z:6.2f}, boundary={look.boundary:6.2f}, "
+            f"h={look.cohen_h:.2f}"
+        )
+
+    last = looks.iloc[-1]
+    threads = int(last["threads_control"] + last["threads_contaminated"])
+    total = design.max_threads["control"] + design.max_threads["contaminated"]
+    if last["conclusive"]:
+        lines.append(f"Conclusive at look {int(last['look'])} after {threads} of {total} threads: "
+                     f"collection can stop")
+    elif last["final"]:
+        lines.append(f"Not conclusive at the planned maximum ({threads} threads)")
+    else:
+        lines.append(f"Not yet conclusive after {threads} threads: continue collecting")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    from pathlib import Path
+
+    from run_analysis import AnalysisResults
+
+    results = AnalysisResults(str(Path(__file__).parent.parent))
+    counts = thread_outcome_counts(results.final_outcomes)
+    n_control = int((counts["condition"] == "control").sum())
+    n_contaminated = int((counts["condition"] == "contaminated").sum())
+    design = SequentialDesign(n_control, n_contaminated)
+
+    # Replay the corpus with conditions interleaved, as if collected in parallel
+    by_condition = [counts[counts["condition"] == condition].reset_index(drop=True)
+                    for condition in CONDITIONS]
+    position = [0, 0]
+    rows = []
+    for code in arrival_order(n_control, n_contaminated):
+        rows.append(by_condition[code].iloc[position[code]])
+        position[code] += 1
+    print(format_monitor_report(monitor_threads(pd.DataFrame(rows), design), design, achieved_alpha(design)))
+
+    print("\nSimulated operating characteristics (10,000 trials):")
+    observed = results.stats["first_attempts"]
+    for label, control_rate, contaminated_rate, icc in [
+        ("Observed rates", observed["control"]["refusal_rate"], observed["contaminated"]["refusal_rate"], 0.0),
+        ("Smaller effect (10% vs 40%)", 0.10, 0.40, 0.2),
+        ("No effect (30% vs 30%)", 0.30, 0.30, 0.2),
+    ]:
+        sim = simulate_design(design, control_rate, contaminated_rate, icc=icc)
+        lines = (f"  {label}: rejection rate {sim['rejection_rate']:.3f}, "
+                 f"expected threads {sim['expected_threads']:.1f} of {sim['max_threads']}")
+        print(lines)
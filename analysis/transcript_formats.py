@@ -0,0 +1,487 @@
+"""
+Transcript format module for Violation State study.
+
+This module holds the registry of transcript formats. Each format claims a
+set of file extensions and provides a sniffer that recognizes it from the
+first bytes of a file and a parser that turns a text stream into
+(front-matter metadata, turns). All parsers emit the same turn dictionaries
+(speaker, text, turn_index), so classification downstream does not depend
+on the source format.
+
+A file's format is chosen by its extension; content is only sniffed when
+the extension is not claimed by any format (see detect_format()). A .txt
+transcript that quotes HTML markup is therefore still parsed as text.
+
+Built-in formats, in sniffing order:
+    - html: Saved ChatGPT web pages. Parsed incrementally with an
+      event-based parser, without building a DOM.
+    - markdown: Markdown exports with "## You" / "## ChatGPT" headings or
+      "**You:**" / "**ChatGPT:**" labels.
+    - text: Copy-pasted transcripts with "You said:" / "ChatGPT said:"
+      (or "You:" / "ChatGPT:") marker lines. Always matches, so it is the
+      fallback.
+"""
+
+import codecs
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+from typing import Callable, Dict, IO, List, Optional, Tuple
+
+# Number of leading bytes handed to the sniffers
+SNIFF_BYTES = 4096
+
+# Characters decoded per chunk when streaming HTML
+HTML_CHUNK_SIZE = 1 << 16
+
+FRONT_MATTER_DELIMITER = "---"
+
+TranscriptFormat = namedtuple("TranscriptFormat", ["name", "extensions", "sniff", "parse"])
+
+_FORMATS: List[TranscriptFormat] = []
+
+
+def register_format(name: str, extensions: List[str],
+                    sniff: Callable[[bytes], bool],
+                    parse: Callable[[IO[str]], Tuple[Dict[str, str], List[Dict]]],
+                    first: bool = False) -> TranscriptFormat:
+    """
+    Register a transcript format.
+
+    Args:
+        name: Format name
+        extensions: File extensions (with leading dot) that may hold this format
+        sniff: Function of the first SNIFF_BYTES bytes returning True if the
+            content is in this format
+        parse: Function of a text stream returning (metadata, turns)
+        first: Sniff this format before the already registered ones
+            (by default it is tried before the text fallback only)
+
+    Returns:
+        The registered TranscriptFormat
+    """
+    fmt = TranscriptFormat(name, [ext.lower() for ext in extensions], sniff, parse)
+    unregister_format(name)
+
+    if first:
+        _FORMATS.insert(0, fmt)
+    elif _FORMATS and _FORMATS[-1].name == "text":
+        _FORMATS.insert(len(_FORMATS) - 1, fmt)
+    else:
+        _FORMATS.append(fmt)
+    return fmt
+
+
+def unregister_format(name: str) -> None:
+    """Remove a format from the registry (no-op if not registered)."""
+    _FORMATS[:] = [fmt for fmt in _FORMATS if fmt.name != name]
+
+
+def get_format(name: str) -> TranscriptFormat:
+    """Look up a registered format by name."""
+    for fmt in _FORMATS:
+        if fmt.name == name:
+            return fmt
+    raise KeyError(f"Unknown transcript format: {name}")
+
+
+def registered_extensions() -> List[str]:
+    """All file extensions claimed by registered formats."""
+    extensions = []
+    for fmt in _FORMATS:
+        for ext in fmt.extensions:
+            if ext not in extensions:
+                extensions.append(ext)
+    return extensions
+
+
+def format_for_extension(extension: str) -> Optional[TranscriptFormat]:
+    """
+    Look up the format that claims a file extension.
+
+    Args:
+        extension: File extension with leading dot (e.g., ".txt"); case-insensitive
+
+    Returns:
+        The first registered format claiming the extension, or None
+    """
+    extension = extension.lower()
+    for fmt in _FORMATS:
+        if extension in fmt.extensions:
+            return fmt
+    return None
+
+
+def detect_format(head: bytes, extension: str = "") -> TranscriptFormat:
+    """
+    Determine the format of a transcript file.
+
+    Args:
+        head: Leading bytes of the file (SNIFF_BYTES is enough)
+        extension: File extension with leading dot, if any
+
+    Returns:
+        The format claiming the extension; if no format claims it, the
+        format sniffed from head
+    """
+    return format_for_extension(extension) or sniff_format(head)
+
+
+def sniff_format(head: bytes) -> TranscriptFormat:
+    """
+    Detect the format of a transcript from its first bytes.
+
+    Args:
+        head: Leading bytes of the file (SNIFF_BYTES is enough)
+
+    Returns:
+        The first registered format whose sniffer accepts head
+    """
+    for fmt in _FORMATS:
+        if fmt.sniff(head):
+            return fmt
+    raise ValueError("No registered transcript format matches the content")
+
+
+def parse_front_matter(content: str) -> Tuple[Dict[str, str], str]:
+    """
+    Split an optional front-matter block off the top of a transcript.
+
+    The block starts with a "---" line (leading blank lines are allowed),
+    holds one "key: value" pair per line, and ends with another "---" line.
+    Keys are lowercased; values are kept as strings.
+
+    Args:
+        content: Full transcript text
+
+    Returns:
+        Tuple of (metadata dict, remaining transcript text). If there is no
+        well-formed front-matter block, returns ({}, content) unchanged.
+    """
+    lines = content.split('\n')
+
+    start = 0
+    while start < len(lines) and not lines[start].strip():
+        start += 1
+
+    if start >= len(lines) or lines[start].strip() != FRONT_MATTER_DELIMITER:
+        return {}, content
+
+    metadata = {}
+    for end in range(start + 1, len(lines)):
+        line_stripped = lines[end].strip()
+        if line_stripped == FRONT_MATTER_DELIMITER:
+            return metadata, '\n'.join(lines[end + 1:])
+        if not line_stripped or line_stripped.startswith('#'):
+            continue
+        if ':' not in line_stripped:
+            # Not a metadata block after all
+            return {}, content
+        key, value = line_stripped.split(':', 1)
+        metadata[key.strip().lower()] = value.strip()
+
+    # Unterminated block: treat the whole file as transcript text
+    return {}, content
+
+
+def split_marked_turns(lines: List[str],
+                       match_marker: Callable[[str], Optional[Tuple[str, str]]],
+                       skip_line: Callable[[str], bool],
+                       leading_user_turn: bool = True) -> List[Dict]:
+    """
+    Split transcript lines into turns at speaker marker lines.
+
+    Args:
+        lines: Transcript lines
+        match_marker: Function of a stripped line returning (speaker, rest)
+            if the line is a speaker marker, where rest is any text that
+            follows the marker on the same line, else None
+        skip_line: Function of a stripped line returning True for noise
+            lines to drop
+        leading_user_turn: Treat content before the first marker as the
+            first user turn (copy-pasted transcripts often omit the first
+            "You said:"). If False, that content is discarded.
+
+    Returns:
+        List of turn dictionaries with speaker, text, turn_index
+    """
+    turns = []
+    current_speaker = None
+    current_text = []
+
+    def flush():
+        if current_speaker is not None and current_text:
+            text_content = '\n'.join(current_text).strip()
+            if text_content:  # Only add non-empty turns
+                turns.append({
+                    "speaker": current_speaker,
+                    "text": text_content,
+                    "turn_index": len(turns)
+                })
+
+    # Check if file starts with content before any marker (first user turn)
+    first_marker_line = None
+    for i, line in enumerate(lines):
+        if match_marker(line.strip()) is not None:
+            first_marker_line = i
+            break
+
+    # If there's content before the first marker, treat it as the first user turn
+    if leading_user_turn and first_marker_line is not None and first_marker_line > 0:
+        initial_content = '\n'.join(lines[:first_marker_line]).strip()
+        if initial_content and initial_content != "Share":
+            current_speaker = "user"
+            current_text = lines[:first_marker_line]
+
+    for i, line in enumerate(lines):
+        # Skip lines we already processed as initial content
+        if first_marker_line is not None and i < first_marker_line:
+            continue
+
+        line_stripped = line.strip()
+        marker = match_marker(line_stripped)
+
+        if marker is not None:
+            # Save previous turn if exists, then start a new one
+            flush()
+            current_speaker, rest = marker
+            current_text = [rest] if rest else []
+
+        elif current_speaker is not None and line_stripped and not skip_line(line_stripped):
+            # Add to current turn (skipping noise lines)
+            current_text.append(line)
+
+    # Don't forget the last turn
+    flush()
+
+    return turns
+
+
+# --- Plain text (copy-pasted ChatGPT Web transcripts) ---------------------
+
+TEXT_USER_PATTERN = re.compile(r'^(?:You said:|You:)\s*$')
+TEXT_ASSISTANT_PATTERN = re.compile(r'^(?:ChatGPT said:|ChatGPT:)\s*$')
+
+
+def _match_text_marker(line_stripped: str) -> Optional[Tuple[str, str]]:
+    if TEXT_USER_PATTERN.match(line_stripped):
+        return "user", ""
+    if TEXT_ASSISTANT_PATTERN.match(line_stripped):
+        return "assistant", ""
+    return None
+
+
+def parse_text_transcript(stream: IO[str]) -> Tuple[Dict[str, str], List[Dict]]:
+    """
+    Parse a copy-pasted transcript with "You said:" / "ChatGPT said:" markers.
+
+    Args:
+        stream: Text stream of the transcript
+
+    Returns:
+        Tuple of (front-matter metadata, turns)
+    """
+    metadata, content = parse_front_matter(stream.read())
+    turns = split_marked_turns(content.split('\n'), _match_text_marker,
+                               lambda line: line == "Share")
+    return metadata, turns
+
+
+def _sniff_text(head: bytes) -> bool:
+    return True
+
+
+# --- Markdown exports ------------------------------------------------------
+
+MARKDOWN_SPEAKERS = {
+    "you said": "user", "you": "user", "user": "user",
+    "chatgpt said": "assistant", "chatgpt": "assistant", "assistant": "assistant",
+}
+_MARKDOWN_NAMES = "|".join(sorted((re.escape(name) for name in MARKDOWN_SPEAKERS), key=len, reverse=True))
+
+# "## You", "### ChatGPT said:", "## **User**"
+MARKDOWN_HEADING_PATTERN = re.compile(
+    rf'^#{{1,6}}\s+(?:\*\*)?(?P<name>{_MARKDOWN_NAMES})(?:\*\*)?\s*:?\s*(?:\*\*)?\s*$', re.IGNORECASE
+)
+# "**You:**", "**ChatGPT**: text on the same line"
+MARKDOWN_LABEL_PATTERN = re.compile(
+    rf'^\*\*(?P<name>{_MARKDOWN_NAMES})\s*:?\s*\*\*\s*:?\s*(?P<rest>.*)$', re.IGNORECASE
+)
+MARKDOWN_RULE_PATTERN = re.compile(r'^(?:-{3,}|\*{3,}|_{3,})$')
+
+
+def _match_markdown_marker(line_stripped: str) -> Optional[Tuple[str, str]]:
+    match = MARKDOWN_HEADING_PATTERN.match(line_stripped)
+    if match:
+        return MARKDOWN_SPEAKERS[match.group("name").lower()], ""
+    match = MARKDOWN_LABEL_PATTERN.match(line_stripped)
+    if match:
+        return MARKDOWN_SPEAKERS[match.group("name").lower()], match.group("rest").strip()
+    return None
+
+
+def parse_markdown_transcript(stream: IO[str]) -> Tuple[Dict[str, str], List[Dict]]:
+    """
+    Parse a Markdown export with heading or bold-label speaker markers.
+
+    Content before the first speaker marker (e.g., a title) and horizontal
+    rules between messages are dropped; other Markdown is kept as-is in the
+    turn text.
+
+    Args:
+        stream: Text stream of the transcript
+
+    Returns:
+        Tuple of (front-matter metadata, turns)
+    """
+    metadata, content = parse_front_matter(stream.read())
+    turns = split_marked_turns(content.split('\n'), _match_markdown_marker,
+                               lambda line: bool(MARKDOWN_RULE_PATTERN.match(line)),
+                               leading_user_turn=False)
+    return metadata, turns
+
+
+def _sniff_markdown(head: bytes) -> bool:
+    _, text = parse_front_matter(head.decode('utf-8', errors='ignore'))
+    return any(_match_markdown_marker(line.strip()) for line in text.split('\n'))
+
+
+# --- Saved HTML pages ------------------------------------------------------
+
+HTML_ROLE_ATTRIBUTE = "data-message-author-role"
+HTML_SPEAKERS = {"user": "user", "assistant": "assistant"}
+
+HTML_VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "source", "track", "wbr",
+}
+HTML_BLOCK_TAGS = {
+    "address", "article", "blockquote", "dd", "div", "dl", "dt", "figcaption",
+    "figure", "footer", "h1", "h2", "h3", "h4", "h5", "h6", "header", "li",
+    "ol", "p", "pre", "section", "table", "tr", "ul",
+}
+HTML_SKIP_TAGS = {"script", "style", "template", "svg", "button"}
+
+
+class ChatHTMLParser(HTMLParser):
+    """
+    Event-based extractor for messages in a saved ChatGPT web page.
+
+    Each element carrying a data-message-author-role attribute is one
+    message. Text inside it is collected as events arrive, with block
+    elements and <br> mapped to line breaks; nothing outside messages is
+    retained. Consecutive messages from the same speaker are merged into
+    one turn.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.turns = []
+        self._speaker = None
+        self._open_tags = []
+        self._buffer = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if self._speaker is None:
+            role = dict(attrs).get(HTML_ROLE_ATTRIBUTE)
+            if role in HTML_SPEAKERS and tag not in HTML_VOID_TAGS:
+                self._speaker = HTML_SPEAKERS[role]
+                self._open_tags = [tag]
+                self._buffer = []
+            return
+
+        if tag in HTML_VOID_TAGS:
+            if tag == "br":
+                self._buffer.append('\n')
+            return
+
+        self._open_tags.append(tag)
+        if tag in HTML_SKIP_TAGS:
+            self._skip_depth += 1
+        elif tag in HTML_BLOCK_TAGS:
+            self._buffer.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if self._speaker is not None and tag == "br":
+            self._buffer.append('\n')
+
+    def handle_endtag(self, tag):
+        if self._speaker is None or tag not in self._open_tags:
+            return
+
+        # Close the tag, implicitly closing anything left open inside it
+        while self._open_tags:
+            closed = self._open_tags.pop()
+            if closed in HTML_SKIP_TAGS:
+                self._skip_depth -= 1
+            if closed == tag:
+                break
+
+        if tag in HTML_BLOCK_TAGS:
+            self._buffer.append('\n')
+        if not self._open_tags:
+            self._finish_message()
+
+    def handle_data(self, data):
+        if self._speaker is not None and self._skip_depth == 0:
+            self._buffer.append(data)
+
+    def close(self):
+        super().close()
+        if self._speaker is not None:
+            self._finish_message()
+
+    def _finish_message(self):
+        lines = (' '.join(line.split()) for line in ''.join(self._buffer).split('\n'))
+        text = '\n'.join(line for line in lines if line)
+
+        if text:
+            if self.turns and self.turns[-1]["speaker"] == self._speaker:
+                self.turns[-1]["text"] += '\n' + text
+            else:
+                self.turns.append({
+                    "speaker": self._speaker,
+                    "text": text,
+                    "turn_index": len(self.turns)
+                })
+
+        self._speaker = None
+        self._open_tags = []
+        self._buffer = []
+        self._skip_depth = 0
+
+
+def parse_html_transcript(stream: IO[str]) -> Tuple[Dict[str, str], List[Dict]]:
+    """
+    Parse a saved ChatGPT web page incrementally.
+
+    The stream is fed to ChatHTMLParser in HTML_CHUNK_SIZE pieces, so
+    memory use does not grow with page size beyond the extracted text.
+
+    Args:
+        stream: Text stream of the HTML page
+
+    Returns:
+        Tuple of (empty metadata, turns)
+    """
+    parser = ChatHTMLParser()
+    while True:
+        chunk = stream.read(HTML_CHUNK_SIZE)
+        if not chunk:
+            break
+        parser.feed(chunk)
+    parser.close()
+    return {}, parser.turns
+
+
+def _sniff_html(head: bytes) -> bool:
+    # Only a document that starts with the markup; text merely quoting
+    # "<html" somewhere is not a web page
+    head = head.lstrip(codecs.BOM_UTF8).lstrip().lower()
+    return head.startswith(b"<!doctype html") or head.startswith(b"<html")
+
+
+register_format("text", [".txt"], _sniff_text, parse_text_transcript)
+register_format("markdown", [".md", ".markdown"], _sniff_markdown, parse_markdown_transcript)
+register_format("html", [".html", ".htm"], _sniff_html, parse_html_transcript, first=True)
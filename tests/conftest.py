@@ -0,0 +1,32 @@
+"""Shared fixtures for the analysis tests."""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).parent.parent
+
+# The analysis modules import each other as top-level modules
+sys.path.insert(0, str(REPO_ROOT / "analysis"))
+
+
+@pytest.fixture(scope="session")
+def repo_root() -> Path:
+    return REPO_ROOT
+
+
+@pytest.fixture(scope="session")
+def conversations():
+    """Parsed conversations of the study corpus."""
+    from parse_transcripts import load_all_conversations
+
+    return load_all_conversations(str(REPO_ROOT / "data"))
+
+
+@pytest.fixture(scope="session")
+def results(conversations):
+    """AnalysisResults for the study corpus (nothing written to disk)."""
+    from run_analysis import AnalysisResults
+
+    return AnalysisResults(str(REPO_ROOT), conversations=conversations)
@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+import pytest
+
+from approximate import approximate_analysis, wilson_interval
+
+
+def test_census_matches_exact_statistics(repo_root, results):
+    estimate = approximate_analysis(str(repo_root), precision=1e-6, initial_per_condition=5, seed=3)
+    first = results.stats["first_attempts"]
+
+    for condition in ["control", "contaminated"]:
+        assert estimate[condition]["threads_sampled"] == estimate[condition]["threads_total"]
+        assert estimate[condition]["refusals_sampled"] == first[condition]["refusals"]
+        assert estimate[condition]["prompts_sampled"] == first[condition]["total"]
+    assert estimate["cohen_h"] == pytest.approx(first["cohen_h"])
+    assert estimate["cohen_h_lower"] <= first["cohen_h"] <= estimate["cohen_h_upper"]
+
+
+def test_sample_bounds_usually_cover_the_corpus_rates(repo_root, results):
+    first = results.stats["first_attempts"]
+    covered = []
+    for seed in range(40):
+        estimate = approximate_analysis(str(repo_root), precision=0.3, initial_per_condition=4, seed=seed)
+        for condition in ["control", "contaminated"]:
+            covered.append(estimate[condition]["rate_lower"] <= first[condition]["refusal_rate"]
+                           <= estimate[condition]["rate_upper"])
+    assert sum(covered) / len(covered) >= 0.9
+
+
+def test_wilson_interval_contains_the_rate_and_shrinks():
+    narrow = wilson_interval(0.3, 400, 0.95)
+    wide = wilson_interval(0.3, 40, 0.95)
+    assert wide[0] < narrow[0] < 0.3 < narrow[1] < wide[1]
+
+
+def test_rejects_an_empty_first_round(repo_root):
+    with pytest.raises(ValueError):
+        approximate_analysis(str(repo_root), initial_per_condition=0)
+    with pytest.raises(ValueError):
+        approximate_analysis(str(repo_root), growth=1.0)
+
+
+def test_does_not_import_the_pipeline(repo_root):
+    code = ("import sys; sys.path.insert(0, 'analysis'); import approximate; "
+            "print(sorted({'run_analysis', 'matplotlib'} & set(sys.modules)))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=repo_root, capture_output=True,
+                            text=True, check=True).stdout
+    assert output.strip() == "[]"
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from scipy.stats import false_discovery_control, fisher_exact
+
+from batch_stats import adjust_p_values, batch_2x2_tests, cohen_h_batch, fisher_exact_batch, odds_ratio_batch
+
+
+@pytest.fixture(scope="module")
+def tables():
+    rng = np.random.default_rng(1)
+    tables = rng.integers(0, 40, size=(400, 4))
+    tables[:5] = [[0, 0, 3, 4], [5, 0, 7, 0], [10, 0, 0, 30], [1, 1, 1, 1], [0, 0, 0, 0]]
+    return tables
+
+
+def test_fisher_and_odds_ratio_match_scipy(tables):
+    reference = [fisher_exact([[a, b], [c, d]]) for a, b, c, d in tables]
+
+    np.testing.assert_allclose(fisher_exact_batch(*tables.T), [p for _, p in reference], rtol=1e-9)
+    np.testing.assert_allclose(odds_ratio_batch(*tables.T), [float(r) for r, _ in reference])
+
+
+def test_cohen_h():
+    assert cohen_h_batch(1.0, 0.0) == pytest.approx(np.pi)
+    assert cohen_h_batch(0.3, 0.3) == 0.0
+
+
+def test_bh_matches_scipy_and_holm_matches_step_down():
+    rng = np.random.default_rng(2)
+    p_values = rng.uniform(0, 0.2, size=50)
+
+    np.testing.assert_allclose(adjust_p_values(p_values, "bh", None), false_discovery_control(p_values))
+
+    order = np.argsort(p_values)
+    expected = np.empty(50)
+    expected[order] = np.minimum(1.0, np.maximum.accumulate((50 - np.arange(50)) * p_values[order]))
+    np.testing.assert_allclose(adjust_p_values(p_values, "holm", None), expected)
+
+
+def test_families_are_adjusted_independently():
+    p_values = np.array([0.01, 0.04, 0.03, 0.2, np.nan])
+    groups = np.array(["x", "x", "y", "y", "y"])
+
+    adjusted = adjust_p_values(p_values, "holm", groups)
+
+    np.testing.assert_allclose(adjusted[:2], adjust_p_values(p_values[:2], "holm", None))
+    np.testing.assert_allclose(adjusted[2:4], adjust_p_values(p_values[2:4], "holm", None))
+    assert np.isnan(adjusted[4])
+
+
+def test_many_families_keep_tiny_p_values_exact():
+    rng = np.random.default_rng(3)
+    n_families = 300
+    p_values = 10.0 ** -rng.uniform(1, 40, size=(n_families, 3))
+    groups = np.repeat(np.arange(n_families), 3)
+
+    for method, reference in [("holm", None), ("bh", false_discovery_control)]:
+        adjusted = adjust_p_values(p_values.ravel(), method, groups).reshape(n_families, 3)
+        assert np.all(adjusted >= p_values)
+        for family, raw in zip(adjusted, p_values):
+            expected = adjust_p_values(raw, method, None) if reference is None else reference(raw)
+            np.testing.assert_allclose(family, expected, rtol=1e-12)
+
+    # One table per family: the adjusted p-value is the raw one
+    results = batch_2x2_tests([0, 1, 0], [30, 29, 25], [40, 38, 30], [0, 2, 1], groups=np.arange(3))
+    np.testing.assert_array_equal(results["p_holm"], results["p_value"])
+    np.testing.assert_array_equal(results["p_bh"], results["p_value"])
+
+
+def test_groups_must_be_given():
+    with pytest.raises(TypeError):
+        batch_2x2_tests([1], [2], [3], [4])
+    with pytest.raises(TypeError):
+        adjust_p_values([0.1, 0.2], "holm")
+
+
+def test_untestable_tables_are_left_out_of_corrections(tables):
+    results = batch_2x2_tests(*tables.T, groups=None)
+    untestable = np.isnan(results["odds_ratio"])
+
+    assert untestable[[0, 1, 4]].all() and not untestable[3]
+    np.testing.assert_allclose(results["p_value"][untestable], 1.0)
+    assert np.isnan(results["p_holm"][untestable]).all()
+    np.testing.assert_allclose(results["p_bh"][~untestable],
+                               false_discovery_control(results["p_value"][~untestable]))
@@ -0,0 +1,79 @@
+import shutil
+
+import pandas as pd
+import pytest
+
+from compare_runs import compare_runs, diff_table
+from factor_stats import compute_final_outcomes
+from run_analysis import build_thread_summary
+
+
+def _write_run(path, conversations, turns_df):
+    path.mkdir()
+    classified = turns_df.drop(columns=["user_text", "assistant_text"])
+    turns_df.to_csv(path / "parsed_turns.csv", index=False)
+    build_thread_summary(conversations, classified).to_csv(path / "thread_summary.csv", index=False)
+    compute_final_outcomes(classified).to_csv(path / "final_outcomes.csv", index=False)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def runs(tmp_path_factory, conversations, results):
+    root = tmp_path_factory.mktemp("runs")
+    run_a = _write_run(root / "a", conversations, results.turns_df)
+
+    turns_b = results.turns_df.copy()
+    relabeled = turns_b.index[(turns_b["thread_id"] == "control_02") & (turns_b["prompt_id"] == "I1_KITCHEN")]
+    turns_b.loc[relabeled, "response_class"] = "policy_refusal"
+    turns_b = turns_b[turns_b["thread_id"] != "contaminated_30"]
+    conversations_b = [conv for conv in conversations if conv["thread_id"] != "contaminated_30"]
+    run_b = _write_run(root / "b", conversations_b, turns_b)
+    return run_a, run_b, len(relabeled)
+
+
+def test_changes_and_statistics(runs, results):
+    run_a, run_b, n_relabeled = runs
+    comparison = compare_runs(run_a, run_b)
+
+    turns = comparison["changes"]["parsed_turns"]
+    assert turns["changed"] == n_relabeled
+    assert turns["removed"] == (results.turns_df["thread_id"] == "contaminated_30").sum()
+    assert turns["added"] == 0
+    assert comparison["changes"]["thread_summary"]["removed"] == 1
+    assert comparison["stats_a"]["first_attempts"]["p_value"] == \
+        pytest.approx(results.stats["first_attempts"]["p_value"])
+    assert comparison["stats_b"]["first_attempts"]["control"]["refusals"] == 1
+
+
+def test_partitioned_join_matches_in_memory_join(runs, tmp_path):
+    run_a, run_b, _ = runs
+    direct = compare_runs(run_a, run_b, output_dir=str(tmp_path / "direct"))
+    partitioned = compare_runs(run_a, run_b, memory_budget_mb=0.05, chunk_rows=50,
+                               output_dir=str(tmp_path / "partitioned"))
+
+    assert partitioned["n_partitions"] > 1
+    for table in direct["changes"]:
+        for change in ["changed", "added", "removed"]:
+            assert partitioned["changes"][table][change] == direct["changes"][table][change]
+        key = sorted(pd.read_csv(tmp_path / "direct" / f"{table}_changes.csv").astype(str).values.tolist())
+        assert sorted(pd.read_csv(tmp_path / "partitioned" / f"{table}_changes.csv")
+                      .astype(str).values.tolist()) == key
+    assert partitioned["stats_b"] == direct["stats_b"]
+
+
+def test_missing_final_outcomes_are_derived(runs, tmp_path):
+    run_a, run_b, _ = runs
+    copy = tmp_path / "b"
+    shutil.copytree(run_b, copy)
+    (copy / "final_outcomes.csv").unlink()
+    derived = compare_runs(run_a, str(copy))["changes"]["final_outcomes"]
+    written = compare_runs(run_a, run_b)["changes"]["final_outcomes"]
+    assert [derived[change] for change in ["changed", "added", "removed"]] == \
+        [written[change] for change in ["changed", "added", "removed"]]
+
+
+def test_diff_table_labels_changes():
+    a = pd.DataFrame({"k": ["1", "2", "3"], "v": ["x", "y", "z"]})
+    b = pd.DataFrame({"k": ["2", "3", "4"], "v": ["y", "Z", "w"]})
+    diff = diff_table(a, b, ["k"], ["v"]).set_index("k")
+    assert diff["change"].to_dict() == {"1": "removed", "3": "changed", "4": "added"}
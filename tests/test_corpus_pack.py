@@ -0,0 +1,75 @@
+import shutil
+
+import pytest
+
+from corpus_pack import PACK_HEADER, PackedCorpus, load_packed_conversations, locate_turns, pack_corpus
+from parse_transcripts import load_all_conversations
+
+
+@pytest.fixture(scope="module")
+def pack_path(repo_root, tmp_path_factory):
+    path = tmp_path_factory.mktemp("pack") / "corpus.pack"
+    pack_corpus(str(repo_root / "data"), str(path))
+    return path
+
+
+def test_pack_round_trips_the_directory(pack_path, conversations):
+    assert load_packed_conversations(str(pack_path)) == conversations
+
+
+def test_pack_without_turn_boundaries_round_trips(repo_root, tmp_path, conversations):
+    path = tmp_path / "corpus.pack"
+    pack_corpus(str(repo_root / "data"), str(path), turn_boundaries=False)
+    with PackedCorpus(str(path)) as corpus:
+        assert not any("turns" in entry for entry in corpus.index)
+        assert corpus.load_all() == conversations
+
+
+def test_random_access_and_verification(pack_path, conversations):
+    with PackedCorpus(str(pack_path)) as corpus:
+        assert len(corpus) == 40
+        assert corpus.get("contaminated_07") == next(c for c in conversations
+                                                     if c["thread_id"] == "contaminated_07")
+        assert [c["thread_id"] for c in corpus.load_all("control")] == \
+            [c["thread_id"] for c in conversations if c["condition"] == "control"]
+        assert corpus.verify() == []
+
+
+def test_verify_reports_corrupted_threads(pack_path, tmp_path):
+    path = tmp_path / "corpus.pack"
+    shutil.copy(pack_path, path)
+    with PackedCorpus(str(path)) as corpus:
+        offset = corpus.entry("control_03")["offset"]
+    data = bytearray(path.read_bytes())
+    data[offset] ^= 0x20
+    path.write_bytes(bytes(data))
+
+    with PackedCorpus(str(path)) as corpus:
+        assert corpus.verify() == ["control_03"]
+
+
+def test_text_turns_located_as_byte_ranges():
+    raw = "You said:\nline one\nline two\nChatGPT said:\nreply\n".encode()
+    turns = [{"speaker": "user", "text": "line one\nline two"}, {"speaker": "assistant", "text": "reply"}]
+    assert locate_turns(raw, turns) == [["user", [10, 27]], ["assistant", [42, 47]]]
+    assert locate_turns(raw, [{"speaker": "user", "text": "not in the file"}]) is None
+
+
+@pytest.mark.parametrize("tail", [b"", b"{not json"])
+def test_bad_files_raise_and_release_the_file(tmp_path, monkeypatch, tail):
+    path = tmp_path / "bad.pack"
+    index_at = PACK_HEADER.size
+    path.write_bytes(PACK_HEADER.pack(b"VSCORPUS", 1, index_at, len(tail)) + tail if tail else b"")
+
+    opened = []
+    real_open = open
+
+    def tracking_open(*args, **kwargs):
+        handle = real_open(*args, **kwargs)
+        opened.append(handle)
+        return handle
+
+    monkeypatch.setattr("builtins.open", tracking_open)
+    with pytest.raises(ValueError):
+        PackedCorpus(str(path))
+    assert opened and all(handle.closed for handle in opened)
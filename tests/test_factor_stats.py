@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import false_discovery_control
+
+from factor_stats import ALL_IMAGE_PROMPTS, compute_factor_stats
+
+
+def _outcomes(rows):
+    """final_outcomes frame from (thread_id, condition, prompt_id, refused) rows."""
+    return pd.DataFrame(rows, columns=["thread_id", "condition", "prompt_id", "refused"])
+
+
+def _holm(p_values):
+    """Reference Holm step-down adjustment."""
+    p_values = np.asarray(p_values)
+    order = np.argsort(p_values)
+    m = len(p_values)
+    adjusted = np.maximum.accumulate([(m - k) * p_values[i] for k, i in enumerate(order)])
+    result = np.empty(m)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+
+def _corpus():
+    rows = []
+    metadata = []
+    for i in range(12):
+        condition = "contaminated" if i % 2 else "control"
+        model = ["a", "b", "c"][i % 3]
+        metadata.append({"thread_id": f"t{i}", "condition": condition, "model": model})
+        for j, prompt in enumerate(["I1_KITCHEN", "I2_BEDROOM"]):
+            refused = condition == "contaminated" and (i + j) % 4 != 0
+            rows.append((f"t{i}", condition, prompt, refused))
+    return _outcomes(rows), pd.DataFrame(metadata)
+
+
+def test_corrections_are_applied_within_factor_and_prompt_families():
+    outcomes, metadata = _corpus()
+    stats = compute_factor_stats(outcomes, metadata)
+
+    for prompt in ["I1_KITCHEN", ALL_IMAGE_PROMPTS]:
+        family = stats[(stats["prompt_id"] == prompt) & stats["model"].notna()]
+        tested = family[family["p_holm"].notna()]
+        assert len(tested) == 3
+        np.testing.assert_allclose(tested["p_holm"], _holm(tested["p_value"]))
+        np.testing.assert_allclose(tested["p_bh"], false_discovery_control(tested["p_value"]))
+
+    # A corpus-wide table is a family of one
+    overall = stats[(stats["prompt_id"] == "I1_KITCHEN") & stats["model"].isna()].iloc[0]
+    assert overall["p_holm"] == pytest.approx(overall["p_value"])
+
+
+def test_untestable_tables_are_not_adjusted():
+    outcomes = _outcomes([
+        ("c1", "control", "I1_KITCHEN", False),
+        ("x1", "contaminated", "I1_KITCHEN", True),
+        ("x1", "contaminated", "T1_MORTGAGE", False),
+        ("c1", "control", "I2_BEDROOM", False),
+        ("x1", "contaminated", "I2_BEDROOM", False),
+    ])
+    stats = compute_factor_stats(outcomes).set_index("prompt_id")
+
+    # T1 has no control threads; I2 has no refusals in either condition
+    assert stats.loc["T1_MORTGAGE", "p_value"] == 1.0
+    assert np.isnan(stats.loc["T1_MORTGAGE", "p_holm"])
+    assert np.isnan(stats.loc["I2_BEDROOM", "p_bh"])
+    assert stats.loc["I1_KITCHEN", "p_holm"] == pytest.approx(stats.loc["I1_KITCHEN", "p_value"])
@@ -0,0 +1,84 @@
+import pandas as pd
+import pytest
+
+from factor_stats import IMAGE_PROMPTS, compute_factor_stats
+from figure_sets import MANIFEST_FILENAME, _slug, build_figure_specs, render_figure_sets
+
+MODELS = ["gpt-4o", "gpt 4o", "gpt-5", "ALL", "a_date-b", "a"]
+
+
+def _corpus():
+    """final_outcomes and metadata with model levels that slug alike or look like a marginal."""
+    rows = []
+    metadata = []
+    for i in range(4 * len(MODELS)):
+        condition = "contaminated" if i % 2 else "control"
+        thread_id = f"{condition}_{i:02d}"
+        metadata.append({"thread_id": thread_id, "condition": condition, "model": MODELS[(i // 2) % len(MODELS)],
+                         "date": "b"})
+        for prompt in IMAGE_PROMPTS:
+            refused = condition == "contaminated"
+            rows.append((thread_id, condition, prompt, refused,
+                         "policy_refusal" if refused else "image_success"))
+    outcomes = pd.DataFrame(rows, columns=["thread_id", "condition", "prompt_id", "refused", "response_class"])
+    return outcomes, pd.DataFrame(metadata)
+
+
+def test_slug_is_injective():
+    labels = ["gpt-4o", "gpt 4o", "gpt/4o", "gpt--4o", "gpt.4o", "", "blank", "ALL", "a_date-b"]
+    slugs = [_slug(label) for label in labels]
+    assert len(set(slugs)) == len(labels)
+    assert _slug("gpt.4o") == "gpt.4o" and _slug("ALL") == "ALL"
+    # Name separators never appear inside a slug
+    assert all(set(slug) <= set("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789.")
+               for slug in slugs)
+
+
+def test_figure_names_are_unique_for_colliding_levels():
+    outcomes, metadata = _corpus()
+    stats = compute_factor_stats(outcomes, metadata)
+    specs = build_figure_specs(stats, outcomes, metadata)
+
+    names = [spec.name for spec in specs]
+    assert len(set(names)) == len(names)
+    # A real "ALL" level is a figure of its own, not the corpus-wide one
+    assert "rates_I1_KITCHEN" in names
+    assert "rates_I1_KITCHEN_model-ALL" in names
+    # model = "a_date-b" with date marginalized vs model = a, date = b
+    assert "rates_I1_KITCHEN_model-a_date-b" in names
+    assert "rates_I1_KITCHEN_model-" + _slug("a_date-b") in names
+    kitchen = [name for name in names if name.startswith("rates_I1_KITCHEN")]
+    assert len(kitchen) == 2 * len(MODELS) + 2
+
+
+def test_rendering_is_deterministic_and_incremental(tmp_path):
+    outcomes, metadata = _corpus()
+    specs = build_figure_specs(compute_factor_stats(outcomes, metadata), outcomes)
+    specs = [spec for spec in specs if spec.name in ("rates_I1_KITCHEN", "prompts_control", "outcomes_control")]
+    assert len(specs) == 3
+
+    first = render_figure_sets(specs, tmp_path / "a", formats=("png", "svg"), dpi=30, max_workers=1)
+    second = render_figure_sets(specs, tmp_path / "b", formats=("png", "svg"), dpi=30, max_workers=1)
+    assert sorted(first["rendered"]) == sorted(second["rendered"]) == sorted(spec.name for spec in specs)
+    for spec in specs:
+        for fmt in ("png", "svg"):
+            assert (tmp_path / "a" / f"{spec.name}.{fmt}").read_bytes() == \
+                (tmp_path / "b" / f"{spec.name}.{fmt}").read_bytes()
+
+    again = render_figure_sets(specs, tmp_path / "a", formats=("png", "svg"), dpi=30, max_workers=1)
+    assert again["rendered"] == [] and sorted(again["skipped"]) == sorted(first["rendered"])
+
+    changed = specs[0]._replace(data={**specs[0].data, "title": "Changed"})
+    update = render_figure_sets([changed, specs[1]], tmp_path / "a", formats=("png", "svg"), dpi=30,
+                                max_workers=1)
+    assert update["rendered"] == [changed.name]
+    assert update["removed"] == [specs[2].name]
+    assert not (tmp_path / "a" / f"{specs[2].name}.png").exists()
+    assert (tmp_path / "a" / MANIFEST_FILENAME).exists()
+
+
+def test_duplicate_names_are_rejected(tmp_path):
+    outcomes, metadata = _corpus()
+    spec = build_figure_specs(compute_factor_stats(outcomes, metadata), outcomes)[0]
+    with pytest.raises(ValueError):
+        render_figure_sets([spec, spec], tmp_path, max_workers=1)
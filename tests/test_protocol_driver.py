@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from classify_responses import identify_prompt_id
+from parse_transcripts import parse_single_transcript
+from protocol_driver import (PROTOCOL_PROMPTS, PROTOCOL_SEQUENCES, UNDOCUMENTED_PROMPTS,
+                             BackendRateLimited, ChatBackend, MockBackend, ProtocolDriver,
+                             collect_sessions)
+
+
+def _prompt_sequence(conversation):
+    return [identify_prompt_id(turn["text"]) for turn in conversation["turns"] if turn["speaker"] == "user"]
+
+
+def test_chat_backend_is_abstract():
+    with pytest.raises(TypeError):
+        ChatBackend()
+
+    class NoReply(ChatBackend):
+        pass
+
+    with pytest.raises(TypeError):
+        NoReply()
+
+
+def test_documented_prompts_are_verbatim(repo_root):
+    instructions = (repo_root / "misc" / "replication_instructions.md").read_text(encoding="utf-8")
+    for prompt_id, text in PROTOCOL_PROMPTS.items():
+        assert identify_prompt_id(text) == prompt_id
+        if prompt_id in UNDOCUMENTED_PROMPTS:
+            assert text not in instructions
+        else:
+            assert text in instructions, prompt_id
+
+
+def test_collected_transcripts_round_trip(tmp_path):
+    backend = MockBackend(seed=1, persistence=1.0, rate_limit_rate=0.0, latency=0.0)
+    conversations = collect_sessions([backend], str(tmp_path), n_control=2, n_contaminated=3)
+
+    assert [conv["thread_id"] for conv in conversations] == [
+        "control_01", "control_02", "contaminated_01", "contaminated_02", "contaminated_03"]
+    for conv in conversations:
+        condition = conv["thread_id"].split("_")[0]
+        assert _prompt_sequence(conv) == PROTOCOL_SEQUENCES[condition]
+
+        parsed = parse_single_transcript(str(tmp_path / "transcripts" / condition / f"{conv['thread_id']}.txt"))
+        assert [(t["speaker"], t["text"]) for t in parsed["turns"]] == \
+            [(t["speaker"], t["text"]) for t in conv["turns"]]
+
+    contaminated = [turn["text"] for turn in conversations[2]["turns"] if turn["speaker"] == "assistant"]
+    assert contaminated[2:6] == [MockBackend.POLICY_REFUSAL] * 4
+    control = [turn["text"] for turn in conversations[0]["turns"] if turn["speaker"] == "assistant"]
+    assert control[:4] == [MockBackend.IMAGE_SUCCESS] * 4
+
+
+def test_rate_limit_replies_are_kept_and_retried(tmp_path):
+    backend = MockBackend(seed=3, rate_limit_rate=0.5, latency=0.0)
+    driver = ProtocolDriver([backend], str(tmp_path), max_retries=2)
+    conversations = asyncio.run(driver.run(n_control=4, n_contaminated=4))
+
+    retries = sum(len(_prompt_sequence(conv)) - len(PROTOCOL_SEQUENCES[conv["thread_id"].split("_")[0]])
+                  for conv in conversations)
+    assert driver.rate_limit_retries == retries > 0
+    for conv in conversations:
+        sequence = _prompt_sequence(conv)
+        # Retries repeat the same prompt, so the distinct prompts keep protocol order
+        deduplicated = [p for i, p in enumerate(sequence) if i == 0 or p != sequence[i - 1]]
+        assert deduplicated == PROTOCOL_SEQUENCES[conv["thread_id"].split("_")[0]]
+
+
+def test_sessions_are_deterministic(tmp_path):
+    def collect(path, concurrency):
+        backend = MockBackend(seed=7, persistence=0.6, rate_limit_rate=0.2, latency=0.001)
+        return collect_sessions([backend], str(path), 3, 3, max_concurrency=concurrency)
+
+    serial = collect(tmp_path / "serial", 1)
+    concurrent = collect(tmp_path / "concurrent", 6)
+    assert [conv["turns"] for conv in serial] == [conv["turns"] for conv in concurrent]
+
+
+def test_persistent_throttling_raises(tmp_path):
+    class AlwaysThrottled(ChatBackend):
+        async def reply(self, session_id, history):
+            raise BackendRateLimited(retry_after=0.0)
+
+    driver = ProtocolDriver([AlwaysThrottled()], str(tmp_path), max_throttle_retries=3)
+    with pytest.raises(BackendRateLimited):
+        asyncio.run(asyncio.wait_for(driver.run(n_control=1, n_contaminated=0), timeout=10))
+    assert driver.throttled == 3
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from classify_responses import DEFAULT_RULES, classify_response
+from rule_index import RuleIndex, changed_phrases
+
+PROPOSED_RULES = {
+    **DEFAULT_RULES,
+    "policy": DEFAULT_RULES["policy"][1:] + ["i can't help with"],
+    "success": DEFAULT_RULES["success"] + ["here is"],
+}
+
+
+@pytest.fixture()
+def index(conversations, results):
+    return RuleIndex.build(conversations, results.turns_df)
+
+
+def test_phrase_lookup_matches_a_scan(index, results):
+    texts = results.turns_df["assistant_text"].str.lower()
+    for phrase in ["image created", "content polic", "i", "no such phrase anywhere"]:
+        expected = np.flatnonzero(texts.str.contains(phrase, regex=False).to_numpy())
+        np.testing.assert_array_equal(index.turns_containing(phrase), expected)
+
+
+def test_incremental_update_equals_full_reclassification(index, results, tmp_path):
+    index.save(str(tmp_path / "index"))
+    loaded = RuleIndex.load(str(tmp_path / "index"))
+
+    read_rows = []
+    text = loaded.text
+    loaded.text = lambda row: read_rows.append(row) or text(row)
+    change = loaded.apply_rules(PROPOSED_RULES)
+
+    full = [classify_response(prompt_id, text, PROPOSED_RULES).value
+            for prompt_id, text in zip(results.turns_df["prompt_id"], results.turns_df["assistant_text"])]
+    assert loaded.turns["response_class"].tolist() == full
+    assert change["n_reclassified"] < len(full)
+    assert set(read_rows) < set(range(len(full)))
+    assert change["changed_phrases"] == sorted(changed_phrases(DEFAULT_RULES, PROPOSED_RULES))
+
+
+def test_labels_only_save_keeps_texts_and_postings(index, tmp_path):
+    path = tmp_path / "index"
+    index.save(str(path))
+    texts_before = (path / "texts.bin").stat().st_mtime_ns
+
+    loaded = RuleIndex.load(str(path))
+    loaded.apply_rules(PROPOSED_RULES)
+    loaded.save(str(path), labels_only=True)
+
+    reloaded = RuleIndex.load(str(path))
+    assert (path / "texts.bin").stat().st_mtime_ns == texts_before
+    assert reloaded.rules == PROPOSED_RULES
+    pd.testing.assert_frame_equal(reloaded.turns, loaded.turns)
+    assert reloaded.text(3) == index.text(3)
+
+
+def test_single_file_index_must_be_rebuilt(tmp_path):
+    old_index = tmp_path / "rule_index.json"
+    old_index.write_text("{}")
+    with pytest.raises(ValueError, match="rebuild"):
+        RuleIndex.load(str(old_index))
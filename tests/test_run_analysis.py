@@ -0,0 +1,36 @@
+import re
+import subprocess
+import sys
+
+from run_analysis import AnalysisResults, analyze_conversations
+
+
+def test_primary_result(results):
+    first = results.stats["first_attempts"]
+    assert (first["control"]["refusals"], first["control"]["total"]) == (0, 40)
+    assert (first["contaminated"]["refusals"], first["contaminated"]["total"]) == (116, 120)
+    assert first["p_value"] < 1e-30
+
+
+def test_results_are_lazy(conversations, repo_root):
+    results = AnalysisResults(str(repo_root), conversations=conversations)
+    results.stats
+    assert "figures" not in results.__dict__
+    assert "turns_df" not in results.__dict__
+
+
+def test_steps_are_logged_without_writing_files(repo_root, tmp_path, capsys):
+    (tmp_path / "data").symlink_to(repo_root / "data")
+    analyze_conversations(str(tmp_path), write_files=False)
+
+    steps = re.findall(r"^Step (\d+):", capsys.readouterr().out, flags=re.MULTILINE)
+    assert steps == [str(i) for i in range(1, 8)]
+    assert not (tmp_path / "analysis").exists()
+
+
+def test_optional_features_are_not_imported(repo_root):
+    code = ("import sys; sys.path.insert(0, 'analysis'); import run_analysis; "
+            "print(sorted({'corpus_pack', 'sequence_features'} & set(sys.modules)))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=repo_root, capture_output=True,
+                            text=True, check=True).stdout
+    assert output.strip() == "[]"
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+from classify_responses import ResponseClass
+from sequence_features import (
+    RESPONSE_CODES,
+    build_sequence_tensors,
+    hazard_curve,
+    prompt_mask,
+    rate_by_position,
+    response_mask,
+    transition_matrix
+)
+
+SUCCESS = ResponseClass.IMAGE_SUCCESS.value
+POLICY = ResponseClass.POLICY_REFUSAL.value
+RATE_LIMIT = ResponseClass.RATE_LIMIT.value
+OTHER = ResponseClass.OTHER.value
+
+
+def _turns(rows):
+    """Classified turns from (thread_id, condition, prompt_id, response_class) rows in order."""
+    frame = pd.DataFrame(rows, columns=["thread_id", "condition", "prompt_id", "response_class"])
+    frame["user_turn_index"] = frame.groupby("thread_id").cumcount() * 2
+    return frame
+
+
+def test_positions_trigger_distance_and_attempts():
+    tensors = build_sequence_tensors(_turns([
+        ("x1", "contaminated", "TRIGGER", POLICY),
+        ("x1", "contaminated", "I1_KITCHEN", RATE_LIMIT),
+        ("x1", "contaminated", "I1_KITCHEN", POLICY),
+        ("x1", "contaminated", None, OTHER),
+        ("x1", "contaminated", None, OTHER),
+        ("c1", "control", "I1_KITCHEN", SUCCESS),
+    ]))
+
+    np.testing.assert_array_equal(tensors.offsets, [0, 5, 6])
+    np.testing.assert_array_equal(tensors.trigger_distance, [-1, 1, 2, 3, 4, -1])
+    # Unrecognized prompts are not numbered as retries of each other
+    np.testing.assert_array_equal(tensors.attempt, [1, 1, 2, 0, 0, 1])
+
+    counts = transition_matrix(tensors, same_prompt=True, normalize=False)
+    assert counts.sum() == 1
+    assert counts[RESPONSE_CODES.index(RATE_LIMIT), RESPONSE_CODES.index(POLICY)] == 1
+
+
+def test_rates_and_hazard_match_a_direct_count(results):
+    tensors = results.sequence_tensors
+    refused = response_mask(tensors, [POLICY])
+    image = prompt_mask(tensors, ["I1_KITCHEN", "I2_BEDROOM", "I3_ABSTRACT", "I4_COFFEE"])
+
+    rate, n_events, n_exchanges = rate_by_position(tensors.position, refused, mask=image)
+    assert n_exchanges.sum() == image.sum()
+    assert n_events.sum() == (refused & image).sum()
+
+    success = response_mask(tensors, [SUCCESS])
+    hazard, events, at_risk = hazard_curve(tensors, tensors.position, success, mask=image)
+    threads_with_success = len(set(tensors.thread_index[success & image]))
+    assert events.sum() == threads_with_success
+    assert at_risk[0] == len(set(tensors.thread_index[image & (tensors.position == 0)]))
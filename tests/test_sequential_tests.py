@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sequential_tests import (SequentialDesign, SequentialMonitor, SpendingBoundary, achieved_alpha,
+                              design_effect, format_monitor_report, monitor_threads, spent_alpha,
+                              thread_outcome_counts)
+
+
+def test_spent_alpha_reaches_alpha():
+    for spending in ("obrien_fleming", "pocock"):
+        spent = spent_alpha([0.0, 0.25, 0.5, 1.0], 0.05, spending)
+        assert spent[0] == 0
+        assert np.all(np.diff(spent) > 0)
+        assert spent[-1] == pytest.approx(0.05)
+    with pytest.raises(ValueError):
+        spent_alpha(0.5, 0.05, "linear")
+
+
+def test_single_look_boundary_is_fixed_sample_critical_value():
+    boundary = SpendingBoundary(alpha=0.05, n_simulations=400_000).next(1.0)
+    assert boundary == pytest.approx(1.96, abs=0.02)
+
+
+def test_design_effect_of_clustered_threads():
+    # Two threads refusing everything, two refusing nothing: fully clustered
+    n_i, r_i = np.array([4, 4, 4, 4]), np.array([4, 4, 0, 0])
+    deff = design_effect(4, n_i.sum(), r_i.sum(), (n_i * n_i).sum(), (r_i * n_i).sum(), (r_i * r_i).sum())
+    assert deff > 4
+    assert design_effect(1, 4, 2, 16, 8, 4) == 1.0
+
+
+def test_achieved_alpha_at_small_clustered_design():
+    # 10 + 30 threads with refusals correlated within threads (ICC 0.2): the
+    # estimated design effect alone gives a type I error of about 0.07
+    design = SequentialDesign(10, 30, alpha=0.05, icc=0.2, n_simulations=100_000)
+    alpha = achieved_alpha(design, n_trials=20_000)
+    # Monte Carlo standard error is about 0.0015 at 20,000 trials
+    assert alpha <= 0.05 + 0.005
+
+
+def test_monitor_stops_on_clear_effect(results):
+    counts = thread_outcome_counts(results.final_outcomes)
+    control = counts[counts["condition"] == "control"]
+    contaminated = counts[counts["condition"] == "contaminated"]
+    arrivals = pd.concat([pd.concat([control.iloc[[i]], contaminated.iloc[[i]]]) for i in range(len(control))])
+
+    design = SequentialDesign(len(control), len(contaminated))
+    looks = monitor_threads(arrivals, design)
+    assert looks["conclusive"].iloc[-1]
+    assert not looks["conclusive"].iloc[:-1].any()
+    assert looks["threads_control"].iloc[-1] < len(control)
+    assert "collection can stop" in format_monitor_report(looks, design, 0.04)
+
+
+def test_monitor_ignores_looks_without_both_conditions():
+    monitor = SequentialMonitor(SequentialDesign(10, 10))
+    assert monitor.update("contaminated", 4, 4) is None
+    assert monitor.update("contaminated", 4, 4) is None
+    assert monitor.update("control", 4, 0) is None
+    look = monitor.update("control", 4, 0)
+    assert look["look"] == 1 and look["z"] > 0 and not monitor.stopped
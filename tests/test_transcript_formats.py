@@ -0,0 +1,87 @@
+import io
+import warnings
+
+import pytest
+
+from parse_transcripts import parse_single_transcript
+from transcript_formats import detect_format, get_format, sniff_format
+
+TEXT_TRANSCRIPT = """You said:
+How do I embed a page? It starts with <html> and a <body>.
+ChatGPT said:
+Put the markup in an <html> file.
+"""
+
+MARKDOWN_TRANSCRIPT = """# Chat
+
+## You
+Draw a kitchen.
+
+## ChatGPT
+Here is your kitchen.
+"""
+
+HTML_TRANSCRIPT = """\ufeff  <!DOCTYPE html><html><body>
+<div data-message-author-role="user"><p>Draw a kitchen.</p></div>
+<div data-message-author-role="assistant"><p>Here is <b>your</b> kitchen.</p></div>
+</body></html>"""
+
+
+def _write(path, content):
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_txt_quoting_html_is_parsed_as_text(tmp_path):
+    conv = parse_single_transcript(_write(tmp_path / "control_01.txt", TEXT_TRANSCRIPT))
+
+    assert conv["format"] == "text"
+    assert [turn["speaker"] for turn in conv["turns"]] == ["user", "assistant"]
+
+
+def test_format_follows_extension_before_content():
+    head = TEXT_TRANSCRIPT.encode()
+    assert detect_format(head, ".txt").name == "text"
+    assert detect_format(HTML_TRANSCRIPT.encode(), ".TXT").name == "text"
+    assert detect_format(head, ".htm").name == "html"
+    assert detect_format(head, ".md").name == "markdown"
+
+
+def test_sniffing_requires_markup_at_document_start():
+    assert sniff_format(HTML_TRANSCRIPT.encode("utf-8")).name == "html"
+    assert sniff_format(TEXT_TRANSCRIPT.encode()).name == "text"
+    assert sniff_format(b'Notes\n<div data-message-author-role="user">').name == "text"
+    assert detect_format(MARKDOWN_TRANSCRIPT.encode(), ".log").name == "markdown"
+
+
+@pytest.mark.parametrize("name, content, expected", [
+    ("contaminated_01.md", MARKDOWN_TRANSCRIPT, [("user", "Draw a kitchen."), ("assistant", "Here is your kitchen.")]),
+    ("contaminated_01.html", HTML_TRANSCRIPT, [("user", "Draw a kitchen."), ("assistant", "Here is your kitchen.")]),
+])
+def test_markdown_and_html_parse_to_the_same_turns(tmp_path, name, content, expected):
+    conv = parse_single_transcript(_write(tmp_path / name, content))
+    assert [(turn["speaker"], turn["text"]) for turn in conv["turns"]] == expected
+
+
+def test_html_parser_streams_in_chunks(monkeypatch):
+    import transcript_formats
+
+    monkeypatch.setattr(transcript_formats, "HTML_CHUNK_SIZE", 7)
+    _, turns = get_format("html").parse(io.StringIO(HTML_TRANSCRIPT))
+    assert [turn["text"] for turn in turns] == ["Draw a kitchen.", "Here is your kitchen."]
+
+
+def test_transcript_without_turns_warns(tmp_path):
+    path = _write(tmp_path / "control_02.html", "<html><body><p>Nothing here</p></body></html>")
+    with pytest.warns(UserWarning, match="control_02: no turns"):
+        parse_single_transcript(path)
+
+
+def test_study_corpus_parses_without_warnings(repo_root):
+    from parse_transcripts import load_all_conversations
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        conversations = load_all_conversations(str(repo_root / "data"))
+    assert len(conversations) == 40
+    assert all(conv["format"] == "text" for conv in conversations)